@@ -0,0 +1,95 @@
+#!python3
+"""
+Rules deciding which printer alerts are reported.
+
+ignore_list in config.py is a regex of alerts ignored on every printer.
+alert_rules in config.py adds rules for some printers or models only:
+
+    alert_rules = [('exclude', 'example_printer1', 'toner low'),
+                   ('include', 'LaserJet 4250', 'energy saver mode')]
+
+Each rule is (action, printer, alert). printer is a regex searched for in
+the printer name and model, '' for all printers, and alert is a regex
+searched for in the lowercased alert description. An alert is ignored if an
+exclude rule matches it and no include rule does.
+
+The patterns which apply to a printer are compiled into one regex for the
+excludes and one for the includes the first time the printer is seen, so
+every alert is classified with at most two searches, however many rules there are.
+"""
+__all__ = ['AlertRules', 'get_rules']
+import re
+
+import config as cfg
+
+
+class AlertRules:
+    """
+    Args:
+        ignore(str): regex of alerts ignored on all printers, e.g cfg.ignore_list
+        rules(list): (action, printer, alert) tuples, action is 'include' or 'exclude'
+
+    Example:
+        rules = AlertRules(cfg.ignore_list)
+        rules.filter(alerts, 'example_printer1.printer.example.com')
+    """
+
+    def __init__(self, ignore=None, rules=()):
+        self.rules = [('exclude', '', ignore)] if ignore else []
+        for action, printer, alert in rules:
+            if action not in ('include', 'exclude'):
+                raise ValueError('Unknown alert rule action %s' % action)
+            self.rules.append((action, printer, alert))
+        #(printer, model) -> (include, exclude) compiled regexes, None if there are no rules
+        self._compiled = {}
+
+    def _patterns(self, printer, model):
+        key = (printer, model)
+        if key not in self._compiled:
+            patterns = {'include': [], 'exclude': []}
+            for action, target, alert in self.rules:
+                if not target or re.search(target, printer) or re.search(target, model):
+                    patterns[action].append('(?:%s)' % alert)
+            self._compiled[key] = tuple(re.compile('|'.join(patterns[action])) if patterns[action]
+                                        else None for action in ('include', 'exclude'))
+        return self._compiled[key]
+
+    def ignored(self, descriptions, printer='', model=''):
+        """
+        Classifies a batch of alert descriptions of one printer
+
+        Returns:
+            ignored(list): True for each description which should not be reported
+        """
+        include, exclude = self._patterns(printer, model)
+        if exclude is None:
+            return [False]*len(descriptions)
+        descriptions = [description.lower() for description in descriptions]
+        if include is None:
+            return [exclude.search(description) is not None for description in descriptions]
+        return [exclude.search(description) is not None and include.search(description) is None
+                for description in descriptions]
+
+    def filter(self, alerts, printer='', model=''):
+        """
+        Returns the alerts of a printer which should be reported. alerts is a
+        list of records with a description attribute, e.g printer_mibs.Alert.
+        """
+        ignored = self.ignored([alert.description for alert in alerts], printer, model)
+        return [alert for alert, ignore in zip(alerts, ignored) if not ignore]
+
+#AlertRules made by get_rules, keyed by the ignore regex and rules they were made from
+_rules = {}
+
+
+def get_rules(ignore=None):
+    """
+    Returns the AlertRules for an ignore regex and the alert_rules in
+    config.py, compiled once per process, or again if config.py has been
+    reloaded with other rules. ignore defaults to cfg.ignore_list.
+    """
+    ignore = cfg.ignore_list if ignore is None else ignore
+    rules = tuple(tuple(rule) for rule in getattr(cfg, 'alert_rules', []))
+    if (ignore, rules) not in _rules:
+        _rules[ignore, rules] = AlertRules(ignore, rules)
+    return _rules[ignore, rules]
@@ -0,0 +1,112 @@
+#!python3
+"""
+Persistent state of the alerts seen on the printers, used to only report
+alerts when they are raised or cleared instead of on every check.
+
+Alerts are keyed by (printer, prtAlertIndex) and stored with the time they
+were first and last seen. The prtAlertAllEvents counter of each printer is
+stored as well, so unchanged alert tables do not have to be walked again.
+"""
+__all__ = ['AlertStore']
+import sqlite3
+import time
+from os.path import dirname, join
+
+
+class AlertStore:
+    """
+    SQLite backed alert state.
+
+    Args:
+        path(str): database file, created if it does not exist
+
+    Example:
+        store = AlertStore()
+        raised, cleared = store.update('example_printer1.printer.example.com',
+                                       {3: 'Paper jam'}, counter=17)
+    """
+
+    def __init__(self, path=join(dirname(__file__), 'alert_state.db')):
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS alerts (
+                                   printer TEXT NOT NULL,
+                                   alert_index INTEGER NOT NULL,
+                                   description TEXT NOT NULL,
+                                   first_seen REAL NOT NULL,
+                                   last_seen REAL NOT NULL,
+                                   PRIMARY KEY (printer, alert_index))''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS counters (
+                                   printer TEXT PRIMARY KEY,
+                                   counter INTEGER)''')
+
+    def active(self, printer):
+        """
+        Returns the alerts currently raised on the printer as a dict
+        prtAlertIndex -> description
+        """
+        return dict(self.db.execute(
+            'SELECT alert_index, description FROM alerts WHERE printer = ?', (printer,)))
+
+    def counter(self, printer):
+        """
+        Returns the prtAlertAllEvents value stored at the last walk, or None
+        """
+        row = self.db.execute('SELECT counter FROM counters WHERE printer = ?',
+                              (printer,)).fetchone()
+        return row[0] if row else None
+
+    def touch(self, printer, now=None):
+        """
+        Marks all the alerts of a printer as seen, used when the alert table
+        is known to be unchanged
+        """
+        now = time.time() if now is None else now
+        with self.db:
+            self.db.execute('UPDATE alerts SET last_seen = ? WHERE printer = ?', (now, printer))
+
+    def update(self, printer, alerts, counter=None, now=None):
+        """
+        Replaces the alerts of a printer with the ones just found.
+
+        Args:
+            printer(str): printer name
+            alerts(dict): prtAlertIndex -> description of the alerts found
+            counter(int): prtAlertAllEvents at the time of the walk
+            now(float): time of the walk, defaults to time.time()
+
+        Returns:
+            raised(list): (index, description) of alerts not seen before
+            cleared(list): (index, description, first_seen) of alerts which are gone
+        """
+        now = time.time() if now is None else now
+        previous = {index: (description, first_seen) for index, description, first_seen
+                    in self.db.execute('SELECT alert_index, description, first_seen '
+                                       'FROM alerts WHERE printer = ?', (printer,))}
+        #An index reused for another alert counts as a clear and a raise
+        raised = [(index, description) for index, description in sorted(alerts.items())
+                  if previous.get(index, (None,))[0] != description]
+        cleared = [(index, description, first_seen)
+                   for index, (description, first_seen) in sorted(previous.items())
+                   if alerts.get(index) != description]
+        with self.db:
+            self.db.executemany('DELETE FROM alerts WHERE printer = ? AND alert_index = ?',
+                                [(printer, index) for index, _, _ in cleared])
+            self.db.executemany('INSERT INTO alerts VALUES (?, ?, ?, ?, ?)',
+                                [(printer, index, description, now, now)
+                                 for index, description in raised])
+            self.db.execute('UPDATE alerts SET last_seen = ? WHERE printer = ?', (now, printer))
+            self.db.execute('INSERT OR REPLACE INTO counters VALUES (?, ?)', (printer, counter))
+        return raised, cleared
+
+    def forget(self, printer):
+        """
+        Removes everything stored about a printer
+        """
+        with self.db:
+            self.db.execute('DELETE FROM alerts WHERE printer = ?', (printer,))
+            self.db.execute('DELETE FROM counters WHERE printer = ?', (printer,))
+
+    def close(self):
+        self.db.close()
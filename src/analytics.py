@@ -0,0 +1,214 @@
+#!python3
+"""
+Usage analytics on the page count history stored by printer_stats.py.
+
+The history is loaded into a printers x days NumPy array, and increases,
+period and room totals, moving averages and counter resets are computed on
+the whole array at once.
+
+Usage:
+    python analytics.py
+    python analytics.py --start 2019-01-01 --end 2019-12-31 --period month
+    python analytics.py --period week --by room
+    python analytics.py --period day --window 7 --csv usage.csv
+    python analytics.py --resets
+"""
+__all__ = ['load_history', 'fill_forward', 'daily_increase', 'counter_resets',
+           'period_totals', 'group_totals', 'moving_average', 'format_table', 'write_csv']
+import csv
+import sys
+from argparse import ArgumentParser
+from datetime import date, timedelta
+
+import numpy as np
+
+from page_store import PageCountStore
+
+PERIODS = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+
+#A Monday. datetime64[W] counts weeks from 1970-01-01, a Thursday, so the
+#weeks are counted from here instead to start on Mondays like printer_stats
+MONDAY = np.datetime64('1969-12-29', 'D')
+
+
+def load_history(store, start, end):
+    """
+    Loads the page counts from start to end into an array
+
+    Args:
+        store(PageCountStore): the page count history
+        start(str): first day, YYYY-MM-DD
+        end(str): last day, YYYY-MM-DD
+
+    Returns:
+        printers(list): printer names, one for each row
+        locations(list): the location of each printer
+        days(np.ndarray): datetime64[D] of each column
+        counts(np.ndarray): float array printers x days, NaN where the
+            page count is unknown
+    """
+    locations = store.printers()
+    printers = sorted(locations)
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    counts = np.full((len(printers), len(days)), np.nan)
+    #The day offsets are computed by SQLite, parsing dates in Python is the slow part
+    rows = store.db.execute('SELECT printer, CAST(julianday(day) - julianday(?) AS INTEGER), count '
+                            'FROM page_counts WHERE day BETWEEN ? AND ? AND count IS NOT NULL',
+                            (start, start, end)).fetchall()
+    row_of = {printer: row for row, printer in enumerate(printers)}
+    rows = [(row_of[name], column, value) for name, column, value in rows if name in row_of]
+    if rows:
+        rows = np.array(rows, dtype=np.int64)
+        counts[rows[:, 0], rows[:, 1]] = rows[:, 2]
+    return printers, [locations[printer] for printer in printers], days, counts
+
+def fill_forward(counts):
+    """
+    Replaces unknown page counts with the last known count of the printer.
+    Counts before the first known count stay NaN.
+    """
+    known = ~np.isnan(counts)
+    last_known = np.where(known, np.arange(counts.shape[1]), 0)
+    np.maximum.accumulate(last_known, axis=1, out=last_known)
+    filled = counts[np.arange(counts.shape[0])[:, None], last_known]
+    filled[~np.maximum.accumulate(known, axis=1)] = np.nan
+    return filled
+
+def counter_resets(counts):
+    """
+    Returns a boolean array printers x days which is True on the days the
+    page count went down, e.g after the counter was reset or the printer replaced
+    """
+    filled = fill_forward(counts)
+    resets = np.zeros(counts.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        resets[:, 1:] = np.diff(filled, axis=1) < 0
+    return resets
+
+def daily_increase(counts):
+    """
+    Returns the pages printed each day as an array printers x days.
+    Pages printed on days without a page count are counted on the next day
+    with one. On a counter reset the counter is taken to have started at 0.
+    The first day, and days before the first known count, are 0.
+    """
+    filled = fill_forward(counts)
+    increase = np.zeros(counts.shape)
+    increase[:, 1:] = np.diff(filled, axis=1)
+    resets = counter_resets(counts)
+    increase[resets] = filled[resets]
+    return np.nan_to_num(increase)
+
+def period_totals(days, increase, period='week'):
+    """
+    Sums the daily increase over days, weeks, months or years. Weeks start
+    on Mondays.
+
+    Returns:
+        periods(np.ndarray): the start of each period
+        totals(np.ndarray): printers x periods
+    """
+    if period == 'week':
+        days = days.astype('datetime64[D]')
+        keys = days - ((days - MONDAY).astype(np.int64) % 7).astype('timedelta64[D]')
+    else:
+        keys = days.astype('datetime64[%s]' % PERIODS[period])
+    periods, column = np.unique(keys, return_inverse=True)
+    totals = np.zeros((increase.shape[0], len(periods)))
+    np.add.at(totals.T, column, increase.T)
+    return periods, totals
+
+def group_totals(groups, totals):
+    """
+    Sums the rows of totals which are in the same group, e.g the printers
+    in the same room
+
+    Returns:
+        names(np.ndarray): the groups, sorted
+        totals(np.ndarray): groups x columns
+    """
+    names, row = np.unique(np.asarray(groups), return_inverse=True)
+    grouped = np.zeros((len(names), totals.shape[1]))
+    np.add.at(grouped, row, totals)
+    return names, grouped
+
+def moving_average(values, window):
+    """
+    Trailing moving average over the columns. The first window - 1 columns
+    average over the columns available so far.
+    """
+    cumulative = np.cumsum(values, axis=1)
+    cumulative[:, window:] = cumulative[:, window:] - cumulative[:, :-window]
+    width = np.minimum(np.arange(1, values.shape[1] + 1), window)
+    return cumulative / width
+
+def format_table(labels, columns, values, label_title='PRINTER', total=True):
+    """
+    Formats a labels x columns array as a text table, with a total column
+    at the end if total is True
+    """
+    columns = [str(column) for column in columns] + (['TOTAL'] if total else [])
+    width = max([len(label_title)] + [len(str(label)) for label in labels])
+    header = '%*s | ' % (width, label_title) + ' | '.join('%10s' % c for c in columns)
+    lines = [header, '-'*len(header)]
+    for label, row in zip(labels, values):
+        row = list(row) + ([row.sum()] if total else [])
+        lines.append('%*s | ' % (width, label) + ' | '.join('%10.0f' % v for v in row))
+    return '\n'.join(lines)
+
+def write_csv(outfile, labels, columns, values, label_title='printer'):
+    """
+    Writes a labels x columns array as CSV
+    """
+    writer = csv.writer(outfile)
+    writer.writerow([label_title] + [str(column) for column in columns])
+    for label, row in zip(labels, values):
+        writer.writerow([label] + ['%g' % v for v in row])
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-s', '--start',
+        default=str(date.today() - timedelta(30)),
+        help='First day (YYYY-MM-DD), defaults to 30 days ago')
+    parser.add_argument('-e', '--end',
+        default=str(date.today()),
+        help='Last day (YYYY-MM-DD), defaults to today')
+    parser.add_argument('-p', '--period',
+        choices=sorted(PERIODS), default='week',
+        help='Sum the increase per day, week, month or year')
+    parser.add_argument('-b', '--by',
+        choices=['printer', 'room'], default='printer',
+        help='One row per printer, or per room')
+    parser.add_argument('-w', '--window',
+        type=int,
+        help='Report the moving average over this many periods')
+    parser.add_argument('-r', '--resets',
+        action='store_true',
+        help='List the days the page counters went down')
+    parser.add_argument('-c', '--csv',
+        help='Write CSV to this file instead of a table, - for stdout')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argparser()
+    printers, locations, days, counts = load_history(PageCountStore(), args.start, args.end)
+    names = [printer.split('.')[0] for printer in printers]
+
+    if args.resets:
+        for row, column in zip(*np.nonzero(counter_resets(counts))):
+            print('%s: page counter reset on %s' % (names[row], days[column]))
+        sys.exit(0)
+
+    periods, values = period_totals(days, daily_increase(counts), args.period)
+    label_title = 'PRINTER'
+    if args.by == 'room':
+        names, values = group_totals(locations, values)
+        label_title = 'ROOM'
+    if args.window:
+        values = moving_average(values, args.window)
+
+    if args.csv:
+        with (sys.stdout if args.csv == '-' else open(args.csv, 'w', newline='')) as outfile:
+            write_csv(outfile, names, periods, values, label_title.lower())
+    else:
+        print(format_table(names, periods, values, label_title, total=not args.window))
@@ -0,0 +1,211 @@
+#!python3
+"""
+Benchmarks of the start up cost of the scripts, and of sweeps of a
+simulated fleet of printers.
+
+Every measurement is run in a fresh python process, so nothing is cached
+between runs, and the median of the runs is reported.
+
+    import                 python startup + import printer_mibs
+    import + engines       the same, and both SNMP engines created, as the
+                           module used to do on import
+    resolve by name        first GET varBinds built from MIB names, which
+                           loads the MIB modules
+    resolve from index     first GET varBinds built from oid_index.json
+
+With --fleet, the sweeps of the scripts are run against that many agents
+of simulator.py instead, and the sweep time, CPU time and peak RSS of the
+process are reported:
+
+    printer_monitor        async_check_printer_errors of every printer
+    printer_status         reachability probe and async_get_printer_status
+    printer_stats          printer_stats.check_printers into a new page_count.db
+
+The agents listen on 127.1.0.1 and up, on --port. Port 161 needs root.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --runs 20
+    python benchmark.py --fleet 1000
+    python benchmark.py --fleet 1000 --latency 0.02 --loss 0.01 --offline 0.05 --alerts 20
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from os.path import dirname, abspath
+
+import simulator
+
+SRC = dirname(abspath(__file__))
+
+#The OIDs of printer_status.py, the largest GET of the scripts
+QUERIES = [('SNMPv2-MIB', 'sysDescr', 0),
+           ('SNMPv2-MIB', 'sysLocation', 0),
+           ('Printer-MIB', 'prtConsoleDisplayBufferText', 1, 1),
+           ('Printer-MIB', 'prtMarkerSuppliesLevel', 1, 1),
+           ('Printer-MIB', 'prtMarkerLifeCount', 1, 1),
+           ('DISMAN-EVENT-MIB', 'sysUpTimeInstance')]
+
+#Statements timed inside the child process, after the imports
+RESOLVE = '''
+from pysnmp.hlapi.varbinds import CommandGeneratorVarBinds
+import time
+start = time.perf_counter()
+CommandGeneratorVarBinds().makeVarBinds(printer_mibs.get_engine(), %s)
+print(time.perf_counter() - start)
+'''
+
+BENCHMARKS = [
+    ('python startup', 'pass', False),
+    ('import', 'import printer_mibs', False),
+    ('import + engines',
+     'import printer_mibs; printer_mibs.get_engine(); printer_mibs.get_async_engine()', False),
+    ('resolve by name',
+     'import printer_mibs\nfrom pysnmp.hlapi import ObjectType, ObjectIdentity\n'
+     + RESOLVE % '[ObjectType(ObjectIdentity(*query)) for query in %r]' % QUERIES, True),
+    ('resolve from index',
+     'import printer_mibs\nfrom oid_index import object_type\n'
+     + RESOLVE % '[object_type(query) for query in %r]' % QUERIES, True),
+]
+
+#Run in the process of each fleet benchmark, around the sweep. The state
+#files are kept in a new directory, so every run queries the printers again
+#and the state files in src are left alone.
+SWEEP = '''
+import json, resource, tempfile, time
+from os.path import join
+import printer_mibs, supplies
+from change_cache import ChangeCache
+printer_mibs.SNMP_PORT = %r
+directory = tempfile.mkdtemp()
+printer_mibs.change_cache = ChangeCache(join(directory, 'printer_state.json'))
+printer_mibs.supply_layouts = supplies.SupplyLayouts(join(directory, 'supply_layout.json'))
+printers = %r
+%s
+start, cpu = time.perf_counter(), time.process_time()
+%s
+print(json.dumps([time.perf_counter() - start, time.process_time() - cpu,
+                  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss]))
+'''
+
+#name, statements run before the sweep, the sweep
+FLEET_BENCHMARKS = [
+    ('printer_monitor',
+     'import config as cfg\nfrom printer_mibs import async_check_printer_errors, format_alerts, iter_all',
+     '''for printer, (online, room, alerts, model) in iter_all(async_check_printer_errors, printers,
+                                                cfg.ignore_list, False, 0):
+    format_alerts(printer, room, alerts)'''),
+    ('printer_status',
+     'from printer_mibs import async_get_printer_status, run_all\n'
+     'from records import FleetSnapshot, PrinterStatus\nfrom reachability import probe',
+     '''online = probe(printers, retries=2)
+snapshot = FleetSnapshot([PrinterStatus(p, False) for p in printers if not online[p]])
+for status in run_all(async_get_printer_status, [p for p in printers if online[p]]):
+    snapshot.append(status)'''),
+    ('printer_stats',
+     'import printer_stats\nfrom page_store import PageCountStore\n'
+     'from snapshot_cache import SnapshotCache\n'
+     'printer_stats.store = PageCountStore(join(directory, "page_count.db"))\n'
+     'snapshots = SnapshotCache(join(directory, "snapshot_cache.db"))\n'
+     'for room, printer in enumerate(printers): printer_stats.store.add_printer(printer, room)',
+     'printer_stats.check_printers(max_age=0, snapshots=snapshots)'),
+]
+
+
+def run(code, timed_inside=False):
+    """
+    Runs code in a new python process in the src directory.
+
+    Returns:
+        seconds(float): wall time of the process, or the time printed by
+            the code if timed_inside is True
+    """
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=SRC,
+                                     universal_newlines=True)
+    if timed_inside:
+        return float(output.split()[-1])
+    return time.perf_counter() - start
+
+def benchmark(runs=10):
+    """
+    Returns a list of (name, median seconds) for BENCHMARKS
+    """
+    #oid_index.json is written on first use, so it exists for the timed runs
+    run('from oid_index import oid, NAMES\nfor name in NAMES: oid(*name)')
+    return [(name, statistics.median(run(code, timed_inside) for _ in range(runs)))
+            for name, code, timed_inside in BENCHMARKS]
+
+def benchmark_fleet(agents, runs=3, workers=1, port=161, **options):
+    """
+    Runs FLEET_BENCHMARKS against simulated agents, see simulator.start_fleet
+    for the options
+
+    Returns:
+        results(list): (name, median seconds, median CPU seconds, largest
+            peak RSS in KiB) for FLEET_BENCHMARKS
+    """
+    processes = simulator.start_fleet(agents, workers, port, **options)
+    printers = simulator.addresses(agents)
+    results = []
+    try:
+        run('from oid_index import oid, NAMES\nfor name in NAMES: oid(*name)')
+        for name, setup, sweep in FLEET_BENCHMARKS:
+            code = SWEEP % (port, printers, setup, sweep)
+            measurements = []
+            for _ in range(runs):
+                output = subprocess.check_output([sys.executable, '-c', code], cwd=SRC,
+                                                 universal_newlines=True)
+                measurements.append(json.loads(output.splitlines()[-1]))
+            seconds, cpu, rss = zip(*measurements)
+            results.append((name, statistics.median(seconds), statistics.median(cpu), max(rss)))
+    finally:
+        simulator.stop_fleet(processes)
+    return results
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-r', '--runs',
+        type=int,
+        help='Number of runs of each benchmark, 10 by default and 3 with --fleet')
+    parser.add_argument('-f', '--fleet',
+        type=int, default=0,
+        help='Run the sweeps against this many simulated printers')
+    parser.add_argument('-w', '--workers',
+        type=int, default=1,
+        help='Processes serving the simulated printers')
+    parser.add_argument('--port',
+        type=int, default=161,
+        help='UDP port of the simulated printers')
+    parser.add_argument('--latency',
+        type=float, default=0.0,
+        help='Seconds before the simulated printers answer')
+    parser.add_argument('--loss',
+        type=float, default=0.0,
+        help='Fraction of the requests the simulated printers drop')
+    parser.add_argument('--offline',
+        type=float, default=0.0,
+        help='Fraction of the simulated printers which never answer')
+    parser.add_argument('--alerts',
+        type=int, default=10,
+        help='Rows in the alert table of the simulated printers')
+    parser.add_argument('--supplies',
+        type=int, default=4,
+        help='Rows in the supplies table of the simulated printers')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argparser()
+    if args.fleet:
+        results = benchmark_fleet(args.fleet, args.runs or 3, args.workers, args.port,
+                                  latency=args.latency, loss=args.loss, offline=args.offline,
+                                  alerts=args.alerts, supplies=args.supplies)
+        print('%-20s %10s %10s %10s' % ('', 'SWEEP', 'CPU', 'PEAK RSS'))
+        for name, seconds, cpu, rss in results:
+            print('%-20s %8.2f s %8.2f s %7.1f MB' % (name, seconds, cpu, rss/1024))
+    else:
+        for name, seconds in benchmark(args.runs or 10):
+            print('%-20s %8.1f ms' % (name, seconds*1000))
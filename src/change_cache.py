@@ -0,0 +1,130 @@
+#!python3
+"""
+Values of the printers which rarely change, kept between polls.
+
+Every poll GETs sysUpTimeInstance, which tells when the printer was
+booted. Static values like sysDescr and sysLocation are only asked for
+again after the printer has rebooted. Counters like prtMarkerLifeCount are
+asked for again after an interval which is halved every time the counter
+has changed since the last time, and doubled every time it has not, between
+counter_min_interval and counter_max_interval seconds from config.py.
+For most printers most polls are then one GET of the uptime and the
+values which change all the time.
+
+The cache is kept in printer_state.json, and written by save() after a sweep.
+Only the printers polled are written, over what other processes saved
+meanwhile, see json_state.py. Used by printer_mibs.async_get_changed.
+"""
+__all__ = ['ChangeCache', 'key']
+import time
+from os.path import dirname, join
+
+import config as cfg
+import json_state
+
+#Seconds between the polls of a counter which changes, and of one which does not
+MIN_INTERVAL = getattr(cfg, 'counter_min_interval', 60)
+MAX_INTERVAL = getattr(cfg, 'counter_max_interval', 3600)
+
+#Seconds the boot time worked out from the uptime may move without a reboot,
+#as the clocks of the printers and of this host drift apart
+BOOT_SLACK = 30
+
+
+def key(query):
+    """
+    Returns the key of a (mib_name, mib_variable, *mib_id) query in the cache
+    """
+    return '%s::%s' % query[:2] + ''.join('.%s' % sub_id for sub_id in query[2:])
+
+
+class ChangeCache:
+    """
+    The boot time and cached values of every printer. A value is stored as
+    [value, time fetched, interval], with None as the interval of static
+    values, which do not expire until the printer reboots.
+
+    Args:
+        path(str): JSON file, created by the first save()
+    """
+
+    def __init__(self, path=join(dirname(__file__), 'printer_state.json')):
+        self.path = path
+        self.printers = json_state.load(path)
+        #Printers updated or forgotten since the last save
+        self.changed = set()
+
+    def fresh(self, printer, queries, now=None):
+        """
+        Returns a dict query -> cached value of the queries which do not
+        have to be asked for
+        """
+        now = time.time() if now is None else now
+        values = self.printers.get(printer, {}).get('values', {})
+        fresh = {}
+        for query in queries:
+            cached = values.get(key(query))
+            if cached is not None and (cached[2] is None or now - cached[1] < cached[2]):
+                fresh[query] = cached[0]
+        return fresh
+
+    def rebooted(self, printer, uptime_ticks, now=None):
+        """
+        Returns True if the printer has rebooted since it was last polled
+        """
+        now = time.time() if now is None else now
+        boot = self.printers.get(printer, {}).get('boot')
+        return boot is not None and now - uptime_ticks/100 > boot + BOOT_SLACK
+
+    def update(self, printer, uptime_ticks, counters=None, statics=None, now=None):
+        """
+        Stores the uptime and the values fetched in a poll
+
+        Args:
+            printer(str): printer name
+            uptime_ticks(int): sysUpTimeInstance
+            counters(dict): query -> value of the counters fetched
+            statics(dict): query -> value of the static values fetched
+        """
+        now = time.time() if now is None else now
+        self.changed.add(printer)
+        entry = self.printers.setdefault(printer, {'values': {}})
+        if self.rebooted(printer, uptime_ticks, now):
+            entry['values'] = {}
+        entry['boot'] = now - uptime_ticks/100
+        values = entry['values']
+        for query, value in (statics or {}).items():
+            values[key(query)] = [value, now, None]
+        for query, value in (counters or {}).items():
+            cached = values.get(key(query))
+            if cached is None or cached[2] is None:
+                interval = MIN_INTERVAL
+            elif cached[0] == value:
+                interval = min(cached[2]*2, MAX_INTERVAL)
+            else:
+                interval = max(cached[2]/2, MIN_INTERVAL)
+            values[key(query)] = [value, now, interval]
+
+    def forget(self, printer):
+        """
+        Drops everything cached about a printer
+        """
+        self.printers.pop(printer, None)
+        self.changed.add(printer)
+
+    def save(self):
+        """
+        Writes the printers changed since the last save to the file
+        """
+        def merge(printers):
+            for printer in self.changed:
+                if printer in self.printers:
+                    printers[printer] = self.printers[printer]
+                else:
+                    printers.pop(printer, None)
+        try:
+            self.printers = json_state.update(self.path, merge, sort_keys=True)
+            self.changed = set()
+        except OSError:
+            #Without a writable file everything is asked for again next run
+            pass
@@ -11,14 +11,12 @@ python check_online.py example_printer1
 python check_online.py example_printer1 example_printer2
 python check_online.py example_printer1.printer.example.com
 python check_online.py example_printer1.printer.example.com example_printer2.printer.example.com
+python check_online.py --max-age 0
 """
-from subprocess import CalledProcessError, check_output, STDOUT
-
-from sys import argv
-from printer_mibs import ping
+from reachability import probe
+from snapshot_cache import SnapshotCache
 from argparse import ArgumentParser
 import config as cfg
-import multiprocessing as mp
 
 
 if __name__=='__main__':
@@ -28,22 +26,29 @@ if __name__=='__main__':
     python check_online.py example_printer1 example_printer2
     python check_online.py example_printer1.printer.example.com
     python check_online.py example_printer1.printer.example.com example_printer2.printer.example.com
+    python check_online.py --max-age 0
     '''
     
     error = ''
     parser = ArgumentParser(usage=usage)
     parser.add_argument('printers', type=str, nargs='*', 
-                        default=cfg.printers,
                         help='Give name(s) of printers')
     parser.add_argument('-a', '--all', action='store_true',
                         help='Use all printers defined in config.py')
+    parser.add_argument('-m', '--max-age', type=float, default=None,
+                        help='Oldest result used from snapshot_cache.db in seconds, '
+                             '0 pings every printer. Default snapshot_ttls in config.py')
     args = parser.parse_args()
+    #Only the names given are completed with the suffix, the printers in
+    #config.py may be addresses or names in other domains found by discovery.py
     suffix = cfg.suffix
-    args.printers = [p if p.endswith(suffix) else p+suffix for p in args.printers]
+    args.printers = ([p if p.endswith(suffix) else p+suffix for p in args.printers]
+                     or list(cfg.printers))
 
-    with mp.Pool(32) as pool:
-        ping_async = [pool.apply_async(ping, args=(printer, 3)) for printer in args.printers]
-        inactive_printers = [i for i, p in zip(args.printers, ping_async) if not p.get()] 
+    online = dict(SnapshotCache().serve('reachable', args.printers,
+                                        lambda printers: probe(printers, retries=2).items(),
+                                        args.max_age))
+    inactive_printers = [p for p in args.printers if not online[p]]
 
     if inactive_printers:
         for printer in inactive_printers:
@@ -7,45 +7,344 @@ in the directory name equal to the dstdirectory name
 found in config.py.
 If the directory exist and you are not adding any new mibs
 there should not be any reason for you to run this program.
+
+With --incremental the sources of the mibs are hashed, and only the mibs
+whose source has changed since the last run are compiled, with the mibs
+importing them. The hashes are kept in mib_sources.json in dstdirectory.
+The mibs are compiled in parallel worker processes, each as soon as the
+mibs it imports are done, and a timing report is printed in dependency order.
+
+With --offline only the local mib directories are used, not the HTTP mirror.
+With --bundle the compiled mibs are also bundled into one zip file which is
+faster to load, see mib_bundle.py. A bundle is rebuilt by every later run.
+
+Usage:
+    python create_pymibs.py
+    python create_pymibs.py --incremental
+    python create_pymibs.py --incremental --workers 4 --offline --bundle
+    python create_pymibs.py --incremental --rebuild
 """
+import hashlib
+import json
+import os
+import re
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from os.path import exists, join
+
 from pysmi.reader import getReadersFromUrls
 from pysmi.searcher import PyFileSearcher, PyPackageSearcher
 from pysmi.writer import PyFileWriter
 from pysmi.parser import SmiV1CompatParser
 from pysmi.codegen import PySnmpCodeGen
 from pysmi.compiler import MibCompiler
+from pysmi import error
 
+import config as cfg
 from config import dstdirectory, mibpaths
+from mib_bundle import build_bundle
+from oid_index import build_index
 # debug.setLogger(debug.Debug('all'))
 
+INPUTMIBS = ['Printer-MIB', 'SNMPv2-MIB', 'DISMAN-EVENT-MIB']
+
+MIRROR = 'http://mibs.snmplabs.com/asn1/@mib@'
+
+#Hashes and imports of the mib sources compiled, kept in dstdirectory
+MANIFEST = 'mib_sources.json'
+
+#The module names after FROM in the IMPORTS of a mib
+IMPORTS = re.compile(r'\bIMPORTS\b(.*?);', re.S)
+FROM = re.compile(r'\bFROM\s+([A-Za-z][\w-]*)')
+COMMENT = re.compile(r'--.*?(--|$)', re.M)
+
+
+def mib_sources(mibpaths=mibpaths, offline=getattr(cfg, 'mib_offline', False)):
+    """
+    Returns the URLs of the mib sources: the general mibs, the mirror unless
+    offline, and the user defined mibs
+    """
+    mibsources = ['/usr/share/snmp/mibs']
+    if not offline:
+        mibsources.append(MIRROR)
+    return mibsources + list(mibpaths)
+
+def imports(text):
+    """
+    Returns the names of the mibs imported by a mib source
+    """
+    found = IMPORTS.search(COMMENT.sub('', text))
+    return sorted(set(FROM.findall(found.group(1)))) if found else []
+
+def _compiler(mibsources, dstdirectory, searchers=()):
+    mibcompiler = MibCompiler(SmiV1CompatParser(),
+                              PySnmpCodeGen(),
+                              PyFileWriter(dstdirectory))
+    #getReaderFromUrls uses pysmi.reader.localfile.FileReader
+    #and pysmi.reader.httpclient.HttpReader to add the Sources
+    #and urllib.parse to check wheter link is file or http.
+    #This is a quick way of adding the sources
+    mibcompiler.addSources(*getReadersFromUrls(*mibsources))
+    mibcompiler.addSearchers(*searchers)
+    return mibcompiler
+
+def _compile_one(mibname, mibsources, dstdirectory):
+    """
+    Compiles one mib in a worker process, without the mibs it imports
+
+    Returns:
+        status(str): pysmi status, e.g compiled or failed
+        seconds(float): time taken
+    """
+    start = time.perf_counter()
+    status = _compiler(mibsources, dstdirectory).compile(mibname, noDeps=True, rebuild=True)
+    result = str(status.get(mibname, 'missing'))
+    #The mib fails if it or a mib it imports cannot be read or parsed
+    errors = ['%s %s' % (name, getattr(mibstatus, 'error', mibstatus))
+              for name, mibstatus in sorted(status.items()) if mibstatus in ('failed', 'missing')]
+    if result != 'compiled' and errors:
+        result = 'failed: %s' % '; '.join(errors)
+    return result, time.perf_counter() - start
+
+
 class MibDump:
+    """
+    Compiles the mibs into dstdirectory and indexes the names used by the scripts
+
+    Args:
+        inputmibs(list): mibs to compile, with the mibs they import
+        mibpaths(list): directories or URLs with the user defined mibs
+        dstdirectory(str): directory of the compiled mibs
+        searchers(list): extra pysmi searchers of compiled mibs to skip
+        incremental(bool): only compile the mibs which have changed, see above
+        workers(int): worker processes of the incremental compile, default one per CPU
+        offline(bool): skip the HTTP mirror
+        rebuild(bool): with incremental, compile every mib again
+        bundle(bool): bundle the compiled mibs, see mib_bundle.py
+    """
+
     def __init__(self,
-                 inputmibs=['Printer-MIB','SNMPv2-MIB','DISMAN-EVENT-MIB'],
+                 inputmibs=INPUTMIBS,
                  mibpaths=mibpaths,
                  dstdirectory=dstdirectory,
-                 searchers=[]):
-        
+                 searchers=[],
+                 incremental=False,
+                 workers=None,
+                 offline=getattr(cfg, 'mib_offline', False),
+                 rebuild=False,
+                 bundle=False):
+        self.dstdirectory = dstdirectory
         #General mibs + usr defined mibs
-        mibsources = ['/usr/share/snmp/mibs', 'http://mibs.snmplabs.com/asn1/@mib@']
-        mibsources += mibpaths
+        self.mibsources = mib_sources(mibpaths, offline)
 
         #Defining standards pysnmp mib files ('pysnmp.smi.mibs', 'pysnmp_mibs')
         #Define searchers which finds existing compiled files and skips them
-        mibsearchers = PySnmpCodeGen.defaultMibPackages
-        searchers += [PyFileSearcher(dstdirectory)]
-        searchers += [PyPackageSearcher(mibsearcher) for mibsearcher in mibsearchers]
-
-        mibcompiler = MibCompiler(SmiV1CompatParser(),
-                                  PySnmpCodeGen(),
-                                  PyFileWriter(dstdirectory))
-
-        #getReaderFromUrls uses pysmi.reader.localfile.FileReader
-        #and pysmi.reader.httpclient.HttpReader to add the Sources
-        #and urllib.parse to check wheter link is file or http.
-        #This is a quick way of adding the sources
-        mibcompiler.addSources(*getReadersFromUrls(*mibsources))
-        mibcompiler.addSearchers(*searchers)
-        mibcompiler.compile(*inputmibs)
+        self.package_searchers = [PyPackageSearcher(mibsearcher)
+                                  for mibsearcher in PySnmpCodeGen.defaultMibPackages]
+        searchers = list(searchers) + [PyFileSearcher(dstdirectory)] + self.package_searchers
+
+        if incremental:
+            start = time.perf_counter()
+            results = self.compile_changed(inputmibs, workers, rebuild)
+            self.report(results, time.perf_counter() - start)
+        else:
+            _compiler(self.mibsources, dstdirectory, searchers).compile(*inputmibs)
+
+        if bundle or exists(os.path.normpath(dstdirectory) + '.zip'):
+            build_bundle(dstdirectory)
+
+        #Resolving the names used by the scripts once, see oid_index.py
+        build_index()
+
+    def prebuilt(self, mibname):
+        """
+        Returns True if the mib is compiled in the pysnmp packages or is one of
+        the base mibs built into pysnmp, and is never compiled here
+        """
+        if mibname in PySnmpCodeGen.baseMibs or mibname in PySnmpCodeGen.fakeMibs:
+            return True
+        for searcher in self.package_searchers:
+            try:
+                searcher.fileExists(mibname, 0)
+            except error.PySmiFileNotModifiedError:
+                return True
+            except error.PySmiError:
+                continue
+        return False
+
+    def read_sources(self, inputmibs):
+        """
+        Finds the sources of the mibs and of every mib they import
+
+        Returns:
+            sources(dict): mib name -> (sha1 of the source, imported mibs),
+                None if prebuilt and not compiled, or 'missing' if not found
+        """
+        readers = getReadersFromUrls(*self.mibsources)
+        sources = {}
+        pending = list(inputmibs)
+        while pending:
+            mibname = pending.pop(0)
+            if mibname in sources:
+                continue
+            if self.prebuilt(mibname):
+                sources[mibname] = None
+                continue
+            for reader in readers:
+                try:
+                    file_info, text = reader.getData(mibname)
+                except error.PySmiError:
+                    continue
+                sources[mibname] = (hashlib.sha1(text.encode('utf-8', 'replace')).hexdigest(),
+                                    imports(text))
+                pending += sources[mibname][1]
+                break
+            else:
+                sources[mibname] = 'missing'
+        return sources
+
+    def compile_changed(self, inputmibs, workers=None, rebuild=False):
+        """
+        Compiles the mibs whose source has changed, and the mibs importing
+        them, in parallel. A mib is started when every changed mib it imports
+        has been compiled, and skipped if one of them failed.
+
+        Returns:
+            results(list): (mib name, status, seconds, imported mibs) in
+                dependency order
+        """
+        manifest_path = join(self.dstdirectory, MANIFEST)
+        try:
+            with open(manifest_path, 'r') as infile:
+                manifest = json.load(infile)
+        except (OSError, ValueError):
+            manifest = {}
+        sources = self.read_sources(inputmibs)
+        compilable = {mibname: source for mibname, source in sources.items()
+                      if isinstance(source, tuple)}
+
+        changed = {mibname for mibname, (sha1, _) in compilable.items()
+                   if rebuild or manifest.get(mibname, {}).get('sha1') != sha1
+                   or not exists(join(self.dstdirectory, mibname + '.py'))}
+        importers = {}
+        for mibname, (_, imported) in compilable.items():
+            for dependency in imported:
+                importers.setdefault(dependency, set()).add(mibname)
+        pending = list(changed)
+        while pending:
+            for importer in importers.get(pending.pop(), ()):
+                if importer not in changed:
+                    changed.add(importer)
+                    pending.append(importer)
+
+        status = {}
+        seconds = {}
+        waiting = {mibname: {dependency for dependency in compilable[mibname][1]
+                             if dependency in changed and dependency != mibname}
+                   for mibname in changed}
+        os.makedirs(self.dstdirectory, exist_ok=True)
+        with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+            running = {}
+            while waiting or running:
+                for mibname in sorted(waiting):
+                    if any(status.get(dependency, 'compiled') != 'compiled'
+                           for dependency in waiting[mibname]):
+                        status[mibname] = 'skipped: an imported mib failed'
+                        seconds[mibname] = 0.0
+                        del waiting[mibname]
+                    elif all(dependency in status for dependency in waiting[mibname]):
+                        running[executor.submit(_compile_one, mibname, self.mibsources,
+                                                self.dstdirectory)] = mibname
+                        del waiting[mibname]
+                if not running:
+                    if waiting:
+                        #An import cycle, every worker parses all the mibs it imports anyway
+                        mibname = sorted(waiting)[0]
+                        running[executor.submit(_compile_one, mibname, self.mibsources,
+                                                self.dstdirectory)] = mibname
+                        del waiting[mibname]
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    mibname = running.pop(future)
+                    status[mibname], seconds[mibname] = future.result()
+
+        for mibname, (sha1, imported) in compilable.items():
+            if mibname not in changed:
+                status[mibname], seconds[mibname] = 'untouched', 0.0
+            elif status[mibname] == 'compiled':
+                manifest[mibname] = {'sha1': sha1, 'imports': imported}
+            else:
+                #Compiled again next run
+                manifest.pop(mibname, None)
+        with open(manifest_path, 'w') as outfile:
+            json.dump(manifest, outfile, indent=4, sort_keys=True)
+
+        results = []
+        for mibname in dependency_order(sources):
+            source = sources[mibname]
+            if source is None:
+                results.append((mibname, 'prebuilt', 0.0, []))
+            elif source == 'missing':
+                results.append((mibname, 'missing', 0.0, []))
+            else:
+                results.append((mibname, status[mibname], seconds[mibname], source[1]))
+        return results
+
+    @staticmethod
+    def report(results, seconds):
+        """
+        Prints the status and compile time of every mib, in dependency order
+        """
+        for mibname, status, seconds, imported in results:
+            print('%-32s %-10s %7.2fs  %s' % (mibname, status.split(':')[0], seconds,
+                                             ', '.join(imported)))
+            if ':' in status:
+                print('    %s' % status.split(':', 1)[1].strip())
+        compiled = [result for result in results if result[1] == 'compiled']
+        print('%d of %d mibs compiled in %.2fs, %.2fs of worker time' % (
+            len(compiled), len(results), seconds, sum(result[2] for result in compiled)))
+
+def dependency_order(sources):
+    """
+    Returns the mib names with every mib after the mibs it imports
+    """
+    order = []
+    seen = set()
+    def visit(mibname):
+        if mibname in seen:
+            return
+        seen.add(mibname)
+        source = sources.get(mibname)
+        for dependency in (source[1] if isinstance(source, tuple) else []):
+            if dependency in sources:
+                visit(dependency)
+        order.append(mibname)
+    for mibname in sorted(sources):
+        visit(mibname)
+    return order
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-i', '--incremental',
+        action='store_true',
+        help='Only compile the mibs whose sources have changed, in parallel')
+    parser.add_argument('-w', '--workers',
+        type=int, default=None,
+        help='Worker processes of --incremental, default one per CPU')
+    parser.add_argument('-o', '--offline',
+        action='store_true', default=getattr(cfg, 'mib_offline', False),
+        help='Only use the local mib directories, not the HTTP mirror')
+    parser.add_argument('-r', '--rebuild',
+        action='store_true',
+        help='With --incremental, compile every mib again')
+    parser.add_argument('-b', '--bundle',
+        action='store_true',
+        help='Bundle the compiled mibs into one zip file, see mib_bundle.py')
+    return parser.parse_args()
 
 if __name__=='__main__':
-    MibDump()
+    args = argparser()
+    MibDump(incremental=args.incremental, workers=args.workers, offline=args.offline,
+            rebuild=args.rebuild, bundle=args.bundle)
@@ -0,0 +1,225 @@
+#!python3
+"""
+Finds the printers on the networks in config.py and writes the inventory.
+
+Every address in the networks is sent one SNMPv2c GETNEXT of sysDescr,
+sysObjectID, sysLocation and prtGeneralPrinterName from a single socket,
+paced to discovery_rate requests a second, and the answers are matched
+back to the addresses on the request-id, as reachability.py does. Agents
+which answer with a prtGeneralPrinterName have the Printer-MIB and are
+printers. Addresses which do not answer are asked again retries times, so
+a /16 takes about 65534/rate*(retries + 1) + timeout seconds, about a
+minute at the default rate.
+
+The printers found are written to inventory.json, see inventory.py, where
+the printers of other networks are kept.
+
+Usage:
+    python discovery.py
+    python discovery.py 10.1.0.0/16 10.2.3.0/24
+    python discovery.py 10.1.0.0/16 --rate 5000 --retries 0 --numeric
+"""
+__all__ = ['sweep', 'discover']
+import select
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import ip_address, ip_network
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+import config as cfg
+import inventory
+from oid_index import oid
+from records import DiscoveredPrinter, location_room
+
+NETWORKS = getattr(cfg, 'discovery_networks', [])
+
+#Requests sent a second. Agents and switches drop bursts, and every address
+#which does not exist costs an ARP request on the local networks.
+RATE = getattr(cfg, 'discovery_rate', 2000)
+
+PORT = getattr(cfg, 'snmp_port', 161)
+
+#Bytes of answers the socket holds while requests are being sent
+RECEIVE_BUFFER = 4*1024*1024
+
+#Asked for with GETNEXT, so the instance of prtGeneralPrinterName need not be known
+QUERIES = [('SNMPv2-MIB', 'sysDescr'),
+           ('SNMPv2-MIB', 'sysObjectID'),
+           ('SNMPv2-MIB', 'sysLocation'),
+           ('Printer-MIB', 'prtGeneralPrinterName')]
+
+
+def sweep(addresses, community='public', port=PORT, timeout=1.0, retries=1, rate=RATE):
+    """
+    Sends the GETNEXT to every address, and the addresses which have not
+    answered again retries times
+
+    Returns:
+        answers(dict): address -> list of (OID tuple, value) of the answer
+    """
+    protocol = api.protoModules[api.protoVersion2c]
+    message = protocol.Message()
+    protocol.apiMessage.setDefaults(message)
+    protocol.apiMessage.setCommunity(message, community)
+    pdu = protocol.GetNextRequestPDU()
+    protocol.apiPDU.setDefaults(pdu)
+    protocol.apiPDU.setVarBinds(pdu, [(oid(*query), protocol.Null('')) for query in QUERIES])
+    answers = {}
+    outstanding = {}
+    request_id = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        for _ in range(retries + 1):
+            pending = [address for address in addresses if address not in answers]
+            start = time.monotonic()
+            for number, address in enumerate(pending):
+                request_id += 1
+                outstanding[request_id] = address
+                protocol.apiPDU.setRequestID(pdu, request_id)
+                protocol.apiMessage.setPDU(message, pdu)
+                _send(sock, encoder.encode(message), (address, port), timeout)
+                #Reading the answers while waiting for the time of the next request
+                _receive(sock, protocol, outstanding, answers,
+                         start + (number + 1)/rate - time.monotonic())
+            _receive(sock, protocol, outstanding, answers, timeout)
+    return answers
+
+def _send(sock, packet, address, timeout):
+    try:
+        sock.sendto(packet, address)
+    except BlockingIOError:
+        if select.select([], [sock], [], timeout)[1]:
+            _send(sock, packet, address, timeout)
+    except OSError:
+        #Unroutable address, it will simply be unanswered
+        pass
+
+def _receive(sock, protocol, outstanding, answers, seconds):
+    """
+    Stores the answers which have arrived, and those which arrive in the
+    next seconds. The socket is read even when no time is left, as the
+    answers are dropped once its buffer is full.
+    """
+    deadline = time.monotonic() + seconds
+    while True:
+        while True:
+            try:
+                data, (source, _) = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            try:
+                response, _ = decoder.decode(data, asn1Spec=protocol.Message())
+                response_pdu = protocol.apiMessage.getPDU(response)
+                request_id = int(protocol.apiPDU.getRequestID(response_pdu))
+            except Exception:
+                continue
+            if outstanding.get(request_id) == source:
+                del outstanding[request_id]
+                answers[source] = [(tuple(name), value) for name, value
+                                   in protocol.apiPDU.getVarBinds(response_pdu)]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+            return
+
+def _text(value):
+    if hasattr(value, 'asOctets'):
+        return value.asOctets().decode('utf-8', 'replace').strip('\x00')
+    return value.prettyPrint()
+
+def _printer(address, var_binds):
+    """
+    Returns the DiscoveredPrinter of an answer, or None if the agent has no
+    Printer-MIB or the answer is not to our GETNEXT
+    """
+    if len(var_binds) != len(QUERIES):
+        return None
+    values = []
+    for query, (name, value) in zip(QUERIES, var_binds):
+        prefix = oid(*query)
+        if name[:len(prefix)] != prefix:
+            #The agent has no such object, and answered with the next one in its MIB view
+            values.append(None)
+        else:
+            values.append(_text(value))
+    description, object_id, location, printer_name = values
+    if printer_name is None:
+        return None
+    return DiscoveredPrinter(address, address, printer_name, description, object_id,
+                             location, location_room(location))
+
+def _host(address):
+    try:
+        return socket.gethostbyaddr(address)[0]
+    except (OSError, UnicodeError):
+        return address
+
+def discover(networks, community='public', port=PORT, timeout=1.0, retries=1, rate=RATE,
+             numeric=False):
+    """
+    Sweeps the networks for printers
+
+    Args:
+        networks(list): networks in CIDR notation e.g 10.1.0.0/16
+        numeric(bool): skip the reverse DNS lookups of the printers found
+
+    Returns:
+        printers(list): DiscoveredPrinter of every printer found
+        agents(int): number of SNMP agents which answered
+    """
+    addresses = []
+    for network in networks:
+        network = ip_network(network, strict=False)
+        addresses += [str(address) for address in (network.hosts() if network.num_addresses > 2
+                                                   else network)]
+    answers = sweep(list(dict.fromkeys(addresses)), community, port, timeout, retries, rate)
+    printers = [printer for printer in (_printer(address, var_binds)
+                                        for address, var_binds in answers.items())
+                if printer is not None]
+    if not numeric:
+        with ThreadPoolExecutor(32) as executor:
+            for printer, host in zip(printers, executor.map(_host, [p.address for p in printers])):
+                printer.host = host
+    return printers, len(answers)
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('networks', nargs='*', default=NETWORKS,
+        help='Networks to sweep, e.g 10.1.0.0/16. Default discovery_networks in config.py')
+    parser.add_argument('-c', '--community', default='public',
+        help='SNMP community')
+    parser.add_argument('-r', '--rate', type=float, default=RATE,
+        help='Requests sent a second')
+    parser.add_argument('-t', '--timeout', type=float, default=1.0,
+        help='Seconds to wait for the last answers of each round')
+    parser.add_argument('--retries', type=int, default=1,
+        help='Rounds of requests to the addresses which have not answered')
+    parser.add_argument('-n', '--numeric', action='store_true',
+        help='Name the printers by address, without reverse DNS lookups')
+    parser.add_argument('-o', '--output', default=inventory.INVENTORY_PATH,
+        help='Inventory file to write')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argparser()
+    if not args.networks:
+        print('No networks given, and no discovery_networks in config.py')
+        sys.exit(1)
+    start = time.monotonic()
+    printers, agents = discover(args.networks, args.community, PORT, args.timeout,
+                                args.retries, args.rate, args.numeric)
+    for printer in sorted(printers, key=lambda printer: ip_address(printer.address)):
+        print('%-15s %-30s %-20s %-10s %s' % (printer.address, printer.host, printer.printer_name,
+                                              printer.room, printer.description))
+    print('%d printers and %d other SNMP agents found in %.1fs' % (
+        len(printers), agents - len(printers), time.monotonic() - start))
+    #The printers of networks not swept this time stay in the inventory
+    swept = [ip_network(network, strict=False) for network in args.networks]
+    kept = [printer for printer in inventory.load(args.output)
+            if not any(ip_address(printer.address) in network for network in swept)]
+    inventory.save(kept + printers, args.output)
@@ -0,0 +1,85 @@
+#!python3
+"""
+Process-wide cache of the printer addresses.
+
+pysnmp looks up the host name every time a transport target is made, which
+was once for every query. Addresses are now looked up once and kept for
+dns_ttl seconds from config.py, unknown hosts included, so a check of
+one printer does one lookup no matter how many queries it sends.
+"""
+__all__ = ['resolve', 'async_resolve', 'resolve_all', 'forget', 'configure']
+import asyncio
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config as cfg
+
+
+def configure():
+    """
+    Reads dns_ttl from config.py, the addresses cached keep their expiry
+    """
+    global TTL
+    #Seconds an address is used before it is looked up again
+    TTL = getattr(cfg, 'dns_ttl', 300)
+
+configure()
+
+#host -> (IPv4 address or None if unknown, time.monotonic() the entry expires)
+_cache = {}
+
+
+def _cached(host):
+    address, expires = _cache.get(host, (None, 0))
+    return expires > time.monotonic(), address
+
+def _store(host, address):
+    _cache[host] = (address, time.monotonic() + TTL)
+    return address
+
+def resolve(host):
+    """
+    Returns the IPv4 address of host, or None if the host is unknown
+    """
+    fresh, address = _cached(host)
+    if fresh:
+        return address
+    try:
+        return _store(host, socket.gethostbyname(host))
+    except (socket.gaierror, UnicodeError):
+        return _store(host, None)
+
+async def async_resolve(host):
+    """
+    Same as resolve, but the lookup does not block the event loop
+    """
+    fresh, address = _cached(host)
+    if fresh:
+        return address
+    try:
+        addresses = await asyncio.get_event_loop().getaddrinfo(
+                host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    except (socket.gaierror, UnicodeError):
+        return _store(host, None)
+    return _store(host, addresses[0][4][0])
+
+def resolve_all(hosts):
+    """
+    Looks up the hosts which are not cached in parallel.
+    Returns a dict host -> address, with None for unknown hosts.
+    """
+    missing = [host for host in hosts if not _cached(host)[0]]
+    if missing:
+        with ThreadPoolExecutor(min(32, len(missing))) as executor:
+            list(executor.map(resolve, missing))
+    return {host: _cache[host][0] for host in hosts}
+
+def forget(host=None):
+    """
+    Drops the cached address of host, or of all hosts
+    """
+    if host is None:
+        _cache.clear()
+    else:
+        _cache.pop(host, None)
@@ -0,0 +1,207 @@
+#!python3
+"""
+Prometheus exporter for the printers in config.py.
+
+The printers are polled in the background every exporter_interval seconds,
+and the metrics page is rendered once after each poll. A scrape of /metrics
+only sends the last rendered page, so it never waits on SNMP and takes the
+same time however many printers there are.
+
+Usage:
+    python exporter.py
+    python exporter.py --port 9850 --interval 60
+
+Metrics:
+    printer_up                         1 if the printer answered the last poll
+    printer_pages_total                prtMarkerLifeCount
+    printer_supply_level_percent       level of each supply, see supplies.py
+    printer_uptime_seconds             time since the printer was started
+    printer_alerts                     number of alerts by severity
+    printer_snmp_query_seconds         time taken by the status query
+    printer_exporter_refresh_seconds   time taken by the last poll of all printers
+    printer_exporter_refresh_timestamp_seconds  when the last poll finished
+"""
+__all__ = ['collect', 'render', 'MetricsCache']
+import threading
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import config as cfg
+from printer_mibs import async_get_printer_status, async_walk_mibs, get_change_cache, run_all
+from records import PrinterStatus
+from snapshot_cache import SnapshotCache
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#prtAlertSeverityLevel values
+SEVERITIES = {1: 'other', 3: 'critical', 4: 'warning', 5: 'warning_binary_change'}
+
+
+async def collect(printer, retries=1):
+    """
+    Polls one printer for the metrics. A printer whose poll fails is
+    reported down, so one bad printer never stops the refresh.
+
+    Returns:
+        status(PrinterStatus): see printer_mibs.async_get_printer_status
+        seconds(float): time taken by the status query
+        severities(Counter): number of alerts of each prtAlertSeverityLevel
+    """
+    start = time.monotonic()
+    severities = Counter()
+    try:
+        status = await async_get_printer_status(printer, retries)
+        seconds = time.monotonic() - start
+        if status.online:
+            levels, = await async_walk_mibs(printer, [('Printer-MIB', 'prtAlertSeverityLevel', 1)])
+            severities.update(int(level) for level in levels)
+    except Exception as error:
+        print('Polling %s failed: %r' % (printer, error))
+        status, seconds = PrinterStatus(printer, False), time.monotonic() - start
+        severities.clear()
+    return status, seconds, severities
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in sorted(labels.items()))
+
+def render(results, refresh_seconds, timestamp, rooms=None):
+    """
+    Renders the metrics page
+
+    Args:
+        results(list): (status, seconds, severities) of every printer, from collect
+        refresh_seconds(float): time taken to poll all the printers
+        timestamp(float): time.time() the poll finished
+        rooms(dict): printer -> room label of printer_up, e.g from printer_placement.
+            Not taken from the poll, so the series stays the same while a printer is down.
+
+    Returns:
+        page(bytes): the metrics in the Prometheus text format
+    """
+    rooms = rooms or {}
+    metrics = {name: [] for name in ('up', 'pages', 'supply', 'uptime', 'alerts', 'query')}
+    for status, seconds, severities in results:
+        name = status.printer.split('.')[0]
+        labels = _labels(printer=name)
+        up_labels = _labels(printer=name, room=rooms.get(status.printer, ''))
+        metrics['up'].append('printer_up%s %i' % (up_labels, status.online))
+        metrics['query'].append('printer_snmp_query_seconds%s %.6f' % (labels, seconds))
+        if not status.online:
+            continue
+        if status.page_count is not None:
+            metrics['pages'].append('printer_pages_total%s %i' % (labels, status.page_count))
+        if status.uptime is not None:
+            metrics['uptime'].append('printer_uptime_seconds%s %.2f' % (labels, status.uptime))
+        for supply in status.supplies:
+            percent = supply.percent()
+            if percent is not None:
+                metrics['supply'].append('printer_supply_level_percent%s %.1f'
+                                         % (_labels(printer=name, supply=supply.name), percent))
+        for level, severity in sorted(SEVERITIES.items()):
+            metrics['alerts'].append('printer_alerts%s %i' % (
+                    _labels(printer=name, severity=severity), severities.get(level, 0)))
+
+    lines = []
+    for key, name, kind, description in [
+            ('up', 'printer_up', 'gauge', '1 if the printer answered the last poll'),
+            ('pages', 'printer_pages_total', 'counter', 'Pages printed since the printer was made'),
+            ('supply', 'printer_supply_level_percent', 'gauge', 'Supply level in percent of max capacity'),
+            ('uptime', 'printer_uptime_seconds', 'gauge', 'Seconds since the printer was started'),
+            ('alerts', 'printer_alerts', 'gauge', 'Active alerts by severity'),
+            ('query', 'printer_snmp_query_seconds', 'gauge', 'Seconds taken by the SNMP status query')]:
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines += metrics[key]
+    lines.append('# HELP printer_exporter_refresh_seconds Seconds taken to poll all printers')
+    lines.append('# TYPE printer_exporter_refresh_seconds gauge')
+    lines.append('printer_exporter_refresh_seconds %.3f' % refresh_seconds)
+    lines.append('# HELP printer_exporter_refresh_timestamp_seconds When the last poll finished')
+    lines.append('# TYPE printer_exporter_refresh_timestamp_seconds gauge')
+    lines.append('printer_exporter_refresh_timestamp_seconds %.3f' % timestamp)
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class MetricsCache:
+    """
+    The last rendered metrics page. refresh() polls the printers and swaps
+    in the new page, while scrapes keep getting the old one.
+
+    Args:
+        printers(list): printer names
+        rooms(dict): printer -> room, see render
+    """
+
+    def __init__(self, printers, rooms=None):
+        self.printers = printers
+        self.rooms = rooms
+        #Shared with the command line tools
+        self.snapshots = SnapshotCache()
+        self.page = render([], 0, time.time())
+
+    def refresh(self):
+        start = time.monotonic()
+        results = run_all(collect, self.printers)
+        get_change_cache().save()
+        self.snapshots.put('status', {status.printer: status for status, _, _ in results})
+        self.snapshots.put('reachable', {status.printer: status.online for status, _, _ in results})
+        self.page = render(results, time.monotonic() - start, time.time(), self.rooms)
+
+    def run(self, interval):
+        """
+        Refreshes the page every interval seconds, forever
+        """
+        while True:
+            start = time.monotonic()
+            self.refresh()
+            time.sleep(max(0, interval - (time.monotonic() - start)))
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(cache, port):
+    """
+    Serves the page of cache on /metrics from a background thread
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            page = cache.page
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _Server(('', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-p', '--port',
+        type=int, default=getattr(cfg, 'exporter_port', 9850),
+        help='Port to serve /metrics on')
+    parser.add_argument('-i', '--interval',
+        type=float, default=getattr(cfg, 'exporter_interval', 60),
+        help='Seconds between polls of the printers')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argparser()
+    cache = MetricsCache(cfg.printers, dict(zip(cfg.printers, cfg.printer_placement)))
+    serve(cache, args.port)
+    cache.run(args.interval)
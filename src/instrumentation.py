@@ -0,0 +1,184 @@
+#!python3
+"""
+Instrumentation of the SNMP queries sent by printer_mibs.
+
+Every request records its round trip time in a latency histogram of the
+host and of each OID it asked for, along with timeouts and rows walked.
+Packets and bytes on the wire, and so retransmissions, are counted by an
+observer on the SNMP engines. Recording a request is a few dict lookups and
+additions, so it is left on; set instrumentation = False in config.py to
+turn it off.
+
+Usage:
+    from instrumentation import recorder
+    ...
+    print(recorder.summary())
+"""
+__all__ = ['Histogram', 'HostStats', 'Recorder', 'recorder', 'BUCKETS']
+from bisect import bisect_left
+from collections import defaultdict
+
+from pysnmp.proto import errind
+
+import config as cfg
+
+#Upper bounds of the latency histogram buckets in seconds, the last bucket has no bound
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed BUCKETS
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0]*(len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q quantile, or
+        the largest value seen if it is in the last bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = q*self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+
+class HostStats:
+    """
+    What was recorded about one host
+    """
+    __slots__ = ('latency', 'requests', 'timeouts', 'errors', 'rows',
+                 'packets_sent', 'packets_received', 'bytes_sent', 'bytes_received')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.requests = self.timeouts = self.errors = self.rows = 0
+        self.packets_sent = self.packets_received = self.bytes_sent = self.bytes_received = 0
+
+    @property
+    def retries(self):
+        """
+        Requests sent again because no answer came in time
+        """
+        return max(0, self.packets_sent - self.requests)
+
+
+class Recorder:
+    """
+    Collects HostStats per host and a latency Histogram per OID
+
+    Args:
+        enabled(bool): record nothing if False
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded, e.g at the start of a sweep
+        """
+        self.hosts = defaultdict(HostStats)
+        self.oids = defaultdict(Histogram)
+        #Transport address -> host, to put the packets seen by the engines on the right host
+        self._hosts_by_address = {}
+
+    def request(self, host, queries, seconds, error_indication=None, address=None):
+        """
+        Records one request and its answer
+
+        Args:
+            host(str): printer name
+            queries(list): the (mib_name, mib_variable, *mib_id) asked for
+            seconds(float): time from sending the request to the answer or timeout
+            error_indication: pysnmp error indication, None if answered
+            address(str): IP address the request was sent to
+        """
+        stats = self.hosts[host]
+        stats.requests += 1
+        if error_indication is not None:
+            if isinstance(error_indication, errind.RequestTimedOut):
+                stats.timeouts += 1
+            else:
+                stats.errors += 1
+        stats.latency.observe(seconds)
+        for query in queries:
+            self.oids['%s::%s' % query[:2]].observe(seconds)
+        if address is not None:
+            self._hosts_by_address[address] = host
+
+    def rows(self, host, count):
+        """
+        Records the number of rows a walk got back
+        """
+        self.hosts[host].rows += count
+
+    def observe(self, snmp_engine, execpoint, variables, context):
+        """
+        pysnmp observer counting the packets sent to and received from each host
+        """
+        address = variables['transportAddress'][0]
+        stats = self.hosts[self._hosts_by_address.get(address, address)]
+        if execpoint == 'rfc3412.sendPdu':
+            stats.packets_sent += 1
+            stats.bytes_sent += len(variables['outgoingMessage'])
+        else:
+            stats.packets_received += 1
+            stats.bytes_received += len(variables['wholeMsg'])
+
+    def attach(self, snmp_engine):
+        """
+        Registers observe on an SNMP engine
+        """
+        if self.enabled:
+            snmp_engine.observer.registerObserver(
+                    self.observe, 'rfc3412.sendPdu', 'rfc3412.receiveMessage:response')
+
+    def summary(self, limit=20):
+        """
+        Returns a text report of the hosts, slowest first, and the OIDs
+        """
+        lines = ['%-30s %6s %8s %8s %8s %8s %5s %5s %6s %9s %9s' % (
+                 'HOST', 'REQ', 'TOTAL', 'MEAN', 'P95', 'MAX', 'TMO', 'RETRY', 'ROWS', 'SENT', 'RECEIVED')]
+        hosts = sorted(self.hosts.items(), key=lambda item: item[1].latency.total, reverse=True)
+        for host, stats in hosts[:limit]:
+            latency = stats.latency
+            lines.append('%-30s %6i %7.2fs %6.1fms %6.1fms %6.1fms %5i %5i %6i %8iB %8iB' % (
+                         host.split('.')[0] if not host[:1].isdigit() else host,
+                         stats.requests, latency.total, latency.mean()*1000,
+                         latency.quantile(0.95)*1000, latency.max*1000, stats.timeouts,
+                         stats.retries, stats.rows, stats.bytes_sent, stats.bytes_received))
+        if len(hosts) > limit:
+            lines.append('... %i more hosts' % (len(hosts) - limit))
+        lines.append('')
+        lines.append('%-45s %6s %8s %8s %8s' % ('OID', 'REQ', 'MEAN', 'P95', 'MAX'))
+        for name, latency in sorted(self.oids.items(), key=lambda item: item[1].total, reverse=True):
+            lines.append('%-45s %6i %6.1fms %6.1fms %6.1fms' % (
+                         name, latency.count, latency.mean()*1000,
+                         latency.quantile(0.95)*1000, latency.max*1000))
+        return '\n'.join(lines)
+
+#The recorder used by printer_mibs
+recorder = Recorder(getattr(cfg, 'instrumentation', True))
@@ -0,0 +1,82 @@
+#!python3
+"""
+The printer inventory written by discovery.py.
+
+inventory.json holds a DiscoveredPrinter for every printer found. config.py
+can add them to the printers maintained by hand:
+
+    from inventory import add_discovered
+    printers, printer_placement = add_discovered(printers, printer_placement)
+
+This module does not import config.py, so config.py can import it.
+
+Usage:
+    python inventory.py
+"""
+__all__ = ['INVENTORY_PATH', 'load', 'save', 'find', 'add_discovered']
+import json
+from os.path import dirname, join
+
+from records import DiscoveredPrinter
+
+INVENTORY_PATH = join(dirname(__file__), 'inventory.json')
+
+
+def load(path=INVENTORY_PATH):
+    """
+    Returns the printers in the inventory, or [] if there is none
+    """
+    try:
+        with open(path, 'r') as infile:
+            return [DiscoveredPrinter(**entry) for entry in json.load(infile)]
+    except (OSError, ValueError, TypeError):
+        return []
+
+def save(printers, path=INVENTORY_PATH):
+    """
+    Writes the printers to the inventory, sorted by address
+    """
+    entries = sorted((printer._asdict() for printer in printers),
+                     key=lambda entry: tuple(int(part) for part in entry['address'].split('.')))
+    with open(path, 'w') as outfile:
+        json.dump(entries, outfile, indent=4, sort_keys=True)
+
+def find(printer, path=INVENTORY_PATH):
+    """
+    Returns the DiscoveredPrinter with the printer as host name or address, or None
+    """
+    for discovered in load(path):
+        if printer in (discovered.host, discovered.address):
+            return discovered
+    return None
+
+def add_discovered(printers, printer_placement, path=INVENTORY_PATH):
+    """
+    Returns the printers and their placements with the printers in the
+    inventory added, unless they are there already by host name or address.
+    The placements are room numbers, so printers whose sysLocation has no
+    room number are left out and have to be added by hand.
+
+    Args:
+        printers(list): printer names from config.py
+        printer_placement(list): the room number of each printer
+    """
+    printers = list(printers)
+    printer_placement = list(printer_placement)
+    known = set(printers)
+    for discovered in load(path):
+        if discovered.host in known or discovered.address in known:
+            continue
+        try:
+            room = int(discovered.room)
+        except (TypeError, ValueError):
+            continue
+        printers.append(discovered.host)
+        printer_placement.append(room)
+        known.add(discovered.host)
+    return printers, printer_placement
+
+if __name__ == '__main__':
+    for discovered in load():
+        print('%-15s %-40s %-20s %s' % (discovered.address, discovered.host,
+                                        discovered.printer_name, discovered.location))
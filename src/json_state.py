@@ -0,0 +1,52 @@
+#!python3
+"""
+The JSON state files shared by the scripts: printer_state.json,
+supply_layout.json and oid_index.json.
+
+The exporter and the command line tools write the same files at the same
+time. update() reads the file, applies the changes of this process to what
+is on disk and writes it back under a lock, to a temporary file which is
+moved over the old one as mib_bundle.py does. A reader never sees half a
+file, and no process loses the updates of another.
+"""
+__all__ = ['load', 'update']
+import fcntl
+import json
+import os
+
+
+def load(path):
+    """
+    Returns the dict in the JSON file, or {} if there is none
+    """
+    try:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def update(path, change, **options):
+    """
+    Applies the changes of this process to the dict in the file, and writes
+    it back. Raises OSError if the file can not be written.
+
+    Args:
+        path(str): JSON file, created if it does not exist
+        change(function): called with the dict on disk, changes it in place
+        **options: given to json.dump, e.g indent
+
+    Returns:
+        data(dict): the dict written, with the changes of the other processes
+
+    Example:
+        layouts = update('supply_layout.json',
+                         lambda layouts: layouts.pop('example_printer1', None))
+    """
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = load(path)
+        change(data)
+        with open(path + '.tmp', 'w') as outfile:
+            json.dump(data, outfile, **options)
+        os.replace(path + '.tmp', path)
+    return data
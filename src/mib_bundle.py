@@ -0,0 +1,73 @@
+#!python3
+"""
+The compiled MIB modules bundled into one zip file.
+
+pysnmp loads the compiled MIBs in dstdirectory from their .py files, and
+compiles every module to bytecode again each time it is loaded as it never
+writes .pyc files. create_pymibs.py --bundle writes the bytecode of all the
+modules in dstdirectory to one zip file next to it, in the format pysnmp
+reads, so loading a module is one lookup in the zip without compiling.
+
+mib_sources() returns the bundle followed by dstdirectory, so modules which
+are not in the bundle, or were compiled by another Python version, are
+still loaded from dstdirectory.
+
+Usage:
+    python mib_bundle.py
+"""
+__all__ = ['BUNDLE_PATH', 'build_bundle', 'mib_sources']
+import marshal
+import os
+import struct
+import sys
+import zipfile
+from importlib.util import MAGIC_NUMBER
+from os.path import exists, getmtime, join, normpath
+
+from pysnmp.smi import builder
+
+import config as cfg
+
+BUNDLE_PATH = normpath(cfg.dstdirectory) + '.zip'
+
+#Package of the modules in the zip file, pysnmp finds it by importing it
+PACKAGE = 'compiled_mib_bundle'
+
+
+def build_bundle(dstdirectory=cfg.dstdirectory, path=None):
+    """
+    Writes the bytecode of every compiled MIB in dstdirectory to the bundle
+
+    Returns:
+        modules(list): names of the modules bundled
+    """
+    path = path or normpath(dstdirectory) + '.zip'
+    modules = sorted(name[:-3] for name in os.listdir(dstdirectory)
+                     if name.endswith('.py') and name != '__init__.py')
+    #Written next to the bundle and moved over it, so running scripts never see half a file
+    with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as bundle:
+        bundle.writestr(PACKAGE + '/__init__.py', '')
+        for module in modules:
+            source_path = join(dstdirectory, module + '.py')
+            with open(source_path, 'r') as infile:
+                code = compile(infile.read(), source_path, 'exec')
+            #The .pyc header pysnmp expects: magic number and source mtime
+            header = MAGIC_NUMBER + struct.pack('<L', int(getmtime(source_path)) & 0xFFFFFFFF)
+            bundle.writestr('%s/%s.pyc' % (PACKAGE, module), header + marshal.dumps(code))
+    os.replace(path + '.tmp', path)
+    return modules
+
+def mib_sources():
+    """
+    Returns the MIB sources of the compiled MIBs, for MibBuilder.addMibSources
+    """
+    sources = [builder.DirMibSource(cfg.dstdirectory)]
+    if exists(BUNDLE_PATH):
+        if BUNDLE_PATH not in sys.path:
+            sys.path.append(BUNDLE_PATH)
+        sources.insert(0, builder.ZipMibSource(PACKAGE))
+    return sources
+
+if __name__ == '__main__':
+    modules = build_bundle()
+    print('%d modules bundled in %s' % (len(modules), BUNDLE_PATH))
@@ -1,43 +1,243 @@
 #!python3
 """
-Used to collect printer errors and sending 
+Used to collect printer errors and sending
 error alert to a mattermost channel configured in
-the config.py file. 
-Depends on matterhook https://github.com/numberly/matterhook
+the config.py file, and the other notifiers there, see notifier.py.
+
+Usage:
+    python monitoring_webhook.py
+    python monitoring_webhook.py --daemon
+    python monitoring_webhook.py --daemon --traps
+
+Without arguments the printers are checked once, e.g from cron. With --daemon
+the script keeps running and polls each printer on its own schedule, see
+polling.py. Send SIGHUP to the daemon to reload config.py. All the
+settings are reloaded except snmp_port and trap_port, see reload_config.
+
+With --traps the daemon also listens for the traps of the printers, see
+trap_receiver.py. A printer which sends a trap is checked right away and its
+alerts are sent without waiting for report_interval, while the printers
+without alerts are only polled every trap_poll_interval seconds to catch
+missed traps.
+
+Alerts are stored in alert_state.db, see alert_state.py, and only alerts which have been raised
+or cleared since the last check are sent. The messages are sent from the thread of the
+Notifier, so a slow chat server never delays the next check.
 """
+import asyncio
+import importlib
+import signal
+import time
+from argparse import ArgumentParser
+from datetime import timedelta
+
 import config as cfg
-from matterhook import Webhook
-from printer_mibs import get_printer_errors, ping
-import multiprocessing as mp
+import dns_cache
+import notifier as notifiers
+import printer_mibs
+import rtt
+from alert_state import AlertStore
+from alert_rules import get_rules
+from notifier import Notifier, make_sinks
+from printer_mibs import async_get_printer_alerts, iter_all
+from polling import PollScheduler
+from trap_receiver import TrapReceiver
+
+quiet = True
+pings = 5
+all_errors = False
+
+#Seconds a check from cron waits for its messages to be sent, the rest are
+#sent by the next check
+FLUSH_TIMEOUT = 30
+
+#Printers woken by a trap, their alerts are sent as soon as they are checked
+urgent = set()
+
+
+async def check_printer(printer, store):
+    """
+    Checks the alerts of one printer against the alert store
+
+    Returns:
+        online (bool): True if the printer answered
+        lines (list): a message for every alert raised or cleared
+    """
+    online, location, counter, alerts, model = await async_get_printer_alerts(
+            printer, pings - 1, store.counter(printer), list(store.active(printer)))
+    name = printer.split('.')[0].upper()
+    if not online:
+        lines = [] if quiet else ['{}: host \'{}\' unknown or offline'.format(name, printer)]
+        return False, lines
+    location = '?' if location is None else location
+    if alerts is None:
+        store.touch(printer)
+        return True, []
+    seconds = {alert.index: alert.seconds for alert in alerts}
+    if not all_errors:
+        alerts = get_rules().filter(alerts, printer, model)
+    alerts = {alert.index: alert.description for alert in alerts}
+    raised, cleared = store.update(printer, alerts, counter)
+    lines = ['%s (%s): %s in %s' % (name, location, description, timedelta(seconds=seconds[index]))
+             for index, description in raised]
+    lines += ['%s (%s): %s cleared after %s' % (name, location, description,
+                                                timedelta(seconds=int(time.time() - first_seen)))
+              for index, description, first_seen in cleared]
+    return True, lines
+
+async def check_guarded(printer, store):
+    """
+    check_printer, but a printer whose check fails is reported offline
+    instead of ending the checks of the other printers
+    """
+    try:
+        return await check_printer(printer, store)
+    except Exception as error:
+        print('Checking %s failed: %r' % (printer, error))
+        return False, []
+
+def check_once():
+    """
+    Checks all the printers once and sends the alerts raised or cleared
+    """
+    store = AlertStore()
+    notifier = Notifier(make_sinks())
+    lines = []
+    try:
+        #Running queries in parallel, the SNMP response doubles as the ping
+        for printer, (online, printer_lines) in iter_all(check_guarded, cfg.printers, store):
+            lines += printer_lines
+    finally:
+        notifier.notify(lines)
+        notifier.close(FLUSH_TIMEOUT)
+
+async def poll(printer, scheduler, semaphore, store, notifier, outbox, wakeup):
+    """
+    Polls one printer, puts it back on the schedule and wakes the main loop
+    to sleep until the new next poll. A printer whose check fails is put
+    back as offline, so it is never left in flight.
+    """
+    online, lines = False, []
+    try:
+        async with semaphore:
+            online, lines = await check_printer(printer, store)
+    except Exception as error:
+        print('Checking %s failed: %r' % (printer, error))
+    finally:
+        #A printer woken while it was polled is polled again before its alerts are sent
+        woken_again = printer in scheduler.woken
+        scheduler.report(printer, online, bool(store.active(printer)))
+        wakeup.set()
+    if printer in urgent and not woken_again:
+        urgent.discard(printer)
+        if lines:
+            notifier.notify(lines)
+            return
+    outbox += lines
+
+async def poll_forever(scheduler, store, notifier, wakeup=None):
+    """
+    Daemon main loop. Starts a poll of each printer when it is due, and
+    sends the alerts raised or cleared every report_interval seconds.
+
+    Args:
+        wakeup(asyncio.Event): set when the schedule has changed, e.g a
+            printer has been woken by a trap
+    """
+    wakeup = wakeup or asyncio.Event()
+    concurrency = printer_mibs.CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    outbox = []
+    next_report = time.monotonic() + getattr(cfg, 'report_interval', 30)
+    while True:
+        now = time.monotonic()
+        if concurrency != printer_mibs.CONCURRENCY:
+            #Changed by reload_config, the polls running finish on the old semaphore
+            concurrency = printer_mibs.CONCURRENCY
+            semaphore = asyncio.Semaphore(concurrency)
+        for printer in scheduler.due(now):
+            asyncio.ensure_future(poll(printer, scheduler, semaphore, store, notifier, outbox,
+                                       wakeup))
+        if now >= next_report:
+            notifier.notify(outbox)
+            del outbox[:]
+            next_report = now + getattr(cfg, 'report_interval', 30)
+        next_due = scheduler.next_time() or next_report
+        try:
+            await asyncio.wait_for(wakeup.wait(),
+                                   max(0, min(next_due, next_report) - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+def intervals(traps=False):
+    """
+    Returns the PollScheduler intervals set in config.py
+    """
+    return {'healthy_interval': getattr(cfg, 'trap_poll_interval', 3600) if traps
+                                else getattr(cfg, 'poll_interval', 300),
+            'alert_interval': getattr(cfg, 'alert_poll_interval', 30),
+            'max_backoff': getattr(cfg, 'max_backoff', 3600)}
+
+def reload_config(scheduler, notifier, receiver=None):
+    """
+    SIGHUP handler. Rereads config.py and updates the printers polled,
+    their intervals and the notifiers. The modules which keep settings of
+    config.py read them again:
+        printer_mibs: concurrency
+        dns_cache: dns_ttl
+        rtt: adaptive_timeouts, fast_fail, min_timeout and the breaker_ settings
+        notifier: webhook_max_length, notify_max_age, and webhook_min_interval
+            of the new sinks
+    report_interval, ignore_list and alert_rules are read when used.
+    snmp_port and trap_port need a restart.
+    """
+    importlib.reload(cfg)
+    for module in (printer_mibs, dns_cache, rtt, notifiers):
+        module.configure()
+    for name, value in intervals(receiver is not None).items():
+        setattr(scheduler, name, value)
+    scheduler.update(cfg.printers)
+    notifier.update(make_sinks())
+    if receiver is not None:
+        receiver.update(cfg.printers)
+
+def run_daemon(traps=False):
+    """
+    Runs the monitoring daemon until it is killed
+
+    Args:
+        traps(bool): listen for traps and poll the healthy printers every
+            trap_poll_interval seconds only
+    """
+    scheduler = PollScheduler(cfg.printers, **intervals(traps))
+    loop = asyncio.get_event_loop()
+    wakeup = asyncio.Event()
+    notifier = Notifier(make_sinks())
+    receiver = None
+    if traps:
+        def trap_received(trap):
+            if scheduler.wake(trap.printer):
+                urgent.add(trap.printer)
+                wakeup.set()
+        receiver = TrapReceiver(trap_received, cfg.printers)
+        receiver.start()
+    loop.add_signal_handler(signal.SIGHUP, reload_config, scheduler, notifier, receiver)
+    loop.run_until_complete(poll_forever(scheduler, AlertStore(), notifier, wakeup))
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-d', '--daemon',
+        action='store_true',
+        help='Keep running and poll the printers on an adaptive schedule')
+    parser.add_argument('-t', '--traps',
+        action='store_true',
+        help='With --daemon, check a printer as soon as it sends a trap')
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    quiet = True
-    pings = 5
-    all_errors = False
-    error = ''
-  
-    #Ping all printers in parallel
-    with mp.Pool(32) as pool:
-        ping_async = [pool.apply_async(ping, args=(printer, pings)) for printer in cfg.printers]
-        active_printers = [i for i, p in zip(cfg.printers, ping_async) if p.get()] 
-        inactive_printers = [i for i, p in zip(cfg.printers, ping_async) if not p.get()] 
-        
-    if inactive_printers and not quiet:
-        for printer in inactive_printers:
-            error += '{}: host \'{}\' unknown or offline\n'.format(printer.split('.')[0].upper(), printer)
-
-    #Running queries in parallel
-    with mp.Pool(32) as pool:
-        err = []
-        for printer in active_printers:
-            err.append(pool.apply_async(get_printer_errors, args=(printer, cfg.ignore_list, all_errors)))
-       
-        if err:
-            err = [str(e.get()) for e in err]
-            err = list(filter(None, err))
-            error += ''.join(err)
-            error = error.strip('\n')
-    
-    if len(error) > 0:
-        mwh = Webhook(cfg.webhook_url, cfg.webhook_key)
-        mwh.send(error.replace('\xe6', 'ae').replace('\xf8', 'oe').replace('\xe5', 'aa'))
+    args = argparser()
+    if args.daemon:
+        run_daemon(args.traps)
+    else:
+        check_once()
@@ -0,0 +1,410 @@
+#!python3
+"""
+Delivers the alert messages of monitoring_webhook.py to one or more sinks.
+
+notify() only hands the lines to a background thread, so a slow or
+unreachable chat server never holds up the checks of the printers. The
+thread normalizes the text with one translation table pass, splits it into
+messages of at most webhook_batch_size lines and webhook_max_length
+characters, and writes them to notify_queue.db before sending them. A
+message is only removed from the queue once its sink has taken it, so the
+messages of a sink which is down are sent, in order, when it is back, also
+after a restart. The HTTP sinks share a pool of keep-alive connections.
+
+The sinks are set with notifiers in config.py, by default the Mattermost
+webhook of webhook_url and webhook_key:
+
+    notifiers = [('mattermost', webhook_url, webhook_key),
+                 ('json', 'https://alerts.example.com/printers', {'Authorization': 'Bearer token'}),
+                 ('file', '/var/log/printer_alerts.log')]
+
+Usage:
+    python notifier.py 'Test message'
+"""
+__all__ = ['Notifier', 'MattermostSink', 'JsonSink', 'FileSink', 'HTTPPool',
+           'RejectedError', 'SINKS', 'TRANSLATION', 'chunk', 'make_sinks', 'configure']
+import hashlib
+import http.client
+import json
+import queue
+import sqlite3
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from os.path import dirname, join
+from urllib.parse import urlsplit
+
+import config as cfg
+
+#Replaced in every message, as the chained .replace calls did
+TRANSLATION = str.maketrans({'\xe6': 'ae', '\xf8': 'oe', '\xe5': 'aa',
+                             '\xc6': 'AE', '\xd8': 'OE', '\xc5': 'AA'})
+
+#Seconds to wait for an HTTP sink to answer
+HTTP_TIMEOUT = 10
+
+#Seconds between tries of a sink which failed, doubled up to RETRY_MAX
+RETRY_MIN = 5
+RETRY_MAX = 600
+
+
+def configure():
+    """
+    Reads webhook_max_length and notify_max_age from config.py
+    """
+    global MAX_LENGTH, MAX_AGE
+    #Longest message sent. Mattermost rejects posts over 16383 characters,
+    #4000 before version 5.0
+    MAX_LENGTH = getattr(cfg, 'webhook_max_length', 4000)
+
+    #Messages still queued after this many seconds are dropped
+    MAX_AGE = getattr(cfg, 'notify_max_age', 24*3600)
+
+configure()
+
+
+class RejectedError(Exception):
+    """
+    The sink refused the message, sending it again would not help
+    """
+
+
+def chunk(lines, max_lines=50, max_length=None):
+    """
+    Splits the lines into messages of at most max_lines lines and
+    max_length characters, default MAX_LENGTH. Lines longer than max_length
+    are split as well.
+
+    Returns:
+        messages(list): the lines of each message joined by newlines
+    """
+    max_length = max_length or MAX_LENGTH
+    messages = []
+    current = []
+    length = 0
+    for line in lines:
+        for start in range(0, max(len(line), 1), max_length):
+            piece = line[start:start + max_length]
+            if current and (len(current) >= max_lines or length + 1 + len(piece) > max_length):
+                messages.append('\n'.join(current))
+                current, length = [], 0
+            length += len(piece) + (1 if current else 0)
+            current.append(piece)
+    if current:
+        messages.append('\n'.join(current))
+    return messages
+
+
+class HTTPPool:
+    """
+    Keep-alive HTTP(S) connections, one for each host. Not thread safe, it
+    is only used by the thread of the Notifier.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.connections = {}
+
+    def post(self, url, body, headers):
+        """
+        Posts body to url, on a new connection if the kept one has been
+        closed by the server
+
+        Returns:
+            status(int): HTTP status of the answer
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for reused in (key in self.connections, False):
+            connection = self.connections.get(key)
+            if connection is None:
+                kind = (http.client.HTTPSConnection if parts.scheme == 'https'
+                        else http.client.HTTPConnection)
+                connection = self.connections[key] = kind(parts.netloc, timeout=self.timeout)
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                #Read to the end, or the connection can not be used again
+                response.read()
+                if response.will_close:
+                    self._drop(key)
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self._drop(key)
+                if not reused:
+                    raise
+
+    def _drop(self, key):
+        connection = self.connections.pop(key, None)
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        for key in list(self.connections):
+            self._drop(key)
+
+
+class _HTTPSink:
+    """
+    Base of the sinks posting JSON
+    """
+
+    def __init__(self, url, headers=None):
+        self.url = url
+        self.min_interval = getattr(cfg, 'webhook_min_interval', 2)
+        self.headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        self.name = '%s %s' % (type(self).__name__, url)
+        #The messages of the sink in notify_queue.db
+        self.queue_key = self.name
+
+    def payload(self, message):
+        return {'text': message}
+
+    def send(self, message, pool):
+        """
+        Posts the message. Raises RejectedError if the endpoint refused it,
+        and OSError or HTTPException if it should be sent again later.
+        """
+        status = pool.post(self.url, json.dumps(self.payload(message)).encode('utf-8'),
+                           self.headers)
+        #Too many requests and timeouts are worth a retry, other client errors are not
+        if 400 <= status < 500 and status not in (408, 429):
+            raise RejectedError('%s answered %i' % (self.name, status))
+        if status >= 300:
+            raise http.client.HTTPException('%s answered %i' % (self.name, status))
+
+
+class MattermostSink(_HTTPSink):
+    """
+    Mattermost incoming webhook
+
+    Args:
+        url(str): the Mattermost server, e.g webhook_url in config.py
+        key(str): the key of the webhook, e.g webhook_key in config.py
+        channel(str): channel to post in, default the one of the webhook
+    """
+
+    def __init__(self, url, key, channel=None):
+        super().__init__(url.rstrip('/') + '/hooks/' + key)
+        self.channel = channel
+        #The key is left out of the name, which is printed, but webhooks with
+        #the same name must not share a queue, so a digest of it is queued by
+        self.name = ('MattermostSink %s %s' % (url, channel or '')).strip()
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+        self.queue_key = '%s %s' % (self.name, digest)
+
+    def payload(self, message):
+        payload = {'text': message}
+        if self.channel:
+            payload['channel'] = self.channel
+        return payload
+
+
+class JsonSink(_HTTPSink):
+    """
+    Generic JSON webhook, posted {"text": message, "lines": [...], "sent": unix time}
+
+    Args:
+        url(str): endpoint
+        headers(dict): extra HTTP headers, e.g Authorization
+    """
+
+    def payload(self, message):
+        return {'text': message, 'lines': message.split('\n'), 'sent': time.time()}
+
+
+class FileSink:
+    """
+    Appends the messages to a local file, every line stamped with the time
+
+    Args:
+        path(str): file written
+    """
+    min_interval = 0
+
+    def __init__(self, path):
+        self.path = path
+        self.name = 'FileSink %s' % path
+        self.queue_key = self.name
+
+    def send(self, message, pool=None):
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with open(self.path, 'a', encoding='utf-8') as outfile:
+            outfile.write(''.join('%s %s\n' % (stamp, line) for line in message.split('\n')))
+
+
+SINKS = {'mattermost': MattermostSink, 'json': JsonSink, 'file': FileSink}
+
+
+def make_sinks(notifiers=None):
+    """
+    Returns the sinks of notifiers, default notifiers in config.py, or the
+    Mattermost webhook of webhook_url and webhook_key if there is none
+    """
+    if notifiers is None:
+        notifiers = getattr(cfg, 'notifiers', [('mattermost', cfg.webhook_url, cfg.webhook_key)])
+    return [SINKS[kind](*args) for kind, *args in notifiers]
+
+
+class Notifier:
+    """
+    Sends the messages to the sinks from a background thread, through the
+    retry queue in notify_queue.db
+
+    Args:
+        sinks(list): e.g from make_sinks
+        path(str): database file of the queue, created if it does not exist
+        batch_size(int): most lines in one message, default webhook_batch_size
+            in config.py, read for every message
+
+    Example:
+        notifier = Notifier(make_sinks())
+        notifier.notify(['PRINTER1 (3301): Paper jam in 0:00:12'])
+        notifier.close(timeout=30)
+    """
+
+    def __init__(self, sinks, path=join(dirname(__file__), 'notify_queue.db'),
+                 batch_size=None):
+        self.sinks = sinks
+        self.path = path
+        self.batch_size = batch_size
+        self.inbox = queue.Queue()
+        #When each sink may be sent to next, and the number of failures in a row
+        self.next_send = {}
+        self.failures = {}
+        self.closing = False
+        #Set while nothing is waiting to be sent, the lock keeps notify and
+        #the thread from clearing and setting it out of order
+        self.idle = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def notify(self, lines):
+        """
+        Queues the lines for all the sinks, without waiting for them
+        """
+        if lines:
+            with self.lock:
+                self.idle.clear()
+                self.inbox.put(('lines', list(lines)))
+
+    def update(self, sinks):
+        """
+        Replaces the sinks, e.g after config.py is reloaded. The messages
+        queued for sinks which are gone stay in the queue until MAX_AGE.
+        """
+        self.inbox.put(('sinks', list(sinks)))
+
+    def close(self, timeout=None):
+        """
+        Waits up to timeout seconds for the queued messages to be sent, and
+        stops the thread. Messages not sent by then are sent by the next run.
+        A message being sent is waited for, at most HTTP_TIMEOUT for each
+        connection tried, so it is not taken off the queue after the process
+        has gone and sent again by the next run.
+
+        Returns:
+            sent(bool): True if the queue was emptied
+        """
+        sent = self.idle.wait(timeout)
+        self.closing = True
+        self.inbox.put(None)
+        self.thread.join()
+        return sent
+
+    def _run(self):
+        db = sqlite3.connect(self.path)
+        with db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS messages (
+                              id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              sink TEXT NOT NULL,
+                              message TEXT NOT NULL,
+                              queued REAL NOT NULL)''')
+        pool = HTTPPool()
+        try:
+            #The messages left by the last run are sent first
+            wait = 0
+            while not self.closing:
+                try:
+                    item = self.inbox.get(timeout=wait)
+                except queue.Empty:
+                    item = ('', None)
+                if item is None:
+                    break
+                kind, value = item
+                if kind == 'lines':
+                    self._queue(db, value)
+                elif kind == 'sinks':
+                    self.sinks = value
+                wait = self._deliver(db, pool)
+        finally:
+            pool.close()
+            db.close()
+
+    def _queue(self, db, lines):
+        text = '\n'.join(lines).translate(TRANSLATION)
+        messages = chunk(text.split('\n'),
+                         self.batch_size or getattr(cfg, 'webhook_batch_size', 50))
+        now = time.time()
+        with db:
+            db.executemany('INSERT INTO messages (sink, message, queued) VALUES (?, ?, ?)',
+                           [(sink.queue_key, message, now) for sink in self.sinks
+                            for message in messages])
+
+    def _deliver(self, db, pool):
+        """
+        Sends the queued messages of every sink which is due, in order,
+        until one fails or the inbox has new lines
+
+        Returns:
+            wait(float): seconds until a sink is due, None to wait for new lines
+        """
+        with db:
+            db.execute('DELETE FROM messages WHERE queued < ?', (time.time() - MAX_AGE,))
+        wait = None
+        for sink in self.sinks:
+            while self.inbox.empty() and not self.closing:
+                row = db.execute('SELECT id, message FROM messages WHERE sink = ? ORDER BY id',
+                                 (sink.queue_key,)).fetchone()
+                if row is None:
+                    break
+                due = self.next_send.get(sink.queue_key, 0) - time.monotonic()
+                if due > 0:
+                    wait = due if wait is None else min(wait, due)
+                    break
+                try:
+                    sink.send(row[1], pool)
+                except RejectedError as error:
+                    print('Message dropped: %s' % error)
+                except (http.client.HTTPException, OSError) as error:
+                    failures = self.failures[sink.queue_key] = self.failures.get(sink.queue_key, 0) + 1
+                    delay = min(RETRY_MAX, RETRY_MIN*2**(failures - 1))
+                    print('Sending to %s failed, trying again in %is: %s' % (sink.name, delay, error))
+                    self.next_send[sink.queue_key] = time.monotonic() + delay
+                    continue
+                self.failures.pop(sink.queue_key, None)
+                self.next_send[sink.queue_key] = time.monotonic() + sink.min_interval
+                with db:
+                    db.execute('DELETE FROM messages WHERE id = ?', (row[0],))
+        if wait is None and self.inbox.empty():
+            #Only messages of sinks which are gone may be left
+            names = [sink.queue_key for sink in self.sinks]
+            if not db.execute('SELECT 1 FROM messages WHERE sink IN (%s) LIMIT 1'
+                              % ','.join('?'*len(names)), names).fetchone():
+                with self.lock:
+                    if self.inbox.empty():
+                        self.idle.set()
+        return wait
+
+if __name__ == '__main__':
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('message', help='Text sent to all the notifiers in config.py')
+    args = parser.parse_args()
+    notifier = Notifier(make_sinks())
+    notifier.notify([args.message])
+    if not notifier.close(timeout=HTTP_TIMEOUT*2):
+        print('Not sent yet, kept in notify_queue.db')
@@ -0,0 +1,123 @@
+#!python3
+"""
+Numeric OIDs of the MIB objects queried by the scripts.
+
+Resolving a name like ('Printer-MIB', 'prtAlertDescription') makes pysnmp
+load the compiled MIB module and every module it imports, which is the
+slowest part of the first query of every run. The names are resolved once
+and stored in oid_index.json, so later runs build numeric ObjectIdentity
+values straight from the index without loading any MIB modules.
+
+Names missing from the index are resolved against the compiled MIBs in
+dstdirectory the first time they are used, and added to the index.
+create_pymibs.py rebuilds the index after compiling the MIBs, or run
+
+    python oid_index.py
+"""
+__all__ = ['NAMES', 'oid', 'object_type', 'build_index']
+from functools import lru_cache
+from os.path import dirname, join
+
+from pysnmp.hlapi import ObjectIdentity, ObjectType
+from pysnmp.smi import builder, view
+
+import json_state
+from mib_bundle import mib_sources
+
+INDEX_PATH = join(dirname(__file__), 'oid_index.json')
+
+#The MIB objects used by the scripts, resolved up front by build_index
+NAMES = [('SNMPv2-MIB', 'sysDescr'),
+         ('SNMPv2-MIB', 'sysObjectID'),
+         ('SNMPv2-MIB', 'sysLocation'),
+         ('DISMAN-EVENT-MIB', 'sysUpTimeInstance'),
+         ('Printer-MIB', 'prtAlertAllEvents'),
+         ('Printer-MIB', 'prtAlertDescription'),
+         ('Printer-MIB', 'prtAlertSeverityLevel'),
+         ('Printer-MIB', 'prtAlertTime'),
+         ('Printer-MIB', 'prtConsoleDisplayBufferText'),
+         ('Printer-MIB', 'prtGeneralPrinterName'),
+         ('Printer-MIB', 'prtMarkerLifeCount'),
+         ('Printer-MIB', 'prtMarkerSuppliesDescription'),
+         ('Printer-MIB', 'prtMarkerSuppliesLevel'),
+         ('Printer-MIB', 'prtMarkerSuppliesMaxCapacity')]
+
+#'MIB-name::variable' -> list of sub-identifiers, loaded from INDEX_PATH on first use
+_index = None
+
+#Only created when a name is missing from the index
+_mib_view = None
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        _index = json_state.load(INDEX_PATH)
+    return _index
+
+def _save_index(replace=False):
+    """
+    Adds the names resolved to the index on disk, or replaces it with them
+    """
+    global _index
+    def merge(index):
+        if replace:
+            index.clear()
+        index.update(_index)
+    try:
+        _index = json_state.update(INDEX_PATH, merge, indent=4, sort_keys=True)
+    except OSError:
+        #A read-only install still works, the names are resolved again next run
+        pass
+
+def _resolve(mib_name, mib_variable):
+    """
+    Resolves a name against the compiled MIBs
+    """
+    global _mib_view
+    if _mib_view is None:
+        mib_builder = builder.MibBuilder()
+        mib_builder.addMibSources(*mib_sources())
+        _mib_view = view.MibViewController(mib_builder)
+    return list(ObjectIdentity(mib_name, mib_variable).resolveWithMib(_mib_view).getOid())
+
+def oid(mib_name, mib_variable, *mib_id):
+    """
+    Returns the numeric OID of a MIB object instance as a tuple
+
+    Example:
+        oid('Printer-MIB', 'prtMarkerLifeCount', 1, 1)
+        (1, 3, 6, 1, 2, 1, 43, 10, 2, 1, 4, 1, 1)
+    """
+    index = _load_index()
+    key = '%s::%s' % (mib_name, mib_variable)
+    if key not in index:
+        index[key] = _resolve(mib_name, mib_variable)
+        _save_index()
+    return tuple(index[key]) + tuple(int(sub_id) for sub_id in mib_id)
+
+@lru_cache(maxsize=None)
+def object_type(query):
+    """
+    Returns the ObjectType for a (mib_name, mib_variable, *mib_id) query.
+    The same ObjectType is returned for the same query, and pysnmp skips
+    resolving it again once it has been sent.
+    """
+    return ObjectType(ObjectIdentity(oid(*query)))
+
+def build_index(names=NAMES):
+    """
+    Resolves the names against the compiled MIBs and writes the index
+
+    Returns:
+        index(dict): 'MIB-name::variable' -> list of sub-identifiers
+    """
+    global _index
+    _index = {'%s::%s' % name: _resolve(*name) for name in names}
+    _save_index(replace=True)
+    object_type.cache_clear()
+    return _index
+
+if __name__ == '__main__':
+    for name, sub_ids in sorted(build_index().items()):
+        print('%s = %s' % (name, '.'.join(str(sub_id) for sub_id in sub_ids)))
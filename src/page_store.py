@@ -0,0 +1,145 @@
+#!python3
+"""
+Page count history of the printers, stored in SQLite.
+
+Every daily page count is one row keyed by (printer, day), so adding a day
+costs the same no matter how long the history is, and a report only reads
+the days it needs. Writes are done in transactions on a write-ahead log, so
+a crash never leaves a half written file behind.
+
+Replaces page_count.json. The old file can be imported with migrate_json.
+"""
+__all__ = ['PageCountStore']
+import json
+import sqlite3
+from os.path import dirname, join
+
+
+class PageCountStore:
+    """
+    Args:
+        path(str): database file, created if it does not exist
+
+    Example:
+        store = PageCountStore()
+        store.add_printer('example_printer1.printer.example.com', 1234)
+        store.record('example_printer1.printer.example.com', '2019-10-01', 1000)
+        store.counts_on('2019-10-01')
+        {'example_printer1.printer.example.com': 1000}
+    """
+
+    def __init__(self, path=join(dirname(__file__), 'page_count.db')):
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS printers (
+                                   printer TEXT PRIMARY KEY,
+                                   location TEXT)''')
+            #count is NULL for days the printer could not be queried,
+            #with the reason why in reason
+            self.db.execute('''CREATE TABLE IF NOT EXISTS page_counts (
+                                   printer TEXT NOT NULL,
+                                   day TEXT NOT NULL,
+                                   count INTEGER,
+                                   reason TEXT,
+                                   PRIMARY KEY (printer, day)) WITHOUT ROWID''')
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(page_counts)')]
+            if 'reason' not in columns:
+                self.db.execute('ALTER TABLE page_counts ADD COLUMN reason TEXT')
+            self.db.execute('CREATE INDEX IF NOT EXISTS page_counts_day ON page_counts (day)')
+
+    def printers(self):
+        """
+        Returns a dict printer -> location of all the printers in the dataset
+        """
+        return dict(self.db.execute('SELECT printer, location FROM printers ORDER BY printer'))
+
+    def add_printer(self, printer, location):
+        """
+        Adds a printer. Returns False if it is already in the dataset.
+        """
+        try:
+            with self.db:
+                self.db.execute('INSERT INTO printers VALUES (?, ?)', (printer, str(location)))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def remove_printer(self, printer):
+        """
+        Removes a printer and its history. Returns False if it is not in the dataset.
+        """
+        with self.db:
+            removed = self.db.execute('DELETE FROM printers WHERE printer = ?', (printer,)).rowcount
+            self.db.execute('DELETE FROM page_counts WHERE printer = ?', (printer,))
+        return removed > 0
+
+    def record(self, printer, day, count, reason=None):
+        """
+        Stores the page count of a printer on a day. If the page count is
+        unknown count is None, and reason tells why.
+        """
+        self.record_many([(printer, day, count, reason)])
+
+    def record_many(self, counts):
+        """
+        Stores a list of (printer, day, count, reason) in one transaction
+        """
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO page_counts (printer, day, count, reason) '
+                                'VALUES (?, ?, ?, ?)', counts)
+
+    def counts_on(self, day):
+        """
+        Returns a dict printer -> page count on the day. Printers without
+        a page count that day are left out.
+        """
+        return dict(self.db.execute('SELECT printer, count FROM page_counts WHERE day = ?', (day,)))
+
+    def failures_on(self, day):
+        """
+        Returns a dict printer -> reason for the printers which could not
+        be queried on the day
+        """
+        return dict(self.db.execute('SELECT printer, reason FROM page_counts '
+                                    'WHERE day = ? AND count IS NULL', (day,)))
+
+    def counts_between(self, start, end):
+        """
+        Returns the page counts from start to end, both included, as a
+        dict printer -> {day: count}. Days are YYYY-MM-DD strings.
+        """
+        counts = {}
+        for printer, day, count in self.db.execute(
+                'SELECT printer, day, count FROM page_counts WHERE day BETWEEN ? AND ? '
+                'ORDER BY printer, day', (start, end)):
+            counts.setdefault(printer, {})[day] = count
+        return counts
+
+    def migrate_json(self, json_path):
+        """
+        Imports the printers and page counts from a page_count.json file made
+        by earlier versions of printer_stats.py. Entries already in the store
+        are kept. 'n/a' page counts are stored as None.
+
+        Returns:
+            imported(int): number of page counts imported
+        """
+        with open(json_path, 'r') as infile:
+            data = json.load(infile)
+        counts = []
+        for printer, history in data.items():
+            for day, count in history.items():
+                if day == 'location':
+                    continue
+                counts.append((printer, day, int(count) if str(count).isdigit() else None, None))
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO printers VALUES (?, ?)',
+                                [(printer, str(history.get('location')))
+                                 for printer, history in data.items()])
+            self.db.executemany('INSERT OR IGNORE INTO page_counts (printer, day, count, reason) '
+                                'VALUES (?, ?, ?, ?)', counts)
+        return len(counts)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,121 @@
+#!python3
+"""
+Per-printer polling schedule used by the monitoring daemon.
+
+Healthy printers are polled rarely, printers with alerts are polled often,
+and printers which do not answer are backed off exponentially so dead hosts
+do not eat up the query slots.
+"""
+__all__ = ['PollScheduler']
+import heapq
+import random
+import time
+
+
+class PollScheduler:
+    """
+    Keeps the time each printer is due to be polled next in a heap.
+    Printers are taken out of the heap by due() and put back by report()
+    once the poll is done, so a printer is never polled twice at the same time.
+
+    Args:
+        printers(list): printer names
+        healthy_interval(float): seconds between polls of printers without alerts
+        alert_interval(float): seconds between polls of printers with alerts
+        max_backoff(float): longest time between polls of unreachable printers
+        jitter(float): fraction the intervals are randomly varied by, so
+            printers polled at the same time drift apart
+
+    Example:
+        scheduler = PollScheduler(cfg.printers)
+        for printer in scheduler.due():
+            ...
+            scheduler.report(printer, online=True, alerts=False)
+    """
+
+    def __init__(self, printers, healthy_interval=300, alert_interval=30,
+                 max_backoff=3600, jitter=0.1):
+        self.healthy_interval = healthy_interval
+        self.alert_interval = alert_interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.failures = {}
+        self.in_flight = set()
+        self.woken = set()
+        self.heap = []
+        self.update(printers)
+
+    def update(self, printers):
+        """
+        Sets the printers to poll, e.g after config.py has been reloaded.
+        New printers are polled right away, removed printers are dropped.
+        """
+        now = time.monotonic()
+        self.printers = set(printers)
+        scheduled = {printer for _, printer in self.heap}
+        self.heap = [(due, printer) for due, printer in self.heap if printer in self.printers]
+        self.heap += [(now, printer) for printer in self.printers - scheduled - self.in_flight]
+        heapq.heapify(self.heap)
+        self.failures = {p: n for p, n in self.failures.items() if p in self.printers}
+
+    def due(self, now=None):
+        """
+        Returns the printers which are due to be polled, and takes them off
+        the schedule until they are reported
+        """
+        now = time.monotonic() if now is None else now
+        printers = []
+        while self.heap and self.heap[0][0] <= now:
+            printers.append(heapq.heappop(self.heap)[1])
+        self.in_flight.update(printers)
+        return printers
+
+    def wake(self, printer, now=None):
+        """
+        Makes a printer due right away, e.g when it has sent a trap. A printer
+        being polled is polled again as soon as it is reported.
+
+        Returns:
+            bool: False if the printer is not polled
+        """
+        if printer not in self.printers:
+            return False
+        if printer in self.in_flight:
+            self.woken.add(printer)
+            return True
+        now = time.monotonic() if now is None else now
+        self.heap = [(due, p) for due, p in self.heap if p != printer]
+        self.heap.append((now, printer))
+        heapq.heapify(self.heap)
+        return True
+
+    def next_time(self):
+        """
+        Returns when the next printer is due, or None if nothing is scheduled
+        """
+        return self.heap[0][0] if self.heap else None
+
+    def report(self, printer, online, alerts):
+        """
+        Schedules the next poll of a printer from the outcome of the last one
+
+        Args:
+            printer(str): printer name
+            online(bool): True if the printer answered
+            alerts(bool): True if the printer has alerts
+        """
+        self.in_flight.discard(printer)
+        if printer not in self.printers:
+            return
+        if printer in self.woken:
+            self.woken.discard(printer)
+            heapq.heappush(self.heap, (time.monotonic(), printer))
+            return
+        if not online:
+            self.failures[printer] = self.failures.get(printer, 0) + 1
+            interval = min(self.alert_interval * 2**self.failures[printer], self.max_backoff)
+        else:
+            self.failures.pop(printer, None)
+            interval = self.alert_interval if alerts else self.healthy_interval
+        interval *= 1 + random.uniform(-self.jitter, self.jitter)
+        heapq.heappush(self.heap, (time.monotonic() + interval, printer))
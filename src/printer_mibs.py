@@ -2,19 +2,203 @@
 """
 The main library used to collect the printer information
 """
-__all__ = ['ping', 'get_mib', 'walk_mib', 'get_printer_errors']
+__all__ = ['ping', 'get_mib', 'get_mibs', 'walk_mib', 'walk_mibs', 'get_printer_errors',
+           'async_ping', 'async_get_mibs', 'async_walk_mibs', 'async_get_printer_errors',
+           'async_check_printer_errors', 'async_walk_rows', 'async_get_printer_alerts',
+           'get_engine', 'get_async_engine', 'PrinterSession', 'get_session',
+           'Alert', 'SupplyLevel', 'PrinterStatus', 'async_get_printer_status',
+           'async_get_supplies', 'get_supply_layouts', 'async_get_changed', 'get_change_cache',
+           'format_alerts', 'walk_rows', 'run_all', 'async_iter_all', 'iter_all', 'configure']
 from pysnmp.hlapi import *
-from pysnmp.smi import builder
+from pysnmp.hlapi.varbinds import CommandGeneratorVarBinds
+import pysnmp.hlapi.asyncio as aiosnmp
+import asyncio
+import time
+from mib_bundle import mib_sources
+from oid_index import object_type, oid
+import dns_cache
+from alert_rules import AlertRules, get_rules
+from records import Alert, SupplyLevel, PrinterStatus, location_room
+import supplies
+from change_cache import ChangeCache
+from instrumentation import recorder
+from rtt import RttEstimator, TIMER_RESOLUTION
+from pysnmp.carrier.asyncio.dispatch import AsyncioDispatcher
+from pysnmp.carrier.asyncore.dispatch import AsyncoreDispatcher
+from pysnmp.proto import errind
+from pysnmp.error import PySnmpError
+from pysnmp.proto.rfc1905 import EndOfMibView
 from subprocess import CalledProcessError, check_output, STDOUT
 import config as cfg
-from datetime import datetime, timedelta
-import re
+from datetime import timedelta
 
-#Setting the PyMib source directory which has been build with create_mibs.py
-engine = SnmpEngine()
-engine.getMibBuilder().addMibSources(builder.DirMibSource(cfg.dstdirectory))
+#The engines are created on first use by get_engine and get_async_engine,
+#so importing this module does not pay for engines the script never uses
+engine = None
+async_engine = None
 
 
+def configure():
+    """
+    Reads concurrency from config.py. snmp_port is only read at import, as
+    the sessions of the printers keep their port.
+    """
+    global CONCURRENCY
+    #Largest number of printers queried at the same time by run_all
+    CONCURRENCY = getattr(cfg, 'concurrency', 256)
+
+configure()
+
+#pysnmp default number of retransmissions of a request before giving up,
+#and seconds to wait for a response
+RETRIES = 5
+TIMEOUT = 1
+
+#UDP port of the printers' SNMP agents
+SNMP_PORT = getattr(cfg, 'snmp_port', 161)
+
+#Upper bound on varBinds per GET PDU. Most agents accept far more, but
+#the SNMP minimum message size (484 octets) only guarantees about this many.
+MAX_VARBINDS = 10
+
+#Rows asked for in each GETBULK request when walking tables
+MAX_REPETITIONS = 25
+
+#Agents which did not answer SNMPv2c GETBULK and are walked with SNMPv1 GETNEXT
+v1_agents = set()
+
+#Agents without the prtAlertAllEvents counter, which always have their alert table walked
+no_alert_counter = set()
+
+#The prtAlertTable columns walked for the alerts
+ALERT_COLUMNS = [('Printer-MIB', 'prtAlertDescription', 1),
+                 ('Printer-MIB', 'prtAlertTime', 1)]
+
+#The uptime used to date the alerts, the location, and the model the alert
+#rules are matched against. Asked for first on its own, as SNMPv1 agents fail
+#the whole GET if one OID is missing, and every missing one costs a GET more,
+#see _no_such_name.
+STATUS_QUERIES = [('DISMAN-EVENT-MIB', 'sysUpTimeInstance'),
+                  ('SNMPv2-MIB', 'sysLocation', 0),
+                  ('SNMPv2-MIB', 'sysDescr', 0)]
+
+#The supply table layout of the printers, see get_supply_layouts
+supply_layouts = None
+
+#The uptime and rarely changing values of the printers, see get_change_cache
+change_cache = None
+
+UPTIME = ('DISMAN-EVENT-MIB', 'sysUpTimeInstance')
+
+#The PrinterSession of every printer queried, see get_session
+sessions = {}
+
+#Recorded by instrumentation for the pings, which are not SNMP queries
+PING = ('ICMP', 'echo')
+
+
+class PrinterSession:
+    """
+    The SNMP parameters of one printer, made once and reused by all the
+    queries to it instead of being built for every request.
+
+    The address is taken from dns_cache, so the host name is looked up once
+    every dns_cache.TTL seconds. Transport targets are made for each
+    timeout and retries used, and made again if the address changes.
+    Request IDs come from the engine, so all sessions share one request-ID space.
+
+    The timeout and retries asked for are upper bounds: the ones used come
+    from the RTT estimate of the printer, see rtt.py. Requests should not
+    be sent while rtt.available() is False.
+
+    Args:
+        host(str): printer name e.g example_printer1.printer.example.com
+        port(int): SNMP port of the agent
+
+    Example:
+        session = get_session('example_printer1.printer.example.com')
+        next(getCmd(get_engine(), session.v1, session.target(), session.context, ...))
+    """
+
+    def __init__(self, host, port=161):
+        self.host = host
+        self.port = port
+        self.v1 = CommunityData('public', mpModel=0)
+        self.v2c = CommunityData('public', mpModel=1)
+        self.context = ContextData()
+        self.address = None
+        self.targets = {}
+        self.rtt = RttEstimator()
+
+    def _target(self, target_class, address, timeout, retries):
+        if address is None:
+            raise PySnmpError('Unknown host %s' % self.host)
+        timeout, retries = self.rtt.limits(timeout, retries)
+        if address != self.address:
+            self.address = address
+            self.targets = {}
+        key = (target_class, timeout, retries)
+        if key not in self.targets:
+            self.targets[key] = target_class((address, self.port), timeout=timeout, retries=retries)
+        return self.targets[key]
+
+    def target(self, timeout=TIMEOUT, retries=RETRIES):
+        """
+        Returns the UdpTransportTarget of the printer.
+        Raises PySnmpError if the host is unknown.
+        """
+        return self._target(UdpTransportTarget, dns_cache.resolve(self.host), timeout, retries)
+
+    async def async_target(self, timeout=TIMEOUT, retries=RETRIES):
+        """
+        Returns the asyncio UdpTransportTarget of the printer, looking up the
+        address without blocking the event loop.
+        Raises PySnmpError if the host is unknown.
+        """
+        return self._target(aiosnmp.UdpTransportTarget, await dns_cache.async_resolve(self.host),
+                            timeout, retries)
+
+def get_session(printer):
+    """
+    Returns the PrinterSession of a printer, creating it on first use
+    """
+    session = sessions.get(printer)
+    if session is None:
+        session = sessions[printer] = PrinterSession(printer, SNMP_PORT)
+    return session
+
+
+def get_engine():
+    """
+    Returns the engine used by the synchronous functions, creating it on first use
+    """
+    global engine
+    if engine is None:
+        #Setting the PyMib source directory which has been build with create_mibs.py
+        engine = SnmpEngine()
+        #pysnmp looks for timed out requests every half second by default,
+        #which is too coarse for the timeouts set by rtt
+        engine.registerTransportDispatcher(AsyncoreDispatcher())
+        engine.transportDispatcher.setTimerResolution(TIMER_RESOLUTION)
+        engine.getMibBuilder().addMibSources(*mib_sources())
+        recorder.attach(engine)
+    return engine
+
+def get_async_engine():
+    """
+    Returns the engine used by the asyncio functions, creating it on first use.
+    All requests share one socket and one event loop, so thousands of them
+    can be in flight from a single process.
+    """
+    global async_engine
+    if async_engine is None:
+        async_engine = aiosnmp.SnmpEngine()
+        async_engine.registerTransportDispatcher(AsyncioDispatcher())
+        async_engine.transportDispatcher.setTimerResolution(TIMER_RESOLUTION)
+        async_engine.getMibBuilder().addMibSources(*mib_sources())
+        recorder.attach(async_engine)
+    return async_engine
+
 def ping(host, times=1):
     """
     Silently pings the host once. Returns true if host answers; false if it doesn't.
@@ -25,10 +209,14 @@ def ping(host, times=1):
         bool: True if connection is established, else False
     """
 
+    start = time.monotonic()
     try:
         check_output(['ping', '-c', str(times), host], stderr=STDOUT, universal_newlines=True)
     except CalledProcessError:
         return False
+    finally:
+        if recorder.enabled:
+            recorder.request(host, [PING], time.monotonic() - start)
     return True
 
 def get_mib(printer, mib_name, mib_variable, *mib_id):
@@ -67,38 +255,101 @@ def get_mib(printer, mib_name, mib_variable, *mib_id):
                 1,)
      
     """
-    return next(getCmd(engine,
-                CommunityData('public', mpModel=0),
-                UdpTransportTarget((printer, 161)),
-                ContextData(),
-                ObjectType(ObjectIdentity(mib_name, mib_variable, *mib_id).loadMibs()))
+    session = get_session(printer)
+    return next(getCmd(get_engine(),
+                session.v1,
+                session.target(),
+                session.context,
+                object_type((mib_name, mib_variable) + mib_id))
                 )[3][0][1]
 
-def walk_mib(printer, mib_name, mib_variable, *mib_id):
+def get_mibs(printer, queries, max_varbinds=MAX_VARBINDS):
     """
-    nextCmnd returns all the objects found as a generator. We convert this to a list.
-    Every object in the list is nested and indexed in the following way:
-    [3][0][1]
+    Batched version of get_mib. All the queries are sent in as few SNMP GET
+    PDUs as possible, at most max_varbinds varBinds in each. If the agent
+    answers with a tooBig error the chunk is split in half and resent, so we
+    settle on whatever PDU size the agent is able to handle.
 
-    The first index is a list of four elements with the first three being error values
-    and the last index [3] being the varBind we want
+    Args:
+        printer(str): name of printer
+        queries(list): list of (mib_name, mib_variable, *mib_id) tuples
+        max_varbinds(int): largest number of varBinds in one PDU
 
-    The second index is the varBind we want, however it is returned as a list because
-    it is possible to bulksearch for varBinds in pysnmp.hlapi.nextCmd(..). 
-    We have not implemented the bulk search and hence we
-    want the first (and only) index in this list [0]
+    Returns:
+        values(list): the values found, in the same order as the queries.
+            None is returned for queries the agent did not answer.
 
-    The varBind is a list of one element containing an objectType.
-    The object behaves as a list where element 0 is the mib number
-    and element 1 is the returned information we want, hence the index 1
+    Example:
+        We want the model and location of a printer in one request
+        get_mibs('example_printer1.printer.example.com',
+                 [('SNMPv2-MIB', 'sysDescr', 0),
+                  ('SNMPv2-MIB', 'sysLocation', 0)])
+    """
+    values = []
+    for start in range(0, len(queries), max_varbinds):
+        values += _get_chunk(printer, queries[start:start + max_varbinds])
+    return values
+
+def _get_chunk(printer, queries):
+    """
+    Sends one GET PDU for the queries, splitting it up if it is too big
+    for the agent.
+    """
+    session = get_session(printer)
+    if not session.rtt.available():
+        return [None]*len(queries)
+    try:
+        target = session.target()
+    except PySnmpError:
+        #Unknown host, reported as not answering
+        return [None]*len(queries)
+    start = time.monotonic()
+    error_indication, error_status, error_index, var_binds = next(
+                getCmd(get_engine(),
+                session.v1,
+                target,
+                session.context,
+                *[object_type(query) for query in queries])
+                )
+    session.rtt.record(time.monotonic() - start, error_indication, target.timeout)
+    if recorder.enabled:
+        recorder.request(printer, queries, time.monotonic() - start, error_indication,
+                         session.address)
+    too_big = error_status and error_status.prettyPrint() == 'tooBig'
+    if (too_big or error_indication is errind.tooBig) and len(queries) > 1:
+        half = len(queries)//2
+        return _get_chunk(printer, queries[:half]) + _get_chunk(printer, queries[half:])
+    missing = _no_such_name(error_status, error_index, queries)
+    if missing is not None:
+        rest = queries[:missing] + queries[missing + 1:]
+        values = _get_chunk(printer, rest) if rest else []
+        return values[:missing] + [None] + values[missing:]
+    if error_indication or error_status:
+        return [None]*len(queries)
+    return [var_bind[1] for var_bind in var_binds]
 
-    With lexiographicMode turned on the nextCmd will traverse the entire mib-tree.
+def _no_such_name(error_status, error_index, queries):
+    """
+    Returns the position of the query an SNMPv1 agent failed the whole GET
+    for as it does not have the object, or None. The other queries are then
+    asked for again without it, so one missing object does not make the
+    printer look offline.
+    """
+    if error_status and error_status.prettyPrint() == 'noSuchName' \
+            and 0 < int(error_index) <= len(queries):
+        return int(error_index) - 1
+    return None
+
+def walk_mib(printer, mib_name, mib_variable, *mib_id, bulk=True):
+    """
+    Walks a single mib column. See walk_mibs for how the walk is done.
 
     Args:  
         printer(str): name of printer
         mib_name(str): name of the mib file to search e.g Printer-MIB
         mib_variable(str): the name of the mib we want to search for in the mib file
         *mib_id(int): The mib variable instance identification. 
+        bulk(bool): walk with GETBULK, falling back to GETNEXT for SNMPv1 agents
 
     Returns:
         printer_info(list): a list of info found in the mib walk
@@ -110,17 +361,153 @@ def walk_mib(printer, mib_name, mib_variable, *mib_id):
                  'prtAlertDescription',
                  1)
     """
-    printer_info  = list(
-                nextCmd(engine,
-                CommunityData('public', mpModel=0),
-                UdpTransportTarget((printer, 161)),
-                ContextData(),
-                ObjectType(ObjectIdentity(mib_name, mib_variable, *mib_id)),
-                lexicographicMode=False)
-                )
-    printer_info  = [str(info[3][0][1]) for info in printer_info] 
-    return printer_info
+    return walk_mibs(printer, [(mib_name, mib_variable) + mib_id], bulk=bulk)[0]
+
+def walk_mibs(printer, queries, max_repetitions=MAX_REPETITIONS, bulk=True):
+    """
+    Walks several mib columns side by side in one pass. Every response
+    carries the next row of all the columns, so a table with n rows is walked in
+    n GETNEXT round trips, or n/max_repetitions GETBULK round trips.
+
+    GETBULK needs SNMPv2c. Agents which do not answer a GETBULK are walked
+    with SNMPv1 GETNEXT instead and remembered in v1_agents, so we only pay
+    the timeout once.
+
+    Columns shorter than the others are padded with endOfMibView by pysnmp
+    when they leave their subtree. These are skipped, so every column only holds
+    the rows found under its own mib.
+
+    Args:
+        printer(str): name of printer
+        queries(list): list of (mib_name, mib_variable, *mib_id) tuples
+        max_repetitions(int): rows asked for in each GETBULK request
+        bulk(bool): walk with GETBULK if the agent supports it
+
+    Returns:
+        columns(list): a list of info found for each of the queries
+
+    Example:
+        We want the description and time of all alerts
+        walk_mibs('example_printer1.printer.example.com',
+                  [('Printer-MIB', 'prtAlertDescription', 1),
+                   ('Printer-MIB', 'prtAlertTime', 1)])
+    """
+    columns = _walk_indexed(printer, queries, max_repetitions, bulk)
+    return [[value for _, value in column] for column in columns]
+
+def walk_rows(printer, queries, max_repetitions=MAX_REPETITIONS, bulk=True):
+    """
+    Synchronous version of async_walk_rows. Walks the columns like walk_mibs,
+    but returns the table rows keyed by their instance index.
+
+    Returns:
+        rows(dict): index tuple -> list with the value of each column,
+            None for columns missing in the row
+    """
+    return _rows(_walk_indexed(printer, queries, max_repetitions, bulk), len(queries))
+
+def _rows(columns, width):
+    """
+    Turns columns of (index, value) pairs into a dict index -> row
+    """
+    rows = {}
+    for col, column in enumerate(columns):
+        for index, value in column:
+            rows.setdefault(index, [None]*width)[col] = value
+    return rows
 
+def _walk_indexed(printer, queries, max_repetitions, bulk):
+    """
+    Walks the columns, returning (index, value) pairs for every column
+    """
+    session = get_session(printer)
+    if not session.rtt.available():
+        return [[] for _ in queries]
+    try:
+        target = session.target()
+    except PySnmpError:
+        #Unknown host, reported as not answering
+        return [[] for _ in queries]
+    var_binds = CommandGeneratorVarBinds().makeVarBinds(
+            get_engine(), [object_type(query) for query in queries])
+    if bulk and printer not in v1_agents:
+        columns = _walk(session, target, queries, var_binds, max_repetitions)
+        if columns is not None:
+            return columns
+        v1_agents.add(printer)
+    columns = _walk(session, target, queries, var_binds)
+    return columns or [[] for _ in queries]
+
+def _walk(session, target, queries, var_binds, max_repetitions=None):
+    """
+    Synchronous version of _async_walk. Every request is a command of its
+    own, stopped after one response with maxCalls, so each round trip is
+    timed on its own.
+    """
+    prefixes = [var_bind[0] for var_bind in var_binds]
+    prefix_lengths = [len(prefix.getOid()) for prefix in prefixes]
+    columns = [[] for _ in prefixes]
+    last = list(prefixes)
+    active = [True]*len(prefixes)
+    answered = False
+    while any(active):
+        #Every request has to carry all the columns, so the columns which
+        #have left their subtree are sent along, but nothing more is recorded
+        current = [(name, Null('')) for name in last]
+        start = time.monotonic()
+        if max_repetitions is None:
+            command = nextCmd(get_engine(),
+                        session.v1,
+                        target,
+                        session.context,
+                        *current,
+                        maxCalls=1)
+        else:
+            command = bulkCmd(get_engine(),
+                        session.v2c,
+                        target,
+                        session.context,
+                        0, max_repetitions,
+                        *current,
+                        maxCalls=1)
+        #The command yields the rows of the response, or an error and
+        #stops, timeouts included, as it would send the request again.
+        #The noSuchName of SNMPv1 agents at the end of the MIB is hidden by
+        #pysnmp, which yields the request back, so it is taken as the end.
+        error_indication, error_status, var_bind_table = None, 0, []
+        for error_indication, error_status, _, row in command:
+            if error_indication or error_status:
+                break
+            if any(isinstance(value, Null) for _, value in row):
+                break
+            var_bind_table.append(row)
+        session.rtt.record(time.monotonic() - start, error_indication, target.timeout)
+        if recorder.enabled:
+            recorder.request(session.host, queries, time.monotonic() - start, error_indication,
+                             session.address)
+        if error_indication or error_status:
+            return columns if answered else None
+        answered = True
+        progress = False
+        rows = max(map(len, columns))
+        for row in var_bind_table:
+            if len(row) != len(prefixes):
+                break
+            for col, (name, value) in enumerate(row):
+                if not active[col]:
+                    continue
+                if isinstance(value, EndOfMibView) or not prefixes[col].isPrefixOf(name) \
+                        or name <= last[col]:
+                    active[col] = False
+                    continue
+                columns[col].append((tuple(name.getOid())[prefix_lengths[col]:], str(value)))
+                last[col] = name
+                progress = True
+        if recorder.enabled:
+            recorder.rows(session.host, max(map(len, columns)) - rows)
+        if not progress:
+            break
+    return columns
 
 def get_printer_errors(printer, ignore_list=None, all=False):
     """
@@ -133,21 +520,549 @@ def get_printer_errors(printer, ignore_list=None, all=False):
 
     Args:
         printer (str): name of printer
-        ignore_list (list): alerts to ignore
+        ignore_list (str): regex of alerts to ignore, or an AlertRules
         all (bool): print all alerts
 
     Returns:
         parsed_errors (str): A string of alert messages found 
     """
-    printer_alerts = walk_mib(printer, 'Printer-MIB', 'prtAlertDescription', 1)
-    if printer_alerts:
-        printer_alerts = [alert.split('{')[0] for alert in printer_alerts] 
-        printer_ticks = walk_mib(printer, 'Printer-MIB', 'prtAlertTime', 1)
-        system_uptime_ticks = int(get_mib(printer, 'DISMAN-EVENT-MIB', 'sysUpTimeInstance'))
-        time_since_alert = [str(timedelta(seconds=(system_uptime_ticks - int(tick)))/100) for tick in printer_ticks] 
-        location = str(get_mib(printer, 'SNMPv2-MIB', 'sysLocation', 0)).split(',')[2]
-        parsed_errors = ''
-        for alert, time in zip(printer_alerts, time_since_alert):
-            if all or not re.search(ignore_list, alert.lower()):
-                parsed_errors += '%s (%s): %s in %s\n' % (printer.split('.')[0].upper(), location, alert, time)
-        return parsed_errors
+    rows = walk_rows(printer, ALERT_COLUMNS)
+    if rows:
+        system_uptime_ticks, location, model = get_mibs(printer, STATUS_QUERIES)
+        alerts = _make_alerts(rows, system_uptime_ticks)
+        if not all:
+            alerts = _alert_rules(ignore_list).filter(alerts, printer, str(model or ''))
+        return format_alerts(printer, location_room(location), alerts)
+
+def format_alerts(printer, room, alerts):
+    """
+    Formats alerts as one line each, e.g
+    EXAMPLE_PRINTER1 (1234): Paper jam in 0:05:00
+    The room is shown as ? if sysLocation has none.
+    """
+    name = printer.split('.')[0].upper()
+    room = '?' if room is None else room
+    return ''.join('%s (%s): %s in %s\n' % (name, room, alert.description, timedelta(seconds=alert.seconds))
+                   for alert in alerts)
+
+def _make_alerts(rows, system_uptime_ticks):
+    """
+    Makes Alert records from the rows of ALERT_COLUMNS, keyed by prtAlertIndex
+    """
+    system_uptime_ticks = int(system_uptime_ticks)
+    return [Alert(index[0], description.split('{')[0],
+                  (system_uptime_ticks - int(ticks or system_uptime_ticks))/100)
+            for index, (description, ticks) in sorted(rows.items())
+            if description is not None]
+
+def _alert_rules(ignore_list):
+    """
+    Returns ignore_list if it is an AlertRules, else the compiled rules for the regex
+    """
+    return ignore_list if isinstance(ignore_list, AlertRules) else get_rules(ignore_list)
+
+
+async def async_ping(host, times=1):
+    """
+    Same as ping, but waits for the ping process without blocking the event loop.
+    Args:
+        host(str): printer name e.g example_printer1.printer.example.com
+        times(int): number of pings
+    Returns
+        bool: True if connection is established, else False
+    """
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+            'ping', '-c', str(times), host,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    answered = await process.wait() == 0
+    if recorder.enabled:
+        recorder.request(host, [PING], time.monotonic() - start)
+    return answered
+
+async def async_get_mibs(printer, queries, max_varbinds=MAX_VARBINDS, retries=RETRIES,
+                         timeout=TIMEOUT):
+    """
+    Asyncio version of get_mibs. Runs on the engine from get_async_engine.
+
+    Args:
+        printer(str): name of printer
+        queries(list): list of (mib_name, mib_variable, *mib_id) tuples
+        max_varbinds(int): largest number of varBinds in one PDU
+        retries(int): retransmissions of each request before giving up
+        timeout(float): seconds to wait for a response to each request
+
+    Returns:
+        values(list): the values found, in the same order as the queries.
+            None is returned for queries the agent did not answer.
+    """
+    values = []
+    for start in range(0, len(queries), max_varbinds):
+        values += await _async_get_chunk(printer, queries[start:start + max_varbinds],
+                                         retries, timeout)
+    return values
+
+async def _async_get_chunk(printer, queries, retries=RETRIES, timeout=TIMEOUT):
+    """
+    Asyncio version of _get_chunk
+    """
+    session = get_session(printer)
+    if not session.rtt.available():
+        return [None]*len(queries)
+    try:
+        target = await session.async_target(timeout, retries)
+    except PySnmpError:
+        #Unknown host, reported as not answering
+        return [None]*len(queries)
+    start = time.monotonic()
+    error_indication, error_status, error_index, var_binds = await aiosnmp.getCmd(
+                get_async_engine(),
+                session.v1,
+                target,
+                session.context,
+                *[object_type(query) for query in queries])
+    session.rtt.record(time.monotonic() - start, error_indication, target.timeout)
+    if recorder.enabled:
+        recorder.request(printer, queries, time.monotonic() - start, error_indication,
+                         session.address)
+    too_big = error_status and error_status.prettyPrint() == 'tooBig'
+    if (too_big or error_indication is errind.tooBig) and len(queries) > 1:
+        half = len(queries)//2
+        return (await _async_get_chunk(printer, queries[:half], retries, timeout)
+                + await _async_get_chunk(printer, queries[half:], retries, timeout))
+    missing = _no_such_name(error_status, error_index, queries)
+    if missing is not None:
+        rest = queries[:missing] + queries[missing + 1:]
+        values = await _async_get_chunk(printer, rest, retries, timeout) if rest else []
+        return values[:missing] + [None] + values[missing:]
+    if error_indication or error_status:
+        return [None]*len(queries)
+    return [var_bind[1] for var_bind in var_binds]
+
+async def async_walk_mibs(printer, queries, max_repetitions=MAX_REPETITIONS, bulk=True):
+    """
+    Asyncio version of walk_mibs. The asyncio hlapi only sends one request
+    per call, so the walk is driven here until every column has left its subtree.
+
+    Args:
+        printer(str): name of printer
+        queries(list): list of (mib_name, mib_variable, *mib_id) tuples
+        max_repetitions(int): rows asked for in each GETBULK request
+        bulk(bool): walk with GETBULK if the agent supports it
+
+    Returns:
+        columns(list): a list of info found for each of the queries
+    """
+    columns = await _async_walk_indexed(printer, queries, max_repetitions, bulk)
+    return [[value for _, value in column] for column in columns]
+
+async def async_walk_rows(printer, queries, max_repetitions=MAX_REPETITIONS, bulk=True):
+    """
+    Walks the columns like async_walk_mibs, but returns the table rows
+    keyed by their instance index, so rows can be told apart between walks.
+
+    Args:
+        printer(str): name of printer
+        queries(list): list of (mib_name, mib_variable, *mib_id) tuples
+        max_repetitions(int): rows asked for in each GETBULK request
+        bulk(bool): walk with GETBULK if the agent supports it
+
+    Returns:
+        rows(dict): index tuple -> list with the value of each column,
+            None for columns missing in the row
+
+    Example:
+        The alerts keyed by prtAlertIndex
+        async_walk_rows('example_printer1.printer.example.com',
+                        [('Printer-MIB', 'prtAlertDescription', 1),
+                         ('Printer-MIB', 'prtAlertTime', 1)])
+        {(1,): ['Paper jam', '3100'], (4,): ['Toner low', '1200']}
+    """
+    return _rows(await _async_walk_indexed(printer, queries, max_repetitions, bulk), len(queries))
+
+async def _async_walk_indexed(printer, queries, max_repetitions, bulk):
+    """
+    Walks the columns, returning (index, value) pairs for every column
+    """
+    session = get_session(printer)
+    if not session.rtt.available():
+        return [[] for _ in queries]
+    try:
+        await session.async_target()
+    except PySnmpError:
+        #Unknown host, reported as not answering
+        return [[] for _ in queries]
+    var_binds = CommandGeneratorVarBinds().makeVarBinds(
+            get_async_engine(), [object_type(query) for query in queries])
+    if bulk and printer not in v1_agents:
+        columns = await _async_walk(printer, queries, var_binds, max_repetitions)
+        if columns is not None:
+            return columns
+        v1_agents.add(printer)
+    columns = await _async_walk(printer, queries, var_binds)
+    return columns or [[] for _ in queries]
+
+async def _async_walk(printer, queries, var_binds, max_repetitions=None):
+    """
+    Walks the columns with GETBULK, or with SNMPv1 GETNEXT if max_repetitions
+    is None. Every column is a list of (index, value) pairs, where index is
+    the part of the OID below the column.
+    Returns None if the agent did not answer the first request.
+    """
+    session = get_session(printer)
+    target = await session.async_target()
+    prefixes = [var_bind[0] for var_bind in var_binds]
+    prefix_lengths = [len(prefix.getOid()) for prefix in prefixes]
+    columns = [[] for _ in prefixes]
+    last = list(prefixes)
+    active = [True]*len(prefixes)
+    answered = False
+    while any(active):
+        #Every request has to carry all the columns, so the columns which
+        #have left their subtree are sent along, but nothing more is recorded
+        current = [(name, Null('')) for name in last]
+        start = time.monotonic()
+        if max_repetitions is None:
+            command = aiosnmp.nextCmd(get_async_engine(),
+                        session.v1,
+                        target,
+                        session.context,
+                        *current)
+        else:
+            command = aiosnmp.bulkCmd(get_async_engine(),
+                        session.v2c,
+                        target,
+                        session.context,
+                        0, max_repetitions,
+                        *current)
+        error_indication, error_status, _, var_bind_table = await command
+        session.rtt.record(time.monotonic() - start, error_indication, target.timeout)
+        if recorder.enabled:
+            recorder.request(printer, queries, time.monotonic() - start, error_indication,
+                             session.address)
+        if error_indication or error_status:
+            return columns if answered else None
+        answered = True
+        progress = False
+        rows = max(map(len, columns))
+        for row in var_bind_table:
+            if len(row) != len(prefixes):
+                break
+            for col, (name, value) in enumerate(row):
+                if not active[col]:
+                    continue
+                if isinstance(value, EndOfMibView) or not prefixes[col].isPrefixOf(name) \
+                        or name <= last[col]:
+                    active[col] = False
+                    continue
+                columns[col].append((tuple(name.getOid())[prefix_lengths[col]:], str(value)))
+                last[col] = name
+                progress = True
+        if recorder.enabled:
+            recorder.rows(printer, max(map(len, columns)) - rows)
+        if not progress:
+            break
+    return columns
+
+async def async_get_printer_errors(printer, ignore_list=None, all=False):
+    """
+    Asyncio version of get_printer_errors
+
+    Args:
+        printer (str): name of printer
+        ignore_list (str): regex of alerts to ignore, or an AlertRules
+        all (bool): print all alerts
+
+    Returns:
+        parsed_errors (str): A string of alert messages found 
+    """
+    rows = await async_walk_rows(printer, ALERT_COLUMNS)
+    if rows:
+        system_uptime_ticks, location, model = await async_get_mibs(printer, STATUS_QUERIES)
+        alerts = _make_alerts(rows, system_uptime_ticks)
+        if not all:
+            alerts = _alert_rules(ignore_list).filter(alerts, printer, str(model or ''))
+        return format_alerts(printer, location_room(location), alerts)
+
+async def async_check_printer_errors(printer, ignore_list=None, all=False, retries=RETRIES):
+    """
+    Like async_get_printer_errors, but the SNMP response is used as the
+    liveness test instead of a separate ping. sysUpTimeInstance and sysLocation
+    are fetched first, and the alert table is only walked if the agent answers.
+    The alerts are returned as records, see format_alerts to print them.
+
+    Args:
+        printer (str): name of printer
+        ignore_list (str): regex of alerts to ignore, or an AlertRules
+        all (bool): return all alerts
+        retries (int): retransmissions before the printer is taken to be offline
+
+    Returns:
+        online (bool): True if the printer answered
+        room (str): the room part of sysLocation, None if offline
+        alerts (list): Alert records of the alerts not ignored
+        model (str): sysDescr, for AlertRules.filter, None if offline
+    """
+    system_uptime_ticks, location, model = await async_get_mibs(printer, STATUS_QUERIES,
+                                                                retries=retries)
+    if system_uptime_ticks is None:
+        return False, None, [], None
+    model = str(model or '')
+    alerts = _make_alerts(await async_walk_rows(printer, ALERT_COLUMNS), system_uptime_ticks)
+    if not all:
+        alerts = _alert_rules(ignore_list).filter(alerts, printer, model)
+    return True, location_room(location), alerts, model
+
+async def async_get_printer_alerts(printer, retries=RETRIES, counter=None, known=()):
+    """
+    Collects the alert table of a printer. Like async_check_printer_errors
+    the sysUpTimeInstance GET doubles as the liveness test.
+
+    If the agent has the prtAlertAllEvents counter, the table is only walked
+    when the counter has moved on from counter or one of the known alert
+    indexes has been removed. Both are checked in one GET.
+
+    Args:
+        printer (str): name of printer
+        retries (int): retransmissions before the printer is taken to be offline
+        counter (int): prtAlertAllEvents from the last walk, or None
+        known (list): prtAlertIndex of the alerts seen in the last walk
+
+    Returns:
+        online (bool): True if the printer answered
+        location (str): the room part of sysLocation, None if it has none
+        counter (int): current prtAlertAllEvents, or None if not supported
+        alerts (list): Alert tuples, or None if the table is unchanged
+        model (str): sysDescr, for AlertRules.filter
+    """
+    system_uptime_ticks, location, model = await async_get_mibs(printer, STATUS_QUERIES,
+                                                                retries=retries)
+    if system_uptime_ticks is None:
+        return False, None, None, None, None
+    location = location_room(location)
+    model = str(model or '')
+
+    current = None
+    if printer not in no_alert_counter:
+        values = await async_get_mibs(printer,
+                [('Printer-MIB', 'prtAlertAllEvents', 1)]
+                + [('Printer-MIB', 'prtAlertSeverityLevel', 1, index) for index in known])
+        if values[0] is None:
+            no_alert_counter.add(printer)
+        elif values[0] is not None:
+            current = int(values[0])
+            if current == counter and None not in values:
+                return True, location, current, None, model
+
+    rows = await async_walk_rows(printer, ALERT_COLUMNS)
+    return True, location, current, _make_alerts(rows, system_uptime_ticks), model
+
+async def async_get_printer_status(printer, retries=RETRIES):
+    """
+    Collects the general status of a printer:
+        Location
+        Model
+        Display info
+        Supply status
+        Page count
+        Uptime
+    Once the supply table layout of the printer is known, everything is
+    fetched in one GET. The first time, the supply table is walked as well.
+    The model and location are only fetched again after a reboot, and the
+    page count when it is due, see async_get_changed.
+
+    Args:
+        printer (str): name of printer
+        retries (int): retransmissions before the printer is taken to be offline
+
+    Returns:
+        status (PrinterStatus): online is False if the printer did not answer
+    """
+    layout = get_supply_layouts().get(printer) or []
+    uptime_ticks, values, (page_count,), (model, location) = await async_get_changed(printer,
+            [('Printer-MIB', 'prtConsoleDisplayBufferText', 1, 1)]
+            + supplies.level_queries(layout),
+            counters=[('Printer-MIB', 'prtMarkerLifeCount', 1, 1)],
+            statics=[('SNMPv2-MIB', 'sysDescr', 0),
+                     ('SNMPv2-MIB', 'sysLocation', 0)],
+            retries=retries)
+    if uptime_ticks is None:
+        return PrinterStatus(printer, False)
+    display = values[0]
+    levels = values[1:]
+    if None in levels:
+        #A supply is gone
+        get_supply_layouts().forget(printer)
+        layout = []
+    if layout:
+        printer_supplies = supplies.make_supplies(layout, levels)
+    else:
+        printer_supplies = await _async_discover_supplies(printer)
+    return PrinterStatus(printer, True, str(model), location_room(location), str(display),
+                         printer_supplies, _int(page_count), int(uptime_ticks)/100)
+
+async def async_get_supplies(printer, retries=RETRIES):
+    """
+    Returns the SupplyLevel of every supply of a printer. The levels of a
+    known layout are fetched in one GET, otherwise the supply table is walked.
+
+    Args:
+        printer (str): name of printer
+        retries (int): retransmissions before giving up
+
+    Returns:
+        supplies (list): SupplyLevel records, empty if the printer did not answer
+    """
+    layout = get_supply_layouts().get(printer)
+    if layout:
+        levels = await async_get_mibs(printer, supplies.level_queries(layout), retries=retries)
+        if None not in levels:
+            return supplies.make_supplies(layout, levels)
+        get_supply_layouts().forget(printer)
+    return await _async_discover_supplies(printer)
+
+async def _async_discover_supplies(printer):
+    """
+    Walks the whole supply table in one pass, stores its layout and returns the supplies
+    """
+    rows = await async_walk_rows(printer, supplies.COLUMNS)
+    layout = supplies.layout_from_rows(rows)
+    if layout:
+        get_supply_layouts().set(printer, layout)
+    return supplies.make_supplies(layout, [rows[(index,)][2] for index, _, _ in layout])
+
+def get_supply_layouts():
+    """
+    Returns the SupplyLayouts used by the functions, loading it on first use
+    """
+    global supply_layouts
+    if supply_layouts is None:
+        supply_layouts = supplies.SupplyLayouts()
+    return supply_layouts
+
+def get_change_cache():
+    """
+    Returns the ChangeCache used by the functions, loading it on first use.
+    The scripts save() it after a sweep.
+    """
+    global change_cache
+    if change_cache is None:
+        change_cache = ChangeCache()
+    return change_cache
+
+async def async_get_changed(printer, queries, counters=(), statics=(), retries=RETRIES,
+                            timeout=TIMEOUT):
+    """
+    GETs the queries and sysUpTimeInstance, along with the counters and
+    static values which the ChangeCache does not have fresh. If the uptime
+    shows the printer has rebooted, the cached ones are asked for again.
+    The counters and static values are returned as strings, as cached.
+
+    Args:
+        printer(str): name of printer
+        queries(list): (mib_name, mib_variable, *mib_id) asked for every time
+        counters(list): queries of counters, e.g prtMarkerLifeCount
+        statics(list): queries of values which only change on reboot, e.g sysDescr
+        retries(int): retransmissions of each request before giving up
+        timeout(float): seconds to wait for a response to each request
+
+    Returns:
+        uptime_ticks(int): sysUpTimeInstance, None if the printer did not answer
+        values(list): values of queries
+        counters(list): values of counters
+        statics(list): values of statics
+    """
+    cache = get_change_cache()
+    now = time.time()
+    cached = cache.fresh(printer, list(counters) + list(statics), now)
+    missing = [query for query in list(counters) + list(statics) if query not in cached]
+    values = await async_get_mibs(printer, [UPTIME] + list(queries) + missing,
+                                  retries=retries, timeout=timeout)
+    uptime_ticks = _int(values[0])
+    fetched = dict(zip(missing, values[1 + len(queries):]))
+    if uptime_ticks is None:
+        return None, values[1:1 + len(queries)], [None]*len(counters), [None]*len(statics)
+    if cached and cache.rebooted(printer, uptime_ticks, now):
+        fetched.update(zip(cached, await async_get_mibs(printer, list(cached),
+                                                        retries=retries, timeout=timeout)))
+        cached = {}
+    fetched = {query: None if value is None else str(value) for query, value in fetched.items()}
+    cache.update(printer, uptime_ticks,
+                 {query: fetched[query] for query in counters
+                  if fetched.get(query) is not None},
+                 {query: fetched[query] for query in statics
+                  if fetched.get(query) is not None}, now)
+    cached.update(fetched)
+    return (uptime_ticks, values[1:1 + len(queries)], [cached[query] for query in counters],
+            [cached[query] for query in statics])
+
+def _int(value):
+    return None if value is None else int(value)
+
+def run_all(coroutine_function, printers, *args, concurrency=None):
+    """
+    Runs coroutine_function(printer, *args) for all the printers on the event
+    loop, with at most concurrency of them running at the same time.
+    This replaces the multiprocessing pools used by the scripts.
+
+    Args:
+        coroutine_function(function): async function taking printer as first argument
+        printers(list): printer names
+        *args: extra arguments given to coroutine_function
+        concurrency(int): largest number of printers queried at the same time,
+            default concurrency in config.py
+
+    Returns:
+        results(list): the results in the same order as the printers
+
+    Example:
+        Ping all printers in config.py 3 times
+        run_all(async_ping, cfg.printers, 3)
+    """
+    semaphore = asyncio.Semaphore(concurrency or CONCURRENCY)
+    async def limited(printer):
+        async with semaphore:
+            return await coroutine_function(printer, *args)
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(asyncio.gather(*[limited(p) for p in printers]))
+
+async def async_iter_all(coroutine_function, printers, *args, concurrency=None):
+    """
+    Same as run_all, but an async generator yielding (printer, result) as soon
+    as each printer is done, so one slow printer does not hold up the rest.
+
+    Args:
+        coroutine_function(function): async function taking printer as first argument
+        printers(list): printer names
+        *args: extra arguments given to coroutine_function
+        concurrency(int): largest number of printers queried at the same time,
+            default concurrency in config.py
+
+    Yields:
+        (printer, result): in the order the printers finish
+    """
+    semaphore = asyncio.Semaphore(concurrency or CONCURRENCY)
+    async def limited(printer):
+        async with semaphore:
+            return printer, await coroutine_function(printer, *args)
+    for future in asyncio.as_completed([limited(p) for p in printers]):
+        yield await future
+
+def iter_all(coroutine_function, printers, *args, concurrency=None):
+    """
+    Generator driving async_iter_all on the event loop, for use in the
+    synchronous scripts.
+
+    Example:
+        Print the errors of each printer as soon as they are found
+        for printer, (online, room, alerts, model) in iter_all(async_check_printer_errors,
+                                                               cfg.printers, cfg.ignore_list):
+            print(format_alerts(printer, room, alerts))
+    """
+    loop = asyncio.get_event_loop()
+    results = async_iter_all(coroutine_function, printers, *args, concurrency=concurrency)
+    while True:
+        try:
+            yield loop.run_until_complete(results.__anext__())
+        except StopAsyncIteration:
+            return
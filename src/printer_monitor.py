@@ -9,6 +9,8 @@ Usage:
     ../venv/bin/python printer_monitor.py example_printer1 --pings 5
     ../venv/bin/python printer_monitor.py example_printer1 --quiet
     ../venv/bin/python printer_monitor.py example_printer1 example_printer2
+    ../venv/bin/python printer_monitor.py --profile
+    ../venv/bin/python printer_monitor.py --max-age 0
 
 """
 
@@ -16,9 +18,11 @@ from argparse import ArgumentParser
 from datetime import datetime, timedelta
 
 import config as cfg
-import multiprocessing as mp
 
-from printer_mibs import ping, get_mib, walk_mib, get_printer_errors
+from alert_rules import get_rules
+from instrumentation import recorder
+from printer_mibs import async_check_printer_errors, format_alerts, iter_all
+from snapshot_cache import SnapshotCache
 
 def argparser():
     """
@@ -34,6 +38,8 @@ def argparser():
     ../venv/bin/python printer_monitor.py example_printer1 --pings 5
     ../venv/bin/python printer_monitor.py example_printer1 --quiet
     ../venv/bin/python printer_monitor.py example_printer1 example_printer2
+    ../venv/bin/python printer_monitor.py --profile
+    ../venv/bin/python printer_monitor.py --max-age 0
 
     """
 
@@ -42,42 +48,52 @@ def argparser():
         action='store_true', 
         help='Display all errors')
     parser.add_argument('-p', '--pings',
-        default=1,
-        help='More pings takes more time, but gives less false positives')
+        default=1, type=int,
+        help='Number of SNMP requests sent before a printer is reported offline. '
+             'More pings takes more time, but gives less false positives. '
+             'With fast_fail in config.py a printer which timed out gets one request, '
+             'and none while its circuit breaker is open, see rtt.py')
     parser.add_argument('-q', '--quiet',
         default=False,
         help='Ignore unresponsive printers (no response to ping)')
-    parser.add_argument('printers', nargs='*', default=cfg.printers,
+    parser.add_argument('--profile',
+        action='store_true',
+        help='Print the latency, timeouts and traffic of every printer after the sweep, slowest first')
+    parser.add_argument('-m', '--max-age',
+        default=None, type=float,
+        help='Oldest alerts shown from snapshot_cache.db in seconds, 0 queries every printer. '
+             'Default snapshot_ttls in config.py')
+    parser.add_argument('printers', nargs='*',
                         help='If no arguments are given, all printernames in config.py are used')
     args = parser.parse_args()
+    #Only the names given are completed with the suffix, the printers in
+    #config.py may be addresses or names in other domains found by discovery.py
     suffix = cfg.suffix
-    args.printers = [p if p.endswith(suffix) else p+suffix for p in args.printers]
+    args.printers = ([p if p.endswith(suffix) else p+suffix for p in args.printers]
+                     or list(cfg.printers))
     return args
 
 if __name__ == '__main__':
     args = argparser()
-    error = ''
-    
-    #Pinging printers async
-    with mp.Pool(32) as pool:
-        ping_async = [pool.apply_async(ping, args=(printer, args.pings)) for printer in args.printers]
-        active_printers = [i for i, p in zip(args.printers, ping_async) if p.get()] 
-        inactive_printers = [i for i, p in zip(args.printers, ping_async) if not p.get()] 
-        
-    if inactive_printers and not args.quiet:
-        for printer in inactive_printers:
-            error += '{}: host \'{}\' unknown or offline\n'.format(printer.split('.')[0].upper(), printer)
+    if args.profile:
+        recorder.enabled = True
+        recorder.reset()
 
-    #Running queries async
-    with mp.Pool(32) as pool:
-        err = []
-        for printer in active_printers:
-            err.append(pool.apply_async(get_printer_errors, args=(printer, cfg.ignore_list, args.all)))
-       
-        if err:
-            err = [e.get() for e in err]
-            err = list(filter(None, err))
-            error += ''.join(err)
-            error = error.strip('\n')
+    #Running queries async, printing the errors of each printer as soon as
+    #it answers. Printers which do not answer SNMP are reported offline.
+    #All the alerts are cached, so the cache serves both --all and the filtered view
+    fetch = lambda printers: iter_all(async_check_printer_errors, printers,
+                                      cfg.ignore_list, True, args.pings - 1)
+    rules = get_rules(cfg.ignore_list)
+    for printer, (online, room, alerts, model) in SnapshotCache().serve('alerts', args.printers,
+                                                                        fetch, args.max_age):
+        if not args.all:
+            alerts = rules.filter(alerts, printer, model or '')
+        if not online and not args.quiet:
+            print('{}: host \'{}\' unknown or offline'.format(printer.split('.')[0].upper(), printer))
+        elif alerts:
+            print(format_alerts(printer, room, alerts).strip('\n'))
 
-    print(error)
+    if args.profile:
+        print()
+        print(recorder.summary())
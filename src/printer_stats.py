@@ -1,20 +1,22 @@
 #!python3
 '''Printer Stats.
-Stores the page count history for printers. Unless the script is provided with start 
+Stores the page count history for printers in page_count.db, see page_store.py.
+Unless the script is provided with start 
 and end dates, it will default to page count development since yesterday 
 (Monday-Saturday) or the last week's development (Sundays).
+An existing page_count.json is imported the first time the script runs.
 
 Options:
   -s --start <YYYY-MM-DD>   Start date
   -e --end <YYYY-MM-DD>     End date
-  -a --add <name>           Add a new printer
+  -a --add <name>           Add a new printer, in its room from inventory.json if discovery.py found it
   -r --remove <name>        Remove a printer
   -d=True --debug=True      Run in debug mode
+  -m --max-age <seconds>    Oldest page count used from snapshot_cache.db, 0 queries every printer
 
 Made by Torgeir Lebesbye (torgeirl) during the fall of 2016. MIT License.
 '''
 
-import json
 import os.path
 import time
 
@@ -23,111 +25,129 @@ from datetime import date, timedelta
 from os.path import dirname, join
 from sys import argv, exit
 
+import config as cfg
+import dns_cache
 from config import printers, printer_placement
 from printer_mibs import *
+from printer_mibs import CONCURRENCY
+from page_store import PageCountStore
+from snapshot_cache import SnapshotCache
+import inventory
 
+USAGE = f'Usage: {argv[0]} [-s startdate -e enddate] [-a new_printer]...'
 
 
 def map_path(target_name):
     '''Enables path names to be dynamically ascertained at runtime.'''
     return join(dirname(__file__), target_name).replace('\\', '/')
 
-def file_existance(json_file):
+def migrate(json_file):
     """
-    Check the existance of file
+    Imports the old page_count.json into the store, if the store is empty
     """
     file = map_path(json_file)
-    if not os.path.exists(file):
-        with open(file, 'w') as outfile:
-            json.dump({}, outfile)
+    if os.path.exists(file) and not store.printers():
+        imported = store.migrate_json(file)
+        print(f'Imported {imported} page counts from {json_file}')
             
 
-def get_page_count(printer):
-    '''Returns a printer's page count'''
-    page_count = walk_mib(printer, 'Printer-MIB', 'prtMarkerLifeCount')[0]
-    if not page_count is None and not page_count is '0':
-        return page_count
+async def async_get_page_count(printer, timeout=2, retries=2, debug=False):
+    '''
+    Returns a printer's page count and None, or None and the reason the
+    page count could not be found. A printer which does not answer is asked
+    again retries times, waiting timeout seconds for each answer.
+    The page count is cached between runs, see async_get_changed, but not
+    for longer than counter_max_interval seconds in config.py.
+    '''
+    start_time = time.time()
+    #The queries report an unknown host as not answering, so it is looked up
+    #first. The address is cached, the queries do not look it up again.
+    if await dns_cache.async_resolve(printer) is None:
+        page_count, reason = None, 'unknown host'
     else:
-        return 'n/a'
+        uptime, _, (page_count,), _ = await async_get_changed(
+                printer, [], counters=[('Printer-MIB', 'prtMarkerLifeCount', 1, 1)],
+                retries=retries, timeout=timeout)
+        if uptime is None:
+            reason = 'no answer'
+        elif not str(page_count).isdigit() or str(page_count) == '0':
+            page_count, reason = None, 'no page count'
+        else:
+            page_count, reason = int(page_count), None
+    if debug:
+        print('Queried %s: %s (%.1f sec)' % (printer.split('.')[0], reason or 'OK',
+                                             time.time() - start_time))
+    return page_count, reason
 
 def add_printer(printer, location):
-    '''Add a new printer to the JSON file'''
-    with open(map_path(json_file), 'r') as infile:
-        data = json.load(infile)
-    if printer not in data:
-        try:
-            data[printer] = {}
-            data[printer]['location'] = str(location)
-            with open(map_path(json_file), 'w') as outfile:
-                json.dump(data, outfile)
+    '''Add a new printer to the dataset'''
+    try:
+        if store.add_printer(printer, location):
             return f'{printer} has successfully been added to dataset'
-        except:
-            return f'Error: something went wrong while trying to add \'{printer}\''
-    else:
-        return f'Error: {printer} already in dataset'
+    except:
+        return f'Error: something went wrong while trying to add \'{printer}\''
+    return f'Error: {printer} already in dataset'
 
 
 def remove_printer(printer):
-    '''Remove a printer from the JSON file'''
-    with open(map_path(json_file), 'r') as infile:
-        data = json.load(infile)
-    if printer in data:
-        try:
-            data.pop(printer, None)
-            with open(map_path(json_file), 'w') as outfile:
-                json.dump(data, outfile)
+    '''Remove a printer from the dataset'''
+    try:
+        if store.remove_printer(printer):
             return f'{printer} has successfully been removed from dataset'
-        except:
-            return f'Error: something went wrong while trying to remove \'{printer}\'' 
-    else:
-        return f'Error: \'{printer}\' not in dataset'
-
-def check_printers(debug=False):
-    '''Checks page count on printer in the JSON file.'''
-    with open(map_path(json_file), 'r') as infile:
-        data = json.load(infile)
-    for printer in data.keys():
-        if debug:
-            status = 'Querying %s ...' % printer.split('.')[0]
-            print(status,)
-        start_time = time.time()
-        page_count = get_page_count(printer)
-        end_time = time.time()
-        data[printer][date.strftime(date.today(), '%Y-%m-%d')] = page_count
-        if debug:
-            print('OK (%.1f sec)' % (end_time - start_time))
-    with open(map_path(json_file), 'w') as outfile:
-        json.dump(data, outfile)
+    except:
+        return f'Error: something went wrong while trying to remove \'{printer}\'' 
+    return f'Error: \'{printer}\' not in dataset'
+
+def check_printers(debug=False, max_age=None, snapshots=None):
+    '''
+    Checks page count on printer in the dataset. All the printers are queried
+    at the same time, so a slow printer only holds up itself. Page counts
+    younger than max_age seconds in snapshots, default snapshot_cache.db, are
+    used as they are.
+    '''
+    today = date.strftime(date.today(), '%Y-%m-%d')
+    printers = list(store.printers())
+    def fetch(printers):
+        return zip(printers, run_all(async_get_page_count, printers,
+                                     getattr(cfg, 'stats_timeout', 2),
+                                     getattr(cfg, 'stats_retries', 2), debug,
+                                     concurrency=CONCURRENCY))
+    results = (snapshots or SnapshotCache()).serve('page_count', printers, fetch, max_age)
+    store.record_many([(printer, today, page_count, reason)
+                       for printer, (page_count, reason) in results])
+    get_change_cache().save()
 
 def make_report(start_date, end_date):
     """
     Returns a report on page count increase for the period.
     """
 
-    with open(map_path(json_file), 'r') as infile:
-        data = json.load(infile)
+    data = store.printers()
+    start_counts = store.counts_on(start_date)
+    end_counts = store.counts_on(end_date)
+    failures = store.failures_on(end_date)
     total = 0
     report = '\nPRINTER USAGE BETWEEN %s AND %s:\n\n' % (start_date, end_date)
     report += '     PRINTER | ROOM# |  COUNT  | INCREASE\n'
     report += '-----------------------------------------\n'
-    for printer in sorted(data,key=lambda x:int(data[x]['location'])):
-        start = data[printer].get(start_date, 'n/a')
-        end = data[printer].get(end_date, 'n/a')
-        if start.isdigit() and end.isdigit():
-            increase = int(end)-int(start)
+    for printer in sorted(data,key=lambda x:int(data[x])):
+        start = start_counts.get(printer)
+        end = end_counts.get(printer)
+        if start is not None and end is not None:
+            increase = end-start
             total += increase
             increase = str(increase)
         else:
             increase = 'n/a'
-        location = int(data[printer].get('location'))
-        report += '%12s | %5i | %7s | +%s\n' % (printer.split('.')[0], location, end, increase)
+        end = 'n/a' if end is None else end
+        location = int(data[printer])
+        report += '%12s | %5i | %7s | +%s' % (printer.split('.')[0], location, end, increase)
+        report += ' (%s)\n' % failures[printer] if failures.get(printer) else '\n'
     report += '\n%i printers, total increase in period: %i pages\n' % (len(data), total)
     return report
 
 def argparser():
-    usage = f'Usage: {argv[0]} [-s startdate -e enddate] [-a new_printer]...' 
-
-    parser = ArgumentParser(usage=usage)
+    parser = ArgumentParser(usage=USAGE)
     parser.add_argument('-s', '--start',
         help='Spesify a start date (YYYY-MM-DD)')
     parser.add_argument('-e', '--end',
@@ -139,20 +159,29 @@ def argparser():
     parser.add_argument('-d', '--debug',
         action='store_true',
         help='Run script in debug mode')
+    parser.add_argument('-m', '--max-age', type=float,
+        help='Oldest page count used from snapshot_cache.db in seconds, 0 queries every printer')
     args = parser.parse_args()
     suffix = cfg.suffix
-    args.printers = [p if p.endswith(suffix) else p+suffix for p in args.printers]
+    if args.add is not None and not args.add.endswith(suffix):
+        args.add += suffix
+    if args.remove is not None and not args.remove.endswith(suffix):
+        args.remove += suffix
     return args
 
 if __name__ == '__main__':
     args = argparser()
-    json_file = 'page_count.json'
-    file_existance(json_file)
+    store = PageCountStore(map_path('page_count.db'))
+    migrate('page_count.json')
 
     if args.add != None:
-        text = f'Please provide the location (rom number) of \'{args.add}\':'
-        print (text)
-        location = input('-->')
+        discovered = inventory.find(args.add)
+        if discovered is not None and discovered.room is not None:
+            location = discovered.room
+        else:
+            text = f'Please provide the location (rom number) of \'{args.add}\':'
+            print (text)
+            location = input('-->')
         print(add_printer(args.add, location))
 
     if args.remove != None:
@@ -175,8 +204,9 @@ if __name__ == '__main__':
             start_date = date.strftime(date.today()- timedelta(1), '%Y-%m-%d')
         end_date = date.strftime(date.today(), '%Y-%m-%d')
     try:
-        check_printers(debug=args.debug)
+        check_printers(debug=args.debug, max_age=args.max_age)
         print(make_report(start_date, end_date))
-    except:
-        print(usage)
+    except Exception as error:
+        print(f'Error: {error}')
+        print(USAGE)
         exit(1)
@@ -5,98 +5,103 @@ Usage:
     python printer_status.py example_printer1 
     python printer_status.py example_printer1 example_printer2 example_printer3 
     python printer_status.py example_printer1.printer.example.com
+    python printer_status.py example_printer1 --max-age 0
 """
 
-from printer_mibs import ping, get_mib
+from printer_mibs import async_get_printer_status, get_change_cache, iter_all
+from records import FleetSnapshot, PrinterStatus
+from reachability import probe
+from snapshot_cache import SnapshotCache
 from datetime import datetime, timedelta
 from argparse import ArgumentParser
 import config as cfg
-import multiprocessing as mp
 
-def get_printer_info(printer):
+def format_status(status):
     """
-    Collect printerinfo:
+    Formats the info collected about a printer:
         Location
         Model
         Display info
         Supply status
         Uptime
     Args:
-        printer(str): printer name
+        status(PrinterStatus): from async_get_printer_status
 
     Returns:
         info(str): String of info collected about printer
     """
-    model = str(get_mib(printer, 'SNMPv2-MIB', 'sysDescr', 0)).split('/')
-    location = str(get_mib(printer, 'SNMPv2-MIB', 'sysLocation', 0)).split(',')[2]
-    display = str(get_mib(printer, 'Printer-MIB', 'prtConsoleDisplayBufferText', 1, 1))
-    supply_level_black = str(get_mib(printer, 'Printer-MIB', 'prtMarkerSuppliesLevel', 1, 1))
-    supply_level_cyan = str(get_mib(printer, 'Printer-MIB', 'prtMarkerSuppliesLevel', 1, 3))
-    supply_level_magenta = str(get_mib(printer, 'Printer-MIB', 'prtMarkerSuppliesLevel', 1, 4))
-    supply_level_yellow = str(get_mib(printer, 'Printer-MIB', 'prtMarkerSuppliesLevel', 1, 5))
-    supply_level_waste = str(get_mib(printer, 'Printer-MIB', 'prtMarkerSuppliesLevel', 1, 2))
-    page_count = int(get_mib(printer, 'Printer-MIB', 'prtMarkerLifeCount', 1, 1))
-
-    uptime_seconds = int(get_mib(printer, 'DISMAN-EVENT-MIB', 'sysUpTimeInstance'))/100
-    uptime_time = timedelta(seconds=uptime_seconds)
-    uptime_start = (datetime.today() - uptime_time).strftime('%a %b %d, %Y %H:%I')
-
-    info = 'Querying \033[1m' + printer.split('.')[0] + '\033[0m'
-    if location:
-        info += ' (room ' + location +')'
+    info = 'Querying \033[1m' + status.printer.split('.')[0] + '\033[0m'
+    info += ' (room ' + ('?' if status.room is None else status.room) +')'
     info += ':\nModel:\n'
-    for line in model:
+    for line in status.model.split('/'):
         info += f'{line}\n'
     info += 'Display:\n'
-    info += f'{display}\n'
-        
+    info += f'{status.display}\n'
+
     info += 'Supply status:\n'
-    info += '%6i %% Black\n' % int(supply_level_black)
-    info += '%6i %% Cyan\n' % int(supply_level_cyan)
-    info += '%6i %% Magenta\n' % int(supply_level_magenta)
-    info += '%6i %% Yellow\n' % int(supply_level_yellow)
-    info += '%6i %% Waste\n' % int(supply_level_waste)
-    info += 'Page count: %s\n' % page_count
-    info += 'Uptime: %s (since %s)\n' % (uptime_time, uptime_start)
+    for supply in status.supplies:
+        percent = supply.percent()
+        info += '%6s %% %s\n' % ('n/a' if percent is None else '%i' % percent, supply.name)
+    info += 'Page count: %s\n' % status.page_count
+    if status.uptime is not None:
+        uptime_time = timedelta(seconds=status.uptime)
+        uptime_start = (datetime.today() - uptime_time).strftime('%a %b %d, %Y %H:%I')
+        info += 'Uptime: %s (since %s)\n' % (uptime_time, uptime_start)
 
     return info
 
+def format_offline(status):
+    return '{}: host \'{}\' unknown or offline'.format(status.printer.split('.')[0].upper(),
+                                                       status.printer)
+
+def fetch_statuses(cache, printers):
+    """
+    Generator of (printer, PrinterStatus) of the printers queried live,
+    the printers which do not answer the ping first
+    """
+    #Ping all printers in parallel
+    online = probe(printers, retries=2)
+    cache.put('reachable', online)
+    for printer in printers:
+        if not online[printer]:
+            yield printer, PrinterStatus(printer, False)
+    #Get all printer info in parallel
+    yield from iter_all(async_get_printer_status, [p for p in printers if online[p]])
+    get_change_cache().save()
+
 def argparser():
     usage = """
     python printer_status.py example_printer1 
     python printer_status.py example_printer1 example_printer2 example_printer3 
     python printer_status.py example_printer1.printer.example.com
+    python printer_status.py example_printer1 --max-age 0
     """
     
     parser = ArgumentParser(usage=usage)
     parser.add_argument('printers', type=str, nargs='*', 
-                        default=cfg.printers,
                         help='Give name(s) of printers')
+    parser.add_argument('-m', '--max-age', type=float, default=None,
+                        help='Oldest status shown from snapshot_cache.db in seconds, '
+                             '0 queries every printer. Default snapshot_ttls in config.py')
     args = parser.parse_args()
-    suffix = '.printer.example.com'
-    args.printers = [p if p.endswith(suffix) else p+suffix for p in args.printers]
+    #Only the names given are completed with the suffix, the printers in
+    #config.py may be addresses or names in other domains found by discovery.py
+    suffix = cfg.suffix
+    args.printers = ([p if p.endswith(suffix) else p+suffix for p in args.printers]
+                     or list(cfg.printers))
     return args
 
 
 if __name__ == '__main__':
     args = argparser()
-    #Ping all printers in parallel
-    with mp.Pool(32) as pool:
-        ping_async = [pool.apply_async(ping, args=(printer, 3)) for printer in args.printers]
-        active_printers = [i for i, p in zip(args.printers, ping_async) if p.get()] 
-        inactive_printers = [i for i, p in zip(args.printers, ping_async) if not p.get()] 
-    
-    if inactive_printers:
-        for printer in inactive_printers:
-            error += '{}: host \'{}\' unknown or offline\n'.format(printer.split('.')[0].upper(), printer)
-
-    #Get all printer info in parallel
-    with mp.Pool(32) as pool:
-        info = []
-        for printer in active_printers:
-            info.append(pool.apply_async(get_printer_info, args=(printer,)))
-
-        info = [i.get() for i in info]
+    #Only the printers without a fresh status in the cache are queried
+    cache = SnapshotCache()
+    statuses = dict(cache.serve('status', args.printers,
+                                lambda printers: fetch_statuses(cache, printers), args.max_age))
+    snapshot = FleetSnapshot([statuses[p] for p in args.printers if p in statuses])
 
-    for i in info:
-        print(i)
+    if snapshot.offline():
+        print('\n'.join(format_offline(status) for status in snapshot.offline()) + '\n')
+    for status in snapshot:
+        if status.online:
+            print(format_status(status))
@@ -0,0 +1,207 @@
+#!python3
+"""
+Checks which printers are reachable. All the probes are sent at once from
+a single socket and the replies are matched back to the hosts, so a sweep
+takes about timeout*(retries + 1) seconds no matter how many printers there are.
+
+Two kinds of probes are supported:
+    icmp: ICMP echo requests. Uses an unprivileged ICMP datagram socket
+          if the kernel allows it (net.ipv4.ping_group_range), otherwise
+          a raw socket, which needs root.
+    snmp: SNMPv1 GET of sysUpTime.0 on UDP/161, or snmp_port in config.py.
+          Needs no privileges and also tells us the SNMP agent is answering.
+
+Usage:
+    from reachability import probe
+    probe(['example_printer1.printer.example.com'], timeout=1, retries=2)
+"""
+__all__ = ['probe', 'icmp_available']
+import os
+import select
+import socket
+import struct
+import time
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+import config as cfg
+from dns_cache import resolve_all
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+
+
+def probe(hosts, timeout=1.0, retries=2, method='auto'):
+    """
+    Probes all the hosts at once. Hosts which have not answered after
+    timeout seconds are probed again, up to retries times.
+
+    Args:
+        hosts(list): printer names e.g example_printer1.printer.example.com
+        timeout(float): seconds to wait for a reply to each probe
+        retries(int): number of extra probes sent to hosts which do not answer
+        method(str): 'icmp', 'snmp' or 'auto'. auto uses icmp if the
+            process is allowed to open an ICMP socket, otherwise snmp
+
+    Returns:
+        reachable(dict): host -> True if the host answered, else False
+    """
+    reachable = dict.fromkeys(hosts, False)
+    addresses = resolve_all(hosts)
+    if method == 'auto':
+        method = 'icmp' if icmp_available() else 'snmp'
+    if method == 'icmp':
+        sock, raw = _icmp_socket()
+        prober = _IcmpProber(raw)
+    elif method == 'snmp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        prober = _SnmpProber()
+    else:
+        raise ValueError('Unknown probe method %s' % method)
+    with sock:
+        answered = _sweep(sock, prober, set(addresses.values()) - {None}, timeout, retries)
+    for host, address in addresses.items():
+        reachable[host] = address in answered
+    return reachable
+
+def icmp_available():
+    """
+    Returns True if this process may send ICMP echo requests
+    """
+    try:
+        sock, _ = _icmp_socket()
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+def _icmp_socket():
+    """
+    Opens an unprivileged ICMP datagram socket, or a raw socket if the kernel
+    does not allow those. Returns the socket and whether it is raw.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+def _sweep(sock, prober, addresses, timeout, retries):
+    """
+    Sends a probe to every address and collects the replies. Every probe
+    gets its own sequence number, so late replies to earlier rounds still count.
+
+    Returns:
+        answered(set): the addresses which replied
+    """
+    answered = set()
+    outstanding = {}
+    sequence = 0
+    sock.setblocking(False)
+    for _ in range(retries + 1):
+        for address in addresses - answered:
+            sequence = (sequence + 1) & 0xffff
+            outstanding[sequence] = address
+            _send(sock, prober.packet(sequence), (address, prober.port), timeout)
+        deadline = time.monotonic() + timeout
+        while addresses - answered:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            while True:
+                try:
+                    data, (source, _) = sock.recvfrom(4096)
+                except (BlockingIOError, InterruptedError):
+                    break
+                sequence_reply = prober.match(data)
+                if outstanding.get(sequence_reply) == source:
+                    answered.add(source)
+        if not addresses - answered:
+            break
+    return answered
+
+def _send(sock, packet, address, timeout):
+    """
+    Sends one probe, waiting for room in the socket buffer if it is full
+    """
+    try:
+        sock.sendto(packet, address)
+    except BlockingIOError:
+        if select.select([], [sock], [], timeout)[1]:
+            _send(sock, packet, address, timeout)
+    except OSError:
+        #Unroutable address, the host will simply be unanswered
+        pass
+
+
+class _IcmpProber:
+    """
+    Builds ICMP echo requests and matches echo replies on identifier and
+    sequence. The kernel sets the identifier itself on datagram sockets
+    and only hands us our own replies, so the identifier is only checked
+    on raw sockets.
+    """
+    port = 0
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.identifier = os.getpid() & 0xffff
+
+    def packet(self, sequence):
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, self.identifier, sequence)
+        payload = b'printer_monitoring'
+        checksum = _checksum(header + payload)
+        return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, self.identifier, sequence) + payload
+
+    def match(self, data):
+        if self.raw:
+            #Skip the IP header
+            data = data[(data[0] & 0x0f)*4:]
+        if len(data) < 8:
+            return None
+        kind, _, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+        if kind != ICMP_ECHO_REPLY or (self.raw and identifier != self.identifier):
+            return None
+        return sequence
+
+
+class _SnmpProber:
+    """
+    Builds SNMPv1 GET requests for sysUpTime.0 with the sequence number as
+    request-id, and matches the responses on it.
+    """
+    port = getattr(cfg, 'snmp_port', 161)
+
+    def __init__(self, community='public'):
+        self.protocol = api.protoModules[api.protoVersion1]
+        self.message = self.protocol.Message()
+        self.protocol.apiMessage.setDefaults(self.message)
+        self.protocol.apiMessage.setCommunity(self.message, community)
+        self.pdu = self.protocol.GetRequestPDU()
+        self.protocol.apiPDU.setDefaults(self.pdu)
+        self.protocol.apiPDU.setVarBinds(self.pdu, [(SYS_UPTIME, self.protocol.Null(''))])
+
+    def packet(self, sequence):
+        self.protocol.apiPDU.setRequestID(self.pdu, sequence)
+        self.protocol.apiMessage.setPDU(self.message, self.pdu)
+        return encoder.encode(self.message)
+
+    def match(self, data):
+        try:
+            message, _ = decoder.decode(data, asn1Spec=self.protocol.Message())
+            return int(self.protocol.apiPDU.getRequestID(self.protocol.apiMessage.getPDU(message)))
+        except Exception:
+            return None
+
+
+def _checksum(data):
+    """
+    RFC 1071 internet checksum
+    """
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!%dH' % (len(data)//2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
@@ -0,0 +1,275 @@
+#!python3
+"""
+Record types of the results collected from the printers.
+
+The library returns these records, and the scripts only format them, so
+results can be aggregated, cached and serialized without parsing text.
+The records use __slots__ and pickle as a reference to the class plus a tuple
+of values, so they are small in memory and on the wire.
+
+FleetSnapshot holds the status of many printers in column arrays instead
+of one object per printer.
+"""
+__all__ = ['Record', 'Alert', 'SupplyLevel', 'PrinterStatus', 'Trap', 'DiscoveredPrinter', 'FleetSnapshot', 'MISSING',
+           'location_room']
+from array import array
+
+#Stored in the arrays of FleetSnapshot for unknown values. Supply levels
+#have their own negative values in the Printer-MIB, so -1 can not be used.
+MISSING = -2**31
+
+
+def location_room(location):
+    """
+    Returns the room part of sysLocation, e.g 3301 of 'Building,3,3301', or
+    None if the agent has no sysLocation or it has no room part
+    """
+    parts = [] if location is None else str(location).split(',')
+    return parts[2] if len(parts) > 2 else None
+
+class Record:
+    """
+    Base class of the records. The fields are given by __slots__, in order.
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self.__slots__):
+            raise TypeError('%s takes %i fields' % (type(self).__name__, len(self.__slots__)))
+        values = dict(zip(self.__slots__, args))
+        values.update(kwargs)
+        for field in self.__slots__:
+            setattr(self, field, values.pop(field, None))
+        if values:
+            raise TypeError('%s has no field %s' % (type(self).__name__, ', '.join(values)))
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % item for item in zip(self.__slots__, self)))
+
+    def __reduce__(self):
+        return type(self), tuple(self)
+
+    def _asdict(self):
+        return dict(zip(self.__slots__, self))
+
+
+class Alert(Record):
+    """
+    An entry in prtAlertTable
+
+    Fields:
+        index(int): prtAlertIndex
+        description(str): prtAlertDescription
+        seconds(float): time since the alert was raised
+    """
+    __slots__ = ('index', 'description', 'seconds')
+
+
+class SupplyLevel(Record):
+    """
+    The level of one marker supply, e.g a toner
+
+    Fields:
+        name(str): prtMarkerSuppliesDescription, e.g Black Cartridge
+        level(int): prtMarkerSuppliesLevel, None if unknown
+        max_capacity(int): prtMarkerSuppliesMaxCapacity, None if unknown
+    """
+    __slots__ = ('name', 'level', 'max_capacity')
+
+    def percent(self):
+        """
+        Returns the level in percent of the max capacity, or None if it is
+        not known. The Printer-MIB uses negative values for levels and
+        capacities the printer can not tell.
+        """
+        if self.level is None or self.max_capacity is None or self.level < 0 \
+                or self.max_capacity <= 0:
+            return None
+        return 100*self.level/self.max_capacity
+
+
+class PrinterStatus(Record):
+    """
+    The general status of a printer, as shown by printer_status.py
+
+    Fields:
+        printer(str): printer name
+        online(bool): True if the printer answered
+        model(str): sysDescr
+        room(str): the room part of sysLocation, None if it has none
+        display(str): prtConsoleDisplayBufferText
+        supplies(list): SupplyLevel of every supply
+        page_count(int): prtMarkerLifeCount
+        uptime(float): seconds since the printer was started
+    """
+    __slots__ = ('printer', 'online', 'model', 'room', 'display', 'supplies',
+                 'page_count', 'uptime')
+
+
+class Trap(Record):
+    """
+    A notification received from a printer, see trap_receiver.py
+
+    Fields:
+        printer(str): printer name, or the address of an unknown sender
+        name(str): the notification, e.g Printer-MIB::printerV2Alert
+        alert_index(int): prtAlertIndex of the alert, None if not an alert
+        values(dict): 'MIB-name::variable' -> value of the varBinds sent
+    """
+    __slots__ = ('printer', 'name', 'alert_index', 'values')
+
+
+class DiscoveredPrinter(Record):
+    """
+    A printer found by discovery.py
+
+    Fields:
+        address(str): IPv4 address
+        host(str): host name from reverse DNS, or the address if it has none
+        printer_name(str): prtGeneralPrinterName
+        description(str): sysDescr
+        object_id(str): sysObjectID, e.g 1.3.6.1.4.1.11.2.3.9.1 for an HP printer
+        location(str): sysLocation
+        room(str): room part of sysLocation, None if it has none
+    """
+    __slots__ = ('address', 'host', 'printer_name', 'description', 'object_id', 'location', 'room')
+
+
+class FleetSnapshot:
+    """
+    The status of many printers, stored column by column. Numbers are
+    kept in arrays with MISSING for unknown values, and the supplies of all the
+    printers in one flat array, with the start of each printer's supplies in
+    supply_start. Text is stored once in strings, and the columns hold its
+    position there, as most printers share models, rooms and supply names.
+
+    Args:
+        statuses(list): PrinterStatus records to add
+
+    Example:
+        snapshot = FleetSnapshot(run_all(async_get_printer_status, cfg.printers))
+        for status in snapshot.offline():
+            print(status.printer)
+    """
+
+    def __init__(self, statuses=()):
+        self.strings = []
+        self._string_codes = {}
+        self.printers = array('i')
+        self.models = array('i')
+        self.rooms = array('i')
+        self.displays = array('i')
+        self.online = array('b')
+        self.page_counts = array('q')
+        self.uptimes = array('d')
+        self.supply_names = array('i')
+        self.supply_levels = array('i')
+        self.supply_capacities = array('i')
+        self.supply_start = array('I', [0])
+        for status in statuses:
+            self.append(status)
+
+    def append(self, status):
+        """
+        Adds the PrinterStatus of a printer
+        """
+        self.printers.append(self._code(status.printer))
+        self.models.append(self._code(status.model))
+        self.rooms.append(self._code(status.room))
+        self.displays.append(self._code(status.display))
+        self.online.append(bool(status.online))
+        self.page_counts.append(_known(status.page_count))
+        self.uptimes.append(_known(status.uptime))
+        for supply in status.supplies or []:
+            self.supply_names.append(self._code(supply.name))
+            self.supply_levels.append(_known(supply.level))
+            self.supply_capacities.append(_known(supply.max_capacity))
+        self.supply_start.append(len(self.supply_levels))
+
+    def _code(self, string):
+        """
+        Returns the position of string in strings, adding it if it is new
+        """
+        code = self._string_codes.get(string)
+        if code is None:
+            code = self._string_codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def __getstate__(self):
+        #The codes are rebuilt from strings when unpickled
+        state = self.__dict__.copy()
+        del state['_string_codes']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._string_codes = {string: code for code, string in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.printers)
+
+    def __getitem__(self, row):
+        """
+        Returns the PrinterStatus in row
+        """
+        if row < 0:
+            row += len(self)
+        start, end = self.supply_start[row], self.supply_start[row + 1]
+        strings = self.strings
+        supplies = [SupplyLevel(strings[name], _unknown(level), _unknown(capacity))
+                    for name, level, capacity in zip(self.supply_names[start:end],
+                                                     self.supply_levels[start:end],
+                                                     self.supply_capacities[start:end])]
+        if not self.online[row]:
+            supplies = None
+        return PrinterStatus(strings[self.printers[row]], bool(self.online[row]),
+                             strings[self.models[row]], strings[self.rooms[row]],
+                             strings[self.displays[row]], supplies,
+                             _unknown(self.page_counts[row]), _unknown(self.uptimes[row]))
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def offline(self):
+        """
+        Returns the PrinterStatus of the printers which did not answer
+        """
+        return [self[row] for row, online in enumerate(self.online) if not online]
+
+    def low_supplies(self, threshold=10):
+        """
+        Returns (printer, SupplyLevel) of the supplies at or below threshold percent
+        """
+        low = []
+        for row, printer in enumerate(self.printers):
+            for i in range(self.supply_start[row], self.supply_start[row + 1]):
+                supply = SupplyLevel(self.strings[self.supply_names[i]],
+                                     _unknown(self.supply_levels[i]),
+                                     _unknown(self.supply_capacities[i]))
+                percent = supply.percent()
+                if percent is not None and percent <= threshold:
+                    low.append((self.strings[printer], supply))
+        return low
+
+    def total_pages(self):
+        """
+        Returns the sum of the known page counts
+        """
+        return sum(count for count in self.page_counts if count != MISSING)
+
+def _known(value):
+    return MISSING if value is None else value
+
+def _unknown(value):
+    return None if value == MISSING else value
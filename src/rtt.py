@@ -0,0 +1,131 @@
+#!python3
+"""
+Round trip time estimates and circuit breakers of the printers.
+
+pysnmp waits the same timeout, and retries as many times, for every
+printer, so a dead or sleeping printer costs timeout*(retries + 1) seconds
+in every sweep. Instead every printer keeps a smoothed RTT and its variance,
+as TCP does (RFC 6298), and its requests time out after
+srtt + 4*rttvar, never longer than the timeout asked for:
+
+    - A printer which has never answered gets the timeout asked for.
+    - After a timeout the timeout is doubled for every timeout in a row.
+      The retries asked for are always sent, unless fast_fail is set.
+
+With fast_fail = True in config.py the retries asked for are upper bounds
+as well, which suits sweeps of large fleets with many printers turned off:
+
+    - After a timeout the printer gets one try and no retries.
+    - After breaker_failures timeouts in a row the circuit is open, and
+      no requests are sent to the printer for breaker_cooldown seconds,
+      doubled for every later timeout up to breaker_max_cooldown. The
+      printer is reported offline meanwhile. When the cooldown ends one
+      request is let through; an answer closes the circuit.
+
+Set adaptive_timeouts = False in config.py to use the fixed timeouts.
+The settings are read again by configure, e.g after config.py is reloaded.
+"""
+__all__ = ['RttEstimator', 'ENABLED', 'FAST_FAIL', 'MIN_TIMEOUT', 'TIMER_RESOLUTION',
+           'configure']
+import math
+import time
+
+from pysnmp.proto import errind
+
+import config as cfg
+
+
+def configure():
+    """
+    Reads the settings from config.py
+    """
+    global ENABLED, FAST_FAIL, MIN_TIMEOUT, BREAKER_FAILURES, BREAKER_COOLDOWN, \
+           BREAKER_MAX_COOLDOWN
+    ENABLED = getattr(cfg, 'adaptive_timeouts', True)
+
+    #Drop the retries of printers which time out, and skip them with the circuit breaker
+    FAST_FAIL = ENABLED and getattr(cfg, 'fast_fail', False)
+
+    #Shortest timeout used, however fast the printer answers
+    MIN_TIMEOUT = getattr(cfg, 'min_timeout', 0.2)
+
+    #Timeouts in a row before the circuit of a printer is opened
+    BREAKER_FAILURES = getattr(cfg, 'breaker_failures', 3)
+
+    #Seconds the circuit stays open after BREAKER_FAILURES timeouts, and at most
+    BREAKER_COOLDOWN = getattr(cfg, 'breaker_cooldown', 60)
+    BREAKER_MAX_COOLDOWN = getattr(cfg, 'breaker_max_cooldown', 900)
+
+configure()
+
+#How often the engines look for timed out requests. Timeouts are rounded up
+#to a multiple of it, which also bounds the targets made for each printer.
+TIMER_RESOLUTION = 0.05
+
+#Gains of the smoothed RTT and its variance, from RFC 6298
+ALPHA = 1/8
+BETA = 1/4
+
+
+class RttEstimator:
+    """
+    The RTT estimate and circuit breaker of one printer
+    """
+    __slots__ = ('srtt', 'rttvar', 'failures', 'retry_at')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def limits(self, timeout, retries):
+        """
+        Returns the timeout and retries to use for the next request, at
+        most the timeout given. The retries given are kept, unless
+        FAST_FAIL is set and the printer timed out last time.
+        """
+        if not ENABLED:
+            return timeout, retries
+        if self.srtt is not None:
+            rto = max(MIN_TIMEOUT, self.srtt + 4*self.rttvar)*2**min(self.failures, 8)
+            timeout = min(timeout, math.ceil(rto/TIMER_RESOLUTION)*TIMER_RESOLUTION)
+        if self.failures and FAST_FAIL:
+            retries = 0
+        return round(timeout, 2), retries
+
+    def available(self):
+        """
+        Returns False while the circuit is open and no requests should be
+        sent, which is never unless FAST_FAIL is set
+        """
+        return not FAST_FAIL or time.monotonic() >= self.retry_at
+
+    def record(self, seconds, error_indication, timeout):
+        """
+        Updates the estimate with a request
+
+        Args:
+            seconds(float): time from sending the request to the answer or timeout
+            error_indication: pysnmp error indication, None if answered
+            timeout(float): timeout of the request
+        """
+        if isinstance(error_indication, errind.RequestTimedOut):
+            self.failures += 1
+            if self.failures >= BREAKER_FAILURES:
+                cooldown = BREAKER_COOLDOWN*2**min(self.failures - BREAKER_FAILURES, 16)
+                self.retry_at = time.monotonic() + min(cooldown, BREAKER_MAX_COOLDOWN)
+            return
+        if error_indication is not None:
+            return
+        self.failures = 0
+        self.retry_at = 0.0
+        if seconds >= timeout:
+            #The answer may be to a retransmission, so the time says nothing (Karn)
+            return
+        if self.srtt is None:
+            self.srtt = seconds
+            self.rttvar = seconds/2
+        else:
+            self.rttvar = (1 - BETA)*self.rttvar + BETA*abs(self.srtt - seconds)
+            self.srtt = (1 - ALPHA)*self.srtt + ALPHA*seconds
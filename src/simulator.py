@@ -0,0 +1,369 @@
+#!python3
+"""
+Simulated fleet of printer SNMP agents on the loopback network.
+
+Every agent listens on its own loopback address, 127.1.0.1, 127.1.0.2 and
+so on, so the scripts query them like real printers by address. The agents
+answer SNMPv1 and SNMPv2c GET, GETNEXT and GETBULK with the system group,
+prtGeneralPrinterName, and the Printer-MIB alert, marker supplies and
+marker tables, with the number of rows, the answer latency and the packet
+loss given. A fraction of the agents can be left offline, they never answer.
+
+Addresses in 127.0.0.0/8 need no setup on Linux. Port 161 needs root, on
+another port set snmp_port in config.py to the same port.
+
+Usage:
+    python simulator.py --agents 1000
+    python simulator.py --agents 1000 --latency 0.01 --loss 0.01 --alerts 20
+"""
+__all__ = ['Fleet', 'Agent', 'printer_table', 'addresses', 'start_fleet', 'stop_fleet']
+import asyncio
+import random
+import resource
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from bisect import bisect_right
+from functools import lru_cache
+from ipaddress import ip_address
+from os.path import abspath
+
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import api
+from pysnmp.proto.rfc1902 import (Counter32, Integer, ObjectIdentifier, ObjectName,
+                                  OctetString, TimeTicks)
+
+FIRST_ADDRESS = '127.1.0.1'
+
+SYS_DESCR = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+SYS_OBJECT_ID = (1, 3, 6, 1, 2, 1, 1, 2, 0)
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+SYS_LOCATION = (1, 3, 6, 1, 2, 1, 1, 6, 0)
+PRINTER_MIB = (1, 3, 6, 1, 2, 1, 43)
+PRINTER_NAME = PRINTER_MIB + (5, 1, 1, 16, 1)
+ALERT_TIME = PRINTER_MIB + (18, 1, 1, 9, 1)
+
+MODELS = ['HP LaserJet M607/FW 2409081/SN %05i',
+          'HP Color LaserJet M652/FW 2409081/SN %05i',
+          'Xerox VersaLink C405/FW 73.40.12/SN %05i']
+#sysObjectID of each model
+OBJECT_IDS = [(1, 3, 6, 1, 4, 1, 11, 2, 3, 9, 1),
+              (1, 3, 6, 1, 4, 1, 11, 2, 3, 9, 1),
+              (1, 3, 6, 1, 4, 1, 253, 8, 62, 1)]
+SUPPLIES = ['Black Cartridge', 'Cyan Cartridge', 'Magenta Cartridge', 'Yellow Cartridge',
+            'Imaging Drum', 'Fuser Kit', 'Transfer Kit', 'Waste Toner Container']
+ALERTS = ['Energy Saver Mode', 'Tray 2 Empty', 'Black Cartridge Low', 'Paper Jam in Tray 1',
+          'Cyan Cartridge Low', 'Warming Up', 'Door Open', 'Replace Fuser Kit']
+
+#BER encodings of the response PDU tag and of the values without a value
+GET_RESPONSE = 0xa2
+NULL = b'\x05\x00'
+NO_SUCH_OBJECT = b'\x80\x00'
+END_OF_MIB_VIEW = b'\x82\x00'
+
+#The GETBULK answers stop at this size, like agents keep to their maximum message size
+MAX_RESPONSE_VAR_BINDS = 250
+
+
+def printer_table(alerts=10, supplies=4, markers=1):
+    """
+    Makes the Printer-MIB values served by every agent
+
+    Args:
+        alerts(int): rows in prtAlertTable
+        supplies(int): rows in prtMarkerSuppliesTable
+        markers(int): rows in prtMarkerTable
+
+    Returns:
+        table(dict): OID tuple -> value
+    """
+    table = {}
+    table[PRINTER_MIB + (5, 1, 1, 19, 1)] = Counter32(alerts)
+    table[PRINTER_MIB + (16, 5, 1, 2, 1, 1)] = OctetString('Ready')
+    for marker in range(1, markers + 1):
+        table[PRINTER_MIB + (10, 2, 1, 4, 1, marker)] = Counter32(100000*marker + 2345)
+    for index in range(1, supplies + 1):
+        name = SUPPLIES[(index - 1) % len(SUPPLIES)]
+        table[PRINTER_MIB + (11, 1, 1, 6, 1, index)] = OctetString(name + ' {HP 89X}')
+        table[PRINTER_MIB + (11, 1, 1, 8, 1, index)] = Integer(100)
+        table[PRINTER_MIB + (11, 1, 1, 9, 1, index)] = Integer(97*index % 101)
+    for index in range(1, alerts + 1):
+        table[PRINTER_MIB + (18, 1, 1, 2, 1, index)] = Integer(3 if index % 4 == 0 else 4)
+        table[PRINTER_MIB + (18, 1, 1, 8, 1, index)] = OctetString(ALERTS[index % len(ALERTS)])
+        table[ALERT_TIME + (index,)] = TimeTicks(1000*index)
+    return table
+
+def addresses(agents, first=FIRST_ADDRESS):
+    """
+    Returns the loopback addresses of the agents
+    """
+    start = ip_address(first)
+    return [str(start + number) for number in range(agents)]
+
+
+class Agent(asyncio.DatagramProtocol):
+    """
+    One simulated printer, answering on its own address
+
+    Args:
+        fleet(Fleet): the shared tables and settings
+        number(int): agent number, sets the model, room and uptime
+        online(bool): False if the agent never answers
+    """
+
+    def __init__(self, fleet, number, online=True):
+        self.fleet = fleet
+        self.online = online
+        self.transport = None
+        self.encoded = {}
+        self.booted = time.monotonic() - 3600*(number % 500)
+        self.values = {SYS_DESCR: OctetString(MODELS[number % len(MODELS)] % number),
+                       SYS_OBJECT_ID: ObjectIdentifier(OBJECT_IDS[number % len(OBJECT_IDS)]),
+                       SYS_LOCATION: OctetString('Building,%i,%04i' % (number//100, number)),
+                       PRINTER_NAME: OctetString('PRINTER%05i' % number)}
+        #An alert can not be older than the agent, so the alert times of the
+        #table are clamped to the uptime of recently booted agents
+        uptime = int((time.monotonic() - self.booted)*100)
+        for name, value in fleet.table.items():
+            if name[:-1] == ALERT_TIME and int(value) > uptime:
+                self.values[name] = TimeTicks(uptime)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        fleet = self.fleet
+        if not self.online or (fleet.loss and fleet.random.random() < fleet.loss):
+            return
+        response = fleet.respond(self, data)
+        if response is None:
+            return
+        if fleet.latency:
+            fleet.loop.call_later(fleet.latency, self.transport.sendto, response, address)
+        else:
+            self.transport.sendto(response, address)
+
+    def get(self, name):
+        """
+        Returns the value of an OID tuple, or None if the agent has no such object
+        """
+        if name == SYS_UPTIME:
+            return TimeTicks(int((time.monotonic() - self.booted)*100))
+        value = self.values.get(name)
+        if value is None:
+            value = self.fleet.table.get(name)
+        return value
+
+    def next(self, name):
+        """
+        Returns the OID tuple following name, or None at the end of the MIB view
+        """
+        names = self.fleet.names
+        position = bisect_right(names, name)
+        return names[position] if position < len(names) else None
+
+
+class Fleet:
+    """
+    The agents served by one process, sharing one table
+
+    Args:
+        agents(list): loopback addresses of the agents
+        port(int): UDP port of the agents
+        latency(float): seconds before each answer is sent
+        loss(float): fraction of the requests dropped
+        offline(float): fraction of the agents which never answer
+        table(dict): OID tuple -> value, see printer_table
+        seed(int): seed of the losses and of the offline agents
+    """
+
+    def __init__(self, agents, port=161, latency=0.0, loss=0.0, offline=0.0, table=None, seed=0):
+        self.addresses = agents
+        self.port = port
+        self.latency = latency
+        self.loss = loss
+        self.offline = offline
+        self.table = printer_table() if table is None else table
+        self.names = sorted(set(self.table) | {SYS_DESCR, SYS_OBJECT_ID, SYS_UPTIME,
+                                               SYS_LOCATION, PRINTER_NAME})
+        self.random = random.Random(seed)
+        self.encoded = {}
+        self.loop = None
+        self.transports = []
+
+    async def start(self, loop):
+        """
+        Opens the socket of every agent
+        """
+        self.loop = loop
+        for address in self.addresses:
+            number = int(ip_address(address)) - int(ip_address(FIRST_ADDRESS))
+            agent = Agent(self, number, self.random.random() >= self.offline)
+            transport, _ = await loop.create_datagram_endpoint(
+                    lambda: agent, local_addr=(address, self.port))
+            self.transports.append(transport)
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+
+    def respond(self, agent, message):
+        """
+        Returns the encoded response to an SNMP request, or None if it can not be decoded
+        """
+        try:
+            version = int(api.decodeMessageVersion(message))
+            module = api.protoModules[version]
+            request, _ = decoder.decode(message, asn1Spec=module.Message())
+        except (PyAsn1Error, KeyError):
+            return None
+        pdu = module.apiMessage.getPDU(request)
+        names = [tuple(name) for name, _ in module.apiPDU.getVarBinds(pdu)]
+        get = pdu.isSameTypeWith(module.GetRequestPDU())
+        if get:
+            var_binds = [(name, agent.get(name)) for name in names]
+        elif pdu.isSameTypeWith(module.GetNextRequestPDU()):
+            var_binds = [self._next(agent, name) for name in names]
+        elif version and pdu.isSameTypeWith(module.GetBulkRequestPDU()):
+            non_repeaters = int(module.apiBulkPDU.getNonRepeaters(pdu))
+            max_repetitions = int(module.apiBulkPDU.getMaxRepetitions(pdu))
+            var_binds = [self._next(agent, name) for name in names[:non_repeaters]]
+            row = names[non_repeaters:]
+            for _ in range(max_repetitions):
+                if not row or len(var_binds) + len(row) > MAX_RESPONSE_VAR_BINDS:
+                    break
+                answers = [self._next(agent, name) for name in row]
+                var_binds += answers
+                if all(value is None for _, value in answers):
+                    break
+                row = [name for name, _ in answers]
+        else:
+            return None
+        error_status = error_index = 0
+        encoded = []
+        for position, (name, value) in enumerate(var_binds):
+            if value is not None:
+                encoded.append(self._var_bind(agent, name, value))
+            elif version:
+                encoded.append(_tlv(0x30, _oid(name) + (NO_SUCH_OBJECT if get else END_OF_MIB_VIEW)))
+            else:
+                #SNMPv1 fails the whole request on the first missing object
+                error_status, error_index = 2, position + 1
+                encoded = [_tlv(0x30, _oid(name) + NULL) for name in names]
+                break
+        community = bytes(module.apiMessage.getCommunity(request))
+        request_id = int(module.apiPDU.getRequestID(pdu))
+        return _tlv(0x30, encoder.encode(Integer(version)) + encoder.encode(OctetString(community))
+                    + _tlv(GET_RESPONSE, encoder.encode(Integer(request_id))
+                           + encoder.encode(Integer(error_status))
+                           + encoder.encode(Integer(error_index))
+                           + _tlv(0x30, b''.join(encoded))))
+
+    def _var_bind(self, agent, name, value):
+        """
+        Returns the encoded varBind. The values of the table and of the
+        agents do not change, so they are encoded once.
+        """
+        if name == SYS_UPTIME:
+            return _tlv(0x30, _oid(name) + encoder.encode(value))
+        cache = agent.encoded if name in agent.values else self.encoded
+        var_bind = cache.get(name)
+        if var_bind is None:
+            var_bind = cache[name] = _tlv(0x30, _oid(name) + encoder.encode(value))
+        return var_bind
+
+    def _next(self, agent, name):
+        following = agent.next(name)
+        if following is None:
+            return name, None
+        return following, agent.get(following)
+
+@lru_cache(maxsize=None)
+def _oid(name):
+    return encoder.encode(ObjectName(name))
+
+def _tlv(tag, content):
+    """
+    Returns a BER tag, length and content
+    """
+    length = len(content)
+    if length < 0x80:
+        return bytes((tag, length)) + content
+    length = length.to_bytes((length.bit_length() + 7)//8, 'big')
+    return bytes((tag, 0x80 | len(length))) + length + content
+
+def _raise_file_limit():
+    #Every agent has its own socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def serve(fleet):
+    """
+    Serves the agents of fleet until the process is stopped. Prints
+    ready when all the agents are listening.
+    """
+    _raise_file_limit()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(fleet.start(loop))
+    print('ready %i agents' % len(fleet.addresses), flush=True)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.close()
+
+def start_fleet(agents, workers=1, port=161, latency=0.0, loss=0.0, offline=0.0,
+                alerts=10, supplies=4, markers=1):
+    """
+    Starts the agents in worker processes, and waits until they are all listening
+
+    Returns:
+        processes(list): the worker processes, for stop_fleet
+    """
+    processes = []
+    for worker in range(workers):
+        first = ip_address(FIRST_ADDRESS) + worker*agents//workers
+        count = (worker + 1)*agents//workers - worker*agents//workers
+        processes.append(subprocess.Popen(
+                [sys.executable, abspath(__file__), '--agents', str(count), '--first', str(first),
+                 '--port', str(port), '--latency', str(latency), '--loss', str(loss),
+                 '--offline', str(offline), '--alerts', str(alerts), '--supplies', str(supplies),
+                 '--markers', str(markers), '--seed', str(worker)],
+                stdout=subprocess.PIPE, universal_newlines=True))
+    for process in processes:
+        if not process.stdout.readline().startswith('ready'):
+            stop_fleet(processes)
+            raise RuntimeError('The simulated agents could not be started')
+    return processes
+
+def stop_fleet(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-n', '--agents', type=int, default=100, help='Number of agents')
+    parser.add_argument('--first', default=FIRST_ADDRESS, help='Address of the first agent')
+    parser.add_argument('-p', '--port', type=int, default=161, help='UDP port of the agents')
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+        help='Seconds before each answer is sent')
+    parser.add_argument('--loss', type=float, default=0.0, help='Fraction of requests dropped')
+    parser.add_argument('--offline', type=float, default=0.0,
+        help='Fraction of agents which never answer')
+    parser.add_argument('--alerts', type=int, default=10, help='Rows in prtAlertTable')
+    parser.add_argument('--supplies', type=int, default=4, help='Rows in prtMarkerSuppliesTable')
+    parser.add_argument('--markers', type=int, default=1, help='Rows in prtMarkerTable')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the losses and offline agents')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argparser()
+    serve(Fleet(addresses(args.agents, args.first), args.port, args.latency, args.loss,
+                args.offline, printer_table(args.alerts, args.supplies, args.markers), args.seed))
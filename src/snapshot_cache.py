@@ -0,0 +1,228 @@
+#!python3
+"""
+Shared on-disk cache of the latest results from the printers.
+
+The command line tools query the printers every time they run, so
+operators running them at the same time send the same queries to the
+fleet. The results are kept in snapshot_cache.db instead, an SQLite
+database in WAL mode which any number of processes read and write at once,
+one row per printer and field:
+
+    reachable   True if the printer answers, from check_online.py and printer_status.py
+    status      PrinterStatus, from printer_status.py and exporter.py
+    alerts      (online, room, every alert unfiltered), from printer_monitor.py
+    page_count  (page count, reason), from printer_stats.py
+
+A value is served while it is younger than the --max-age of the tool, or
+the TTL of its field in snapshot_ttls in config.py. Only the printers
+without a fresh value are queried, and printers another process is
+querying already are waited for instead of queried again.
+
+The values are stored as JSON, the records as their class name and fields,
+and only the record classes in RECORDS are made from them. Every user of
+the tools can write the file, so nothing in it is ever run.
+"""
+__all__ = ['SnapshotCache', 'TTLS', 'RECORDS']
+import json
+import sqlite3
+import time
+from os.path import dirname, join
+
+import config as cfg
+from records import Alert, PrinterStatus, SupplyLevel
+
+#Seconds the values of each field are served for, unless --max-age is given
+TTLS = {'reachable': 60, 'status': 300, 'alerts': 60, 'page_count': 3600}
+TTLS.update(getattr(cfg, 'snapshot_ttls', {}))
+
+#Longest time to wait for the printers another process is querying,
+#after which they are queried here
+CLAIM_TIMEOUT = 30
+
+#Seconds between looks for the values another process is fetching
+CLAIM_POLL = 0.2
+
+#The records the values may hold, by class name
+RECORDS = {record.__name__: record for record in (Alert, PrinterStatus, SupplyLevel)}
+
+
+def _default(value):
+    if type(value) in RECORDS.values():
+        return {'__record__': type(value).__name__, 'fields': value._asdict()}
+    raise TypeError('%r can not be cached' % (value,))
+
+def _record(entry):
+    if '__record__' in entry:
+        return RECORDS[entry['__record__']](**entry['fields'])
+    return entry
+
+def _dumps(value):
+    """
+    Returns the JSON text of a value, made of the records in RECORDS, lists,
+    dicts, strings, numbers, booleans and None. Tuples are read back as lists.
+    """
+    return json.dumps(value, default=_default)
+
+def _loads(text):
+    """
+    Returns the value of JSON text from _dumps.
+    Raises ValueError if it is not JSON or names a record not in RECORDS.
+    """
+    try:
+        return json.loads(text, object_hook=_record)
+    except (KeyError, TypeError) as error:
+        raise ValueError('Not a cached value: %r' % error)
+
+
+class SnapshotCache:
+    """
+    SQLite backed cache of the values of each printer and field.
+
+    Args:
+        path(str): database file, created if it does not exist
+
+    Example:
+        cache = SnapshotCache()
+        for printer, online in cache.serve('reachable', cfg.printers,
+                                           lambda printers: probe(printers).items()):
+            print(printer, online)
+    """
+
+    def __init__(self, path=join(dirname(__file__), 'snapshot_cache.db')):
+        self.db = sqlite3.connect(path, timeout=10)
+        with self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                                   printer TEXT NOT NULL,
+                                   field TEXT NOT NULL,
+                                   value TEXT NOT NULL,
+                                   fetched REAL NOT NULL,
+                                   PRIMARY KEY (printer, field))''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS claims (
+                                   printer TEXT NOT NULL,
+                                   field TEXT NOT NULL,
+                                   claimed REAL NOT NULL,
+                                   PRIMARY KEY (printer, field))''')
+
+    def get(self, field, printers, max_age=None, now=None):
+        """
+        Returns a dict printer -> value of the printers with a value younger
+        than max_age seconds, or the TTL of the field
+        """
+        now = time.time() if now is None else now
+        max_age = TTLS.get(field, 0) if max_age is None else max_age
+        printers = set(printers)
+        values = {}
+        for printer, value in self.db.execute(
+                'SELECT printer, value FROM snapshots WHERE field = ? AND fetched >= ?',
+                (field, now - max_age)):
+            if printer in printers:
+                try:
+                    values[printer] = _loads(value)
+                except ValueError:
+                    #Written by an older version, or not by these tools, fetched again
+                    pass
+        return values
+
+    def put(self, field, values, now=None):
+        """
+        Stores the values just fetched
+
+        Args:
+            field(str): e.g status
+            values(dict): printer -> value
+        """
+        now = time.time() if now is None else now
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+                                [(printer, field, _dumps(value), now)
+                                 for printer, value in values.items()])
+            self.db.executemany('DELETE FROM claims WHERE printer = ? AND field = ?',
+                                [(printer, field) for printer in values])
+
+    def claim(self, field, printers, now=None):
+        """
+        Marks the printers as being queried by this process
+
+        Returns:
+            claimed(list): the printers no other process is querying
+        """
+        now = time.time() if now is None else now
+        claimed = []
+        with self.db:
+            #Claims of processes which died or gave up
+            self.db.execute('DELETE FROM claims WHERE claimed < ?', (now - CLAIM_TIMEOUT,))
+            for printer in printers:
+                cursor = self.db.execute('INSERT OR IGNORE INTO claims VALUES (?, ?, ?)',
+                                         (printer, field, now))
+                if cursor.rowcount:
+                    claimed.append(printer)
+        return claimed
+
+    def release(self, field, printers):
+        """
+        Drops the claims of printers which were not fetched after all
+        """
+        with self.db:
+            self.db.executemany('DELETE FROM claims WHERE printer = ? AND field = ?',
+                                [(printer, field) for printer in printers])
+
+    def claimed(self, field, printers):
+        """
+        Returns the printers another process is still querying
+        """
+        printers = set(printers)
+        return [printer for printer, in self.db.execute(
+                    'SELECT printer FROM claims WHERE field = ? AND claimed >= ?',
+                    (field, time.time() - CLAIM_TIMEOUT))
+                if printer in printers]
+
+    def serve(self, field, printers, fetch, max_age=None):
+        """
+        Generator of (printer, value) for all the printers. The fresh values
+        in the cache come first, then the values of the other printers as
+        they are fetched, then the values fetched by other processes.
+
+        Args:
+            field(str): e.g status
+            printers(list): printer names
+            fetch(function): called with the printers to query, returns an
+                iterable of (printer, value), e.g iter_all
+            max_age(float): oldest value served in seconds, default the TTL of the field
+        """
+        fresh = self.get(field, printers, max_age)
+        for printer in printers:
+            if printer in fresh:
+                yield printer, fresh[printer]
+        stale = [printer for printer in printers if printer not in fresh]
+        if not stale:
+            return
+        started = time.time()
+        mine = self.claim(field, stale, started)
+        try:
+            for printer, value in self._fetch(field, fetch, mine):
+                yield printer, value
+        finally:
+            self.release(field, mine)
+        others = [printer for printer in stale if printer not in mine]
+        deadline = time.monotonic() + CLAIM_TIMEOUT
+        while others:
+            #Any value stored since the claims were made is fresh enough
+            fetched = self.get(field, others, time.time() - started)
+            for printer in others:
+                if printer in fetched:
+                    yield printer, fetched[printer]
+            others = [printer for printer in others if printer not in fetched]
+            if not others or time.monotonic() > deadline or not self.claimed(field, others):
+                break
+            time.sleep(CLAIM_POLL)
+        for printer, value in self._fetch(field, fetch, others):
+            yield printer, value
+
+    def _fetch(self, field, fetch, printers):
+        if not printers:
+            return
+        for printer, value in fetch(printers):
+            self.put(field, {printer: value})
+            yield printer, value
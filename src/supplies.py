@@ -0,0 +1,95 @@
+#!python3
+"""
+Layout of the marker supplies table (prtMarkerSuppliesTable) of the printers.
+
+Printers have different supplies in different orders, e.g a mono printer
+only has a black toner, so the table is walked once to find the index,
+description and max capacity of every supply. The layout does not change,
+so it is kept in supply_layout.json and later polls only GET the
+prtMarkerSuppliesLevel of the known indexes.
+
+The walk and GET are done by printer_mibs.async_get_supplies and
+printer_mibs.async_get_printer_status.
+"""
+__all__ = ['COLUMNS', 'SupplyLayouts', 'layout_from_rows', 'level_queries', 'make_supplies']
+from os.path import dirname, join
+
+import json_state
+from records import SupplyLevel
+
+#The prtMarkerSuppliesTable columns walked to find the layout
+COLUMNS = [('Printer-MIB', 'prtMarkerSuppliesDescription', 1),
+           ('Printer-MIB', 'prtMarkerSuppliesMaxCapacity', 1),
+           ('Printer-MIB', 'prtMarkerSuppliesLevel', 1)]
+
+
+class SupplyLayouts:
+    """
+    The supply layout of every printer, kept in a JSON file. A layout is a
+    list of [prtMarkerSuppliesIndex, description, max capacity].
+
+    Args:
+        path(str): JSON file, created when the first layout is stored
+    """
+
+    def __init__(self, path=join(dirname(__file__), 'supply_layout.json')):
+        self.path = path
+        self.layouts = json_state.load(path)
+
+    def get(self, printer):
+        """
+        Returns the layout of a printer, or None if it is not known
+        """
+        return self.layouts.get(printer)
+
+    def set(self, printer, layout):
+        """
+        Stores the layout of a printer
+        """
+        if self.layouts.get(printer) != layout:
+            self.layouts[printer] = layout
+            self._save(printer)
+
+    def forget(self, printer):
+        """
+        Drops the layout of a printer, e.g after its supplies have changed
+        """
+        if self.layouts.pop(printer, None) is not None:
+            self._save(printer)
+
+    def _save(self, printer):
+        """
+        Writes the layout of the printer over the file, keeping the layouts
+        other processes have stored meanwhile
+        """
+        def merge(layouts):
+            if printer in self.layouts:
+                layouts[printer] = self.layouts[printer]
+            else:
+                layouts.pop(printer, None)
+        try:
+            self.layouts = json_state.update(self.path, merge, indent=4, sort_keys=True)
+        except OSError:
+            #Without a writable file the layouts are only kept for this run
+            pass
+
+def layout_from_rows(rows):
+    """
+    Makes the layout from the rows of a COLUMNS walk, keyed by prtMarkerSuppliesIndex
+    """
+    return [[index[0], description.split('{')[0].strip(), int(max_capacity)]
+            for index, (description, max_capacity, _) in sorted(rows.items())
+            if description is not None and max_capacity is not None]
+
+def level_queries(layout):
+    """
+    Returns the prtMarkerSuppliesLevel queries of the supplies in a layout
+    """
+    return [('Printer-MIB', 'prtMarkerSuppliesLevel', 1, index) for index, _, _ in layout]
+
+def make_supplies(layout, levels):
+    """
+    Makes SupplyLevel records from a layout and the levels of its supplies
+    """
+    return [SupplyLevel(description, None if level is None else int(level), max_capacity)
+            for (_, description, max_capacity), level in zip(layout, levels)]
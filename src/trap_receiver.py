@@ -0,0 +1,145 @@
+#!python3
+"""
+Receiver of the SNMP traps and informs sent by the printers.
+
+Printers send a Printer-MIB printerV2Alert trap when a critical alert is
+added to prtAlertTable. The varBinds are decoded with the compiled MIBs in
+dstdirectory, and every trap is handed to a callback as a Trap record,
+with the sender matched by address to the printers in config.py.
+monitoring_webhook.py --daemon --traps checks the printer as soon as its
+trap arrives, so alerts are reported within a second and the polls are
+only a slow reconciliation of missed traps.
+
+The printers have to be set up to send traps to this host, on trap_port
+in config.py, with trap_community. Port 162 needs root.
+
+Usage:
+    python trap_receiver.py
+    python trap_receiver.py --port 1162
+"""
+__all__ = ['TrapReceiver', 'decode']
+import asyncio
+from argparse import ArgumentParser
+
+from pysnmp.carrier.asyncio.dgram import udp
+from pysnmp.entity import config, engine
+from pysnmp.entity.rfc3413 import ntfrcv
+from pysnmp.smi import view
+from pysnmp.smi.error import SmiError
+from pysnmp.smi.rfc1902 import ObjectIdentity
+
+import config as cfg
+import dns_cache
+from mib_bundle import mib_sources
+from records import Trap
+
+PORT = getattr(cfg, 'trap_port', 162)
+COMMUNITY = getattr(cfg, 'trap_community', 'public')
+
+SNMP_TRAP_OID = ('SNMPv2-MIB', 'snmpTrapOID')
+
+
+def _symbol(object_identity, mib_view):
+    """
+    Returns ('MIB-name::variable', indexes) of an OID, or the dotted OID and
+    () if the compiled MIBs do not have it
+    """
+    try:
+        mib_name, variable, indexes = object_identity.resolveWithMib(mib_view).getMibSymbol()
+    except SmiError:
+        return str(object_identity), ()
+    #Indexes are the sub-ids of the table rows, or an OID for the trap itself
+    return '%s::%s' % (mib_name, variable), tuple(index.prettyPrint() for index in indexes)
+
+def decode(var_binds, mib_view):
+    """
+    Decodes the varBinds of a notification
+
+    Returns:
+        name(str): the notification, e.g Printer-MIB::printerV2Alert
+        alert_index(int): prtAlertIndex of a Printer-MIB alert, else None
+        values(dict): 'MIB-name::variable' -> value of the other varBinds
+    """
+    name = None
+    alert_index = None
+    values = {}
+    for oid, value in var_binds:
+        symbol, indexes = _symbol(ObjectIdentity(oid), mib_view)
+        if symbol == '%s::%s' % SNMP_TRAP_OID:
+            name = _symbol(ObjectIdentity(value), mib_view)[0]
+            continue
+        if symbol.startswith('Printer-MIB::prtAlert') and indexes:
+            alert_index = int(indexes[-1])
+        values[symbol] = value.prettyPrint()
+    return name, alert_index, values
+
+
+class TrapReceiver:
+    """
+    Listens for traps and informs on the asyncio event loop
+
+    Args:
+        callback(function): called with a Trap for every notification received
+        printers(list): printer names, the senders are matched to them by address
+        port(int): UDP port to listen on
+        community(str): community of the traps accepted
+
+    Example:
+        receiver = TrapReceiver(print, cfg.printers)
+        receiver.start()
+        asyncio.get_event_loop().run_forever()
+    """
+
+    def __init__(self, callback, printers, port=PORT, community=COMMUNITY):
+        self.callback = callback
+        self.port = port
+        self.community = community
+        self.update(printers)
+        self.engine = None
+        self.mib_view = None
+
+    def update(self, printers):
+        """
+        Sets the printers traps are accepted from, e.g after config.py has been reloaded
+        """
+        self.printers = {address: printer for printer, address
+                         in dns_cache.resolve_all(printers).items() if address is not None}
+
+    def start(self, address='0.0.0.0'):
+        """
+        Opens the socket. Traps are received while the event loop runs.
+        """
+        self.engine = engine.SnmpEngine()
+        config.addTransport(self.engine, udp.domainName,
+                            udp.UdpTransport().openServerMode((address, self.port)))
+        config.addV1System(self.engine, 'printers', self.community)
+        mib_builder = self.engine.getMibBuilder()
+        mib_builder.addMibSources(*mib_sources())
+        mib_builder.loadModules('SNMPv2-MIB', 'Printer-MIB')
+        self.mib_view = view.MibViewController(mib_builder)
+        ntfrcv.NotificationReceiver(self.engine, self._received)
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.transportDispatcher.closeDispatcher()
+            self.engine = None
+
+    def _received(self, snmp_engine, state_reference, context_engine_id, context_name,
+                  var_binds, context=None):
+        address = snmp_engine.observer.getExecutionContext(
+                'rfc3412.receiveMessage:request')['transportAddress'][0]
+        name, alert_index, values = decode(var_binds, self.mib_view)
+        self.callback(Trap(self.printers.get(address, address), name, alert_index, values))
+
+def argparser():
+    parser = ArgumentParser(usage=__doc__)
+    parser.add_argument('-p', '--port',
+        type=int, default=PORT,
+        help='UDP port to listen on')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = argparser()
+    receiver = TrapReceiver(print, cfg.printers, args.port)
+    receiver.start()
+    asyncio.get_event_loop().run_forever()